@@ -1,24 +1,147 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, Header, Query
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Header, Query, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import CursorType, ReadPreference, ReturnDocument, UpdateOne, monitoring
+from pymongo.errors import BulkWriteError, CollectionInvalid, DuplicateKeyError, OperationFailure
+from bson import ObjectId
+from bson.errors import InvalidId
 import os
+import json
+import asyncio
+import time
 import logging
+import math
+import threading
+import calendar
+import csv
+import io
+import hashlib
+import heapq
+import re
+import unicodedata
+from collections import Counter, OrderedDict, deque
+from functools import lru_cache
 from pathlib import Path
 from pydantic import BaseModel, Field, EmailStr
-from typing import List, Optional
+from typing import Dict, List, Optional
 import uuid
-from datetime import datetime, timedelta
+import base64
+from datetime import date, datetime, timedelta
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
 import bcrypt
 import jwt
+import numpy as np
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+
+MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', '100'))
+MONGO_MIN_POOL_SIZE = int(os.environ.get('MONGO_MIN_POOL_SIZE', '0'))
+MONGO_MAX_IDLE_TIME_MS = int(os.environ.get('MONGO_MAX_IDLE_TIME_MS', '0'))  # 0: keep idle connections
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.environ.get('MONGO_WAIT_QUEUE_TIMEOUT_MS', '0'))  # 0: wait for a connection indefinitely
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', '30000'))
+MONGO_COMPRESSORS = os.environ.get('MONGO_COMPRESSORS', '')  # e.g. "zstd,snappy,zlib"; zstd and snappy need their python packages
+# Dashboard, analytics, reports and insights can tolerate replication lag
+MONGO_ANALYTICS_READ_PREFERENCE = os.environ.get('MONGO_ANALYTICS_READ_PREFERENCE', 'primary')
+
+READ_PREFERENCES = {
+    "primary": ReadPreference.PRIMARY,
+    "primaryPreferred": ReadPreference.PRIMARY_PREFERRED,
+    "secondary": ReadPreference.SECONDARY,
+    "secondaryPreferred": ReadPreference.SECONDARY_PREFERRED,
+    "nearest": ReadPreference.NEAREST,
+}
+
+class PoolStats(monitoring.ConnectionPoolListener):
+    """Connection pool counters summed over all servers, for metrics and health.
+    Events arrive on driver threads, hence the lock."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = Counter()
+
+    def _add(self, **changes):
+        with self._lock:
+            self._counts.update(changes)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            counts = dict(self._counts)
+        return {
+            "max_size": MONGO_MAX_POOL_SIZE,
+            "open": counts.get("open", 0),
+            "in_use": counts.get("in_use", 0),
+            "waiting": counts.get("waiting", 0),
+            "checkout_timeouts": counts.get("checkout_timeouts", 0),
+            "checkout_failures": counts.get("checkout_failures", 0),
+            "cleared": counts.get("cleared", 0)
+        }
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self._add(cleared=1)
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._add(open=1)
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._add(open=-1)
+
+    def connection_check_out_started(self, event):
+        self._add(waiting=1)
+
+    def connection_check_out_failed(self, event):
+        if event.reason == monitoring.ConnectionCheckOutFailedReason.TIMEOUT:
+            self._add(waiting=-1, checkout_timeouts=1)
+        else:
+            self._add(waiting=-1, checkout_failures=1)
+
+    def connection_checked_out(self, event):
+        self._add(waiting=-1, in_use=1)
+
+    def connection_checked_in(self, event):
+        self._add(in_use=-1)
+
+pool_stats = PoolStats()
+
+def mongo_client_options() -> dict:
+    options = {
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        "event_listeners": [pool_stats],
+    }
+    if MONGO_MAX_IDLE_TIME_MS:
+        options["maxIdleTimeMS"] = MONGO_MAX_IDLE_TIME_MS
+    if MONGO_WAIT_QUEUE_TIMEOUT_MS:
+        options["waitQueueTimeoutMS"] = MONGO_WAIT_QUEUE_TIMEOUT_MS
+    if MONGO_COMPRESSORS:
+        options["compressors"] = MONGO_COMPRESSORS
+    return options
+
+client = AsyncIOMotorClient(mongo_url, **mongo_client_options())
 db = client[os.environ['DB_NAME']]
+analytics_db = client.get_database(
+    os.environ['DB_NAME'],
+    read_preference=READ_PREFERENCES[MONGO_ANALYTICS_READ_PREFERENCE]
+)
 
 JWT_SECRET = os.environ.get('JWT_SECRET', 'default_secret_key')
 EMERGENT_LLM_KEY = os.environ.get('EMERGENT_LLM_KEY', '')
@@ -62,8 +185,17 @@ class UserSearchResponse(BaseModel):
 class TokenResponse(BaseModel):
     access_token: str
     token_type: str = "bearer"
+    refresh_token: Optional[str] = None
+    expires_in: Optional[int] = None  # access token lifetime in seconds
     user: UserResponse
 
+class RefreshRequest(BaseModel):
+    refresh_token: str
+
+class PasswordChange(BaseModel):
+    current_password: str
+    new_password: str
+
 # Wallet Models
 class WalletCreate(BaseModel):
     name: str
@@ -94,6 +226,26 @@ class WalletUpdate(BaseModel):
 class WalletInvite(BaseModel):
     email: str
 
+class WalletBulkInvite(BaseModel):
+    emails: List[str] = Field(..., min_length=1, max_length=50)
+
+class WalletBulkInviteResult(BaseModel):
+    invited: List[str] = []
+    already_member: List[str] = []
+    already_invited: List[str] = []
+    not_found: List[str] = []
+
+class WalletInvitationResponse(BaseModel):
+    id: str
+    wallet_id: str
+    wallet_name: str
+    inviter_id: str
+    inviter_name: str
+    invitee_id: str
+    status: str  # "pending", "accepted" or "declined"
+    created_at: datetime
+    responded_at: Optional[datetime] = None
+
 # Transaction Models
 class TransactionCreate(BaseModel):
     wallet_id: str
@@ -114,13 +266,62 @@ class TransactionResponse(BaseModel):
     emoji: str
     note: Optional[str] = None
     created_at: datetime
+    updated_at: Optional[datetime] = None
 
 class TransactionUpdate(BaseModel):
     amount: Optional[float] = None
+    type: Optional[str] = None
     category: Optional[str] = None
     emoji: Optional[str] = None
     note: Optional[str] = None
 
+class TransactionSearchResult(TransactionResponse):
+    # Character spans [start, end) of matched prefixes per field
+    highlights: Dict[str, List[List[int]]] = {}
+
+class SettlementMember(BaseModel):
+    user_id: str
+    name: str
+    paid: float
+    share: float
+    balance: float  # positive: is owed money, negative: owes
+
+class SettlementTransfer(BaseModel):
+    from_user_id: str
+    from_name: str
+    to_user_id: str
+    to_name: str
+    amount: float
+
+class SettlementResponse(BaseModel):
+    wallet_id: str
+    total_expense: float
+    members: List[SettlementMember]
+    transfers: List[SettlementTransfer]
+
+class InsightForecast(BaseModel):
+    category: str
+    spent: float
+    baseline: float
+    forecast: float
+
+class InsightAnomaly(BaseModel):
+    transaction_id: str
+    wallet_id: str
+    category: str
+    amount: float
+    typical: float
+    z_score: float
+    note: Optional[str] = None
+    created_at: datetime
+
+class InsightsResponse(BaseModel):
+    month: Optional[str] = None
+    computed_at: Optional[datetime] = None
+    forecast_total: float = 0
+    forecasts: List[InsightForecast] = []
+    anomalies: List[InsightAnomaly] = []
+
 # Category Models
 class CategoryCreate(BaseModel):
     name: str
@@ -153,14 +354,77 @@ class GoalResponse(BaseModel):
     created_at: datetime
 
 class GoalUpdate(BaseModel):
+    """Progress is not editable: it only moves through contributions"""
     name: Optional[str] = None
     target_amount: Optional[float] = None
-    current_amount: Optional[float] = None
     emoji: Optional[str] = None
     deadline: Optional[datetime] = None
 
 class GoalContribute(BaseModel):
     amount: float
+    wallet_id: Optional[str] = None  # wallet to move the money from
+    note: Optional[str] = None
+
+class GoalContributionResponse(BaseModel):
+    id: str
+    goal_id: str
+    user_id: str
+    amount: float
+    wallet_id: Optional[str] = None
+    transaction_id: Optional[str] = None
+    note: Optional[str] = None
+    created_at: datetime
+
+# Budget Models
+class BudgetCreate(BaseModel):
+    category: str
+    limit: float = Field(..., gt=0)
+    wallet_id: Optional[str] = None  # None = all of the user's wallets
+
+class BudgetUpdate(BaseModel):
+    limit: float = Field(..., gt=0)
+
+class BudgetResponse(BaseModel):
+    id: str
+    user_id: str
+    wallet_id: Optional[str] = None
+    category: str
+    limit: float
+    month: str
+    spent: float
+    remaining: float
+    percent: float
+    status: str  # "ok", "warning" or "exceeded"
+    created_at: datetime
+
+# Recurring Transaction Models
+class RecurringRuleCreate(BaseModel):
+    wallet_id: str
+    amount: float
+    type: str  # "income" or "expense"
+    category: str
+    emoji: str = "🔁"
+    note: Optional[str] = None
+    frequency: str  # "daily", "weekly", "monthly" or "yearly"
+    interval: int = Field(1, ge=1, le=365)
+    start_at: Optional[datetime] = None
+    end_at: Optional[datetime] = None
+
+class RecurringRuleResponse(BaseModel):
+    id: str
+    wallet_id: str
+    user_id: str
+    amount: float
+    type: str
+    category: str
+    emoji: str
+    note: Optional[str] = None
+    frequency: str
+    interval: int
+    next_run_at: datetime
+    end_at: Optional[datetime] = None
+    active: bool
+    created_at: datetime
 
 # AI Chat Models
 class ChatMessage(BaseModel):
@@ -175,6 +439,274 @@ class ChatResponse(BaseModel):
     response: str
     timestamp: datetime
 
+# ================== METRICS ==================
+
+# Process-local counters, exposed by GET /api/metrics
+metrics: Counter = Counter()
+
+# ================== CACHE ==================
+
+# Where cache invalidations are broadcast: "memory" (single worker), "mongo" or "redis"
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'memory')
+CACHE_BUS_COLLECTION = os.environ.get('CACHE_BUS_COLLECTION', 'cache_invalidations')
+CACHE_BUS_CAPPED_SIZE = int(os.environ.get('CACHE_BUS_CAPPED_SIZE', str(8 * 1024 * 1024)))
+CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL', 'redis://localhost:6379/0')
+CACHE_REDIS_CHANNEL = os.environ.get('CACHE_REDIS_CHANNEL', 'cenny_grosz:cache')
+
+class TTLCache:
+    """Small in-process LRU cache with per-entry expiry"""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict = OrderedDict()
+        self._generations: dict = {}
+
+    def get(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def generation(self, key):
+        """Taken before loading a value for key and passed on to set(): a pop
+        or clear in between turns that set into a no-op, so an invalidation
+        that lands while the value is read cannot be overwritten with it"""
+        if len(self._generations) >= self.maxsize:
+            # Fills that never reached set(); dropping them only skips their set
+            self._generations.clear()
+        return self._generations.setdefault(key, object())
+
+    def set(self, key, value, generation=None):
+        if generation is not None:
+            if self._generations.get(key) is not generation:
+                return
+            del self._generations[key]
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key):
+        self._data.pop(key, None)
+        self._generations.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+        self._generations.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+class InvalidationBus:
+    """Delivers cache invalidations to every worker.
+
+    The base implementation is in-process: buses sharing the same ``broker``
+    list see each other's messages, which is enough for a single worker and
+    lets several simulated workers be wired together without any service.
+    """
+
+    def __init__(self, broker: Optional[list] = None):
+        self.origin = uuid.uuid4().hex
+        self._caches = {}
+        self._broker = broker if broker is not None else []
+        self._broker.append(self)
+
+    def register(self, namespace: str, cache: TTLCache):
+        self._caches[namespace] = cache
+
+    def dispatch(self, namespace: str, keys: List[str]):
+        cache = self._caches.get(namespace)
+        if cache is not None:
+            for key in keys:
+                cache.pop(key)
+
+    def clear_all(self):
+        for cache in self._caches.values():
+            cache.clear()
+
+    async def publish(self, namespace: str, keys: List[str]):
+        for bus in self._broker:
+            bus.dispatch(namespace, keys)
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+class MongoInvalidationBus(InvalidationBus):
+    """Broadcasts invalidations through a capped collection tailed by every worker"""
+
+    def __init__(self, database, collection_name: str = CACHE_BUS_COLLECTION, size: int = CACHE_BUS_CAPPED_SIZE):
+        super().__init__()
+        self._db = database
+        self._collection_name = collection_name
+        self._size = size
+        self._task = None
+
+    async def start(self):
+        if self._collection_name not in await self._db.list_collection_names():
+            try:
+                await self._db.create_collection(self._collection_name, capped=True, size=self._size)
+            except CollectionInvalid:
+                pass
+        await self._announce()
+        self._task = asyncio.create_task(self._listen())
+
+    async def _announce(self):
+        # A tailable cursor that matches nothing dies immediately, so make sure there is a recent message
+        await self._db[self._collection_name].insert_one({
+            "origin": self.origin,
+            "namespace": "",
+            "keys": [],
+            "ts": datetime.utcnow()
+        })
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+
+    async def publish(self, namespace: str, keys: List[str]):
+        self.dispatch(namespace, keys)
+        await self._db[self._collection_name].insert_one({
+            "origin": self.origin,
+            "namespace": namespace,
+            "keys": list(keys),
+            "ts": datetime.utcnow()
+        })
+
+    async def _listen(self):
+        collection = self._db[self._collection_name]
+        since = datetime.utcnow()
+        reconnecting = False
+        while True:
+            try:
+                if reconnecting:
+                    await self._announce()
+                # Re-reading the small capped collection is harmless, invalidations are idempotent
+                cursor = collection.find({"ts": {"$gte": since - timedelta(seconds=5)}}, cursor_type=CursorType.TAILABLE_AWAIT)
+                if reconnecting:
+                    # Messages may have been missed while the cursor was dead
+                    self.clear_all()
+                # An empty await-data getMore ends the async for, but the cursor stays alive
+                while cursor.alive:
+                    async for message in cursor:
+                        since = max(since, message["ts"])
+                        if message["origin"] != self.origin:
+                            self.dispatch(message["namespace"], message["keys"])
+                logger.warning("Cache invalidation cursor closed, reconnecting")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Cache invalidation listener error: {str(e)}")
+            reconnecting = True
+            await asyncio.sleep(1)
+
+class RedisInvalidationBus(InvalidationBus):
+    """Broadcasts invalidations over Redis pub/sub (works with any Redis-compatible server)"""
+
+    def __init__(self, url: str = CACHE_REDIS_URL, channel: str = CACHE_REDIS_CHANNEL):
+        super().__init__()
+        self._url = url
+        self._channel = channel
+        self._redis = None
+        self._task = None
+
+    async def start(self):
+        # Optional dependency, only needed for CACHE_BACKEND=redis
+        import redis.asyncio as aioredis
+
+        self._redis = aioredis.from_url(self._url)
+        pubsub = self._redis.pubsub()
+        await pubsub.subscribe(self._channel)
+        self._task = asyncio.create_task(self._listen(pubsub))
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+        if self._redis:
+            await self._redis.close()
+
+    async def publish(self, namespace: str, keys: List[str]):
+        self.dispatch(namespace, keys)
+        await self._redis.publish(self._channel, json.dumps({"origin": self.origin, "namespace": namespace, "keys": list(keys)}))
+
+    async def _listen(self, pubsub):
+        while True:
+            try:
+                async for message in pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    try:
+                        data = json.loads(message["data"])
+                    except ValueError:
+                        continue
+                    if data.get("origin") != self.origin:
+                        self.dispatch(data["namespace"], data["keys"])
+                logger.warning("Cache invalidation subscription closed, reconnecting")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Cache invalidation listener error: {str(e)}")
+            await asyncio.sleep(1)
+            try:
+                await pubsub.reset()
+                pubsub = self._redis.pubsub()
+                await pubsub.subscribe(self._channel)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Cache invalidation resubscribe failed: {str(e)}")
+                continue
+            # Messages published while unsubscribed are lost
+            self.clear_all()
+
+def create_invalidation_bus(backend: str) -> InvalidationBus:
+    if backend == "mongo":
+        return MongoInvalidationBus(db)
+    if backend == "redis":
+        return RedisInvalidationBus()
+    if backend != "memory":
+        raise RuntimeError(f"Unknown CACHE_BACKEND: {backend}")
+    return InvalidationBus()
+
+invalidation_bus = create_invalidation_bus(CACHE_BACKEND)
+
+class SharedCache(TTLCache):
+    """TTLCache whose invalidations reach the same cache in every worker"""
+
+    def __init__(self, namespace: str, maxsize: int, ttl: float, bus: Optional[InvalidationBus] = None):
+        super().__init__(maxsize, ttl)
+        self.namespace = namespace
+        self.bus = bus or invalidation_bus
+        self.bus.register(namespace, self)
+
+    async def invalidate(self, *keys: str):
+        if keys:
+            await self.bus.publish(self.namespace, list(keys))
+
+USER_CACHE_TTL = float(os.environ.get('USER_CACHE_TTL', '60'))
+WALLET_ACCESS_CACHE_TTL = float(os.environ.get('WALLET_ACCESS_CACHE_TTL', '60'))
+DASHBOARD_CACHE_TTL = float(os.environ.get('DASHBOARD_CACHE_TTL', '30'))
+
+# User documents by id, read on every authenticated request
+_user_cache = SharedCache("users", maxsize=50000, ttl=USER_CACHE_TTL)
+
+# Set of wallet ids each user owns or is a member of
+_wallet_access_cache = SharedCache("wallet_access", maxsize=50000, ttl=WALLET_ACCESS_CACHE_TTL)
+
+# Owner + member ids of each wallet
+_wallet_members_cache = SharedCache("wallet_members", maxsize=50000, ttl=WALLET_ACCESS_CACHE_TTL)
+
+# Computed dashboard stats per user
+_dashboard_cache = SharedCache("dashboard", maxsize=20000, ttl=DASHBOARD_CACHE_TTL)
+
 # ================== AUTH HELPERS ==================
 
 def hash_password(password: str) -> str:
@@ -183,31 +715,205 @@ def hash_password(password: str) -> str:
 def verify_password(password: str, hashed: str) -> bool:
     return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
 
-def create_token(user_id: str) -> str:
+ACCESS_TOKEN_TTL_MINUTES = int(os.environ.get('ACCESS_TOKEN_TTL_MINUTES', '15'))
+REFRESH_TOKEN_TTL_DAYS = int(os.environ.get('REFRESH_TOKEN_TTL_DAYS', '30'))
+REVOCATION_FILTER_CAPACITY = int(os.environ.get('REVOCATION_FILTER_CAPACITY', '100000'))
+
+def create_token(user_id: str, session_id: str, token_type: str = "access") -> str:
+    now = datetime.utcnow()
+    ttl = timedelta(minutes=ACCESS_TOKEN_TTL_MINUTES) if token_type == "access" else timedelta(days=REFRESH_TOKEN_TTL_DAYS)
     payload = {
         "user_id": user_id,
-        "exp": datetime.utcnow() + timedelta(days=30)
+        "type": token_type,
+        "jti": uuid.uuid4().hex,
+        "sid": session_id,
+        "iat": now,
+        "exp": now + ttl
     }
     return jwt.encode(payload, JWT_SECRET, algorithm="HS256")
 
-async def get_current_user(authorization: str = Header(None)):
+def create_tokens(user_id: str, session_id: Optional[str] = None) -> dict:
+    """Access and refresh token pair; a session id ties together every token
+    issued by refreshing, so that logout can revoke all of them at once"""
+    session_id = session_id or uuid.uuid4().hex
+    return {
+        "access_token": create_token(user_id, session_id),
+        "refresh_token": create_token(user_id, session_id, "refresh"),
+        "expires_in": ACCESS_TOKEN_TTL_MINUTES * 60
+    }
+
+class BloomFilter:
+    """Fixed-size probabilistic set: no false negatives, and false positives at
+    about ``error_rate`` while it holds up to ``capacity`` keys"""
+
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        self.size = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key: str):
+        for position in self._positions(key):
+            self._bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key: str) -> bool:
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+class RevocationList:
+    """Revoked token (jti) and session (sid) ids from logouts and reuse detection.
+
+    Checks are answered in-process by a Bloom filter; only its positives are
+    confirmed against db.revoked_tokens, whose TTL index drops entries once the
+    token would have expired anyway. Revocations reach other workers through the
+    invalidation bus, and the filter is rebuilt periodically to shed expired ids.
+    """
+
+    namespace = "revoked_tokens"
+
+    def __init__(self, capacity: int, bus: InvalidationBus):
+        self.capacity = capacity
+        self.bus = bus
+        self._filter = BloomFilter(capacity)
+        self._loading: Optional[list] = None
+        bus.register(self.namespace, self)
+
+    async def load(self):
+        self._loading = []
+        try:
+            bloom = BloomFilter(self.capacity)
+            async for entry in db.revoked_tokens.find({"expires_at": {"$gt": datetime.utcnow()}}, {"_id": 1}):
+                bloom.add(entry["_id"])
+            # Revocations that arrived while reading
+            for token_id in self._loading:
+                bloom.add(token_id)
+            self._filter = bloom
+        finally:
+            self._loading = None
+
+    async def revoke(self, token_id: str, expires_at: datetime) -> bool:
+        """Revoke an id; False when it had already been revoked"""
+        try:
+            await db.revoked_tokens.insert_one({"_id": token_id, "expires_at": expires_at})
+        except DuplicateKeyError:
+            return False
+        await self.bus.publish(self.namespace, [token_id])
+        return True
+
+    async def is_revoked(self, token_id: str) -> bool:
+        if token_id not in self._filter:
+            return False
+        metrics["revocation_filter_positives"] += 1
+        entry = await db.revoked_tokens.find_one(
+            {"_id": token_id, "expires_at": {"$gt": datetime.utcnow()}},
+            {"_id": 1}
+        )
+        return entry is not None
+
+    # Invalidation bus hooks
+    def pop(self, token_id: str):
+        self._filter.add(token_id)
+        if self._loading is not None:
+            self._loading.append(token_id)
+
+    def clear(self):
+        # Messages may have been missed; reload from the collection
+        asyncio.get_running_loop().create_task(self.load())
+
+revocation_list = RevocationList(REVOCATION_FILTER_CAPACITY, invalidation_bus)
+
+async def get_current_session(authorization: str = Header(None)) -> tuple:
+    """The authenticated user and the claims of their access token"""
     if not authorization:
         raise HTTPException(status_code=401, detail="Brak autoryzacji")
     
+    return await authenticate_token(authorization.replace("Bearer ", ""))
+
+async def get_current_user(session: tuple = Depends(get_current_session)):
+    return session[0]
+
+async def get_user_from_token(token: str) -> dict:
+    user, _ = await authenticate_token(token)
+    return user
+
+async def authenticate_token(token: str, token_type: str = "access") -> tuple:
     try:
-        token = authorization.replace("Bearer ", "")
         payload = jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
-        user_id = payload.get("user_id")
-        
-        user = await db.users.find_one({"id": user_id})
-        if not user:
-            raise HTTPException(status_code=401, detail="Użytkownik nie znaleziony")
-        
-        return user
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token wygasł")
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Nieprawidłowy token")
+    
+    # Tokens issued before refresh tokens existed carry no type and count as access tokens
+    if payload.get("type", "access") != token_type:
+        raise HTTPException(status_code=401, detail="Nieprawidłowy token")
+    
+    user_id = payload.get("user_id")
+    user = _user_cache.get(user_id)
+    if user is None:
+        generation = _user_cache.generation(user_id)
+        user = await db.users.find_one({"id": user_id})
+        if not user:
+            raise HTTPException(status_code=401, detail="Użytkownik nie znaleziony")
+        _user_cache.set(user_id, user, generation)
+    
+    valid_after = user.get("tokens_valid_after")
+    if valid_after and payload.get("iat", 0) < calendar.timegm(valid_after.utctimetuple()):
+        raise HTTPException(status_code=401, detail="Token unieważniony")
+    # A used refresh token is caught by refresh_tokens itself, which treats the reuse as theft
+    token_ids = (payload.get("jti"), payload.get("sid")) if token_type == "access" else (payload.get("sid"),)
+    for token_id in token_ids:
+        if token_id and await revocation_list.is_revoked(token_id):
+            raise HTTPException(status_code=401, detail="Token unieważniony")
+    
+    return user, payload
+
+# ================== MONEY ==================
+
+# Amounts, balances and goal progress are stored as integer grosze; the API
+# keeps exchanging PLN as floats and converts at the boundary.
+
+def to_minor(amount: float) -> int:
+    # JSON bodies may carry NaN, Infinity or amounts too large to quantize
+    if not math.isfinite(amount):
+        raise HTTPException(status_code=400, detail="Nieprawidłowa kwota")
+    try:
+        return int(Decimal(str(amount)).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP) * 100)
+    except InvalidOperation:
+        raise HTTPException(status_code=400, detail="Nieprawidłowa kwota")
+
+def from_minor(amount: int) -> float:
+    return amount / 100
+
+def sum_minor(amounts) -> int:
+    return int(np.fromiter(amounts, dtype=np.int64).sum())
+
+def summarize_transactions(transactions: List[dict]) -> dict:
+    """Exact income/expense totals and per-category expense sums in grosze"""
+    count = len(transactions)
+    if not count:
+        return {"income": 0, "expense": 0, "expense_categories": {}}
+
+    amounts = np.fromiter((tx["amount"] for tx in transactions), dtype=np.int64, count=count)
+    is_income = np.fromiter((tx["type"] == "income" for tx in transactions), dtype=bool, count=count)
+    is_expense = ~is_income
+
+    categories, inverse = np.unique(
+        np.array([tx["category"] for tx in transactions], dtype=object)[is_expense].astype(str),
+        return_inverse=True
+    )
+    category_totals = np.zeros(len(categories), dtype=np.int64)
+    np.add.at(category_totals, inverse, amounts[is_expense])
+
+    return {
+        "income": int(amounts[is_income].sum()),
+        "expense": int(amounts[is_expense].sum()),
+        "expense_categories": {str(c): int(t) for c, t in zip(categories, category_totals)}
+    }
 
 # ================== HELPER FUNCTIONS ==================
 
@@ -227,102 +933,853 @@ async def get_wallet_with_members(wallet: dict) -> dict:
     wallet["members_details"] = members_details
     return wallet
 
-async def get_transaction_with_user(tx: dict) -> dict:
-    """Enrich transaction with user name"""
-    user = await db.users.find_one({"id": tx.get("user_id")})
-    if user:
-        tx["user_name"] = user["name"]
-    return tx
+# Membership lives in wallets.members and is mirrored into wallet_members, one
+# document per (wallet, user). With WALLET_MEMBERSHIP_SOURCE=collection access
+# checks read the mirror, which stays an indexed lookup however large the
+# shared wallets grow.
+WALLET_MEMBERSHIP_SOURCE = os.environ.get('WALLET_MEMBERSHIP_SOURCE', 'array')  # "array" or "collection"
 
-# ================== AUTH ROUTES ==================
+async def get_user_wallet_ids(user_id: str) -> frozenset:
+    """Ids of all wallets the user can access, served from cache when possible"""
+    wallet_ids = _wallet_access_cache.get(user_id)
+    if wallet_ids is None:
+        generation = _wallet_access_cache.generation(user_id)
+        if WALLET_MEMBERSHIP_SOURCE == "collection":
+            owned = db.wallets.find({"owner_id": user_id}, {"_id": 0, "id": 1})
+            joined = db.wallet_members.find({"user_id": user_id}, {"_id": 0, "wallet_id": 1})
+            wallet_ids = frozenset([w["id"] async for w in owned] + [m["wallet_id"] async for m in joined])
+        else:
+            cursor = db.wallets.find(
+                {"$or": [{"owner_id": user_id}, {"members": user_id}]},
+                {"_id": 0, "id": 1}
+            )
+            wallet_ids = frozenset([w["id"] async for w in cursor])
+        _wallet_access_cache.set(user_id, wallet_ids, generation)
+    return wallet_ids
 
-@api_router.post("/auth/register", response_model=TokenResponse)
-async def register(user_data: UserCreate):
-    # Check if user exists
-    existing = await db.users.find_one({"email": user_data.email.lower()})
-    if existing:
-        raise HTTPException(status_code=400, detail="Użytkownik z tym emailem już istnieje")
-    
-    # Create user
-    user_id = str(uuid.uuid4())
-    user = {
-        "id": user_id,
-        "email": user_data.email.lower(),
-        "password_hash": hash_password(user_data.password),
-        "name": user_data.name,
-        "created_at": datetime.utcnow()
-    }
-    await db.users.insert_one(user)
-    
-    # Create default personal wallet
-    wallet = {
-        "id": str(uuid.uuid4()),
-        "name": "Mój portfel",
-        "emoji": "💰",
-        "balance": 0.0,
-        "is_shared": False,
-        "owner_id": user_id,
-        "members": [],
-        "member_joined": {},
-        "created_at": datetime.utcnow()
-    }
-    await db.wallets.insert_one(wallet)
-    
-    token = create_token(user_id)
-    return TokenResponse(
-        access_token=token,
-        user=UserResponse(
-            id=user_id,
-            email=user["email"],
-            name=user["name"],
-            created_at=user["created_at"]
-        )
+async def add_wallet_member(wallet_id: str, user_id: str) -> bool:
+    """Atomically add a member; False when they already belong to the wallet"""
+    joined_at = datetime.utcnow()
+    result = await db.wallets.update_one(
+        {"id": wallet_id, "owner_id": {"$ne": user_id}, "members": {"$ne": user_id}},
+        {
+            "$addToSet": {"members": user_id},
+            "$set": {f"member_joined.{user_id}": joined_at}
+        }
     )
-
-@api_router.post("/auth/login", response_model=TokenResponse)
-async def login(credentials: UserLogin):
-    user = await db.users.find_one({"email": credentials.email.lower()})
-    if not user or not verify_password(credentials.password, user["password_hash"]):
-        raise HTTPException(status_code=401, detail="Nieprawidłowy email lub hasło")
-    
-    token = create_token(user["id"])
-    return TokenResponse(
-        access_token=token,
-        user=UserResponse(
-            id=user["id"],
-            email=user["email"],
-            name=user["name"],
-            created_at=user["created_at"]
-        )
+    if not result.modified_count:
+        return False
+    await db.wallet_members.update_one(
+        {"wallet_id": wallet_id, "user_id": user_id},
+        {"$setOnInsert": {"joined_at": joined_at}},
+        upsert=True
     )
+    return True
 
-@api_router.get("/auth/me", response_model=UserResponse)
-async def get_me(current_user: dict = Depends(get_current_user)):
-    return UserResponse(
-        id=current_user["id"],
-        email=current_user["email"],
-        name=current_user["name"],
-        created_at=current_user["created_at"]
+async def remove_wallet_member(wallet_id: str, user_id: str) -> bool:
+    """Atomically remove a member; False when they were not in the wallet"""
+    result = await db.wallets.update_one(
+        {"id": wallet_id, "members": user_id},
+        {
+            "$pull": {"members": user_id},
+            "$unset": {f"member_joined.{user_id}": ""}
+        }
     )
+    await db.wallet_members.delete_one({"wallet_id": wallet_id, "user_id": user_id})
+    return bool(result.modified_count)
 
-# ================== USER SEARCH ROUTES ==================
+async def get_wallet_participants(wallet_id: str) -> frozenset:
+    """Ids of the owner and all members of a wallet, served from cache when possible"""
+    participants = _wallet_members_cache.get(wallet_id)
+    if participants is None:
+        generation = _wallet_members_cache.generation(wallet_id)
+        wallet = await db.wallets.find_one({"id": wallet_id}, {"_id": 0, "owner_id": 1, "members": 1})
+        if not wallet:
+            return frozenset()
+        participants = frozenset([wallet["owner_id"], *wallet.get("members", [])])
+        _wallet_members_cache.set(wallet_id, participants, generation)
+    return participants
 
-@api_router.get("/users/search", response_model=List[UserSearchResponse])
-async def search_users(q: str = Query(..., min_length=3), current_user: dict = Depends(get_current_user)):
-    """Search users by email or name for inviting to shared wallets"""
-    users = await db.users.find({
-        "$and": [
-            {"id": {"$ne": current_user["id"]}},  # Exclude current user
-            {"$or": [
-                {"email": {"$regex": q, "$options": "i"}},
-                {"name": {"$regex": q, "$options": "i"}}
-            ]}
-        ]
-    }).limit(10).to_list(10)
-    
-    return [UserSearchResponse(id=u["id"], email=u["email"], name=u["name"]) for u in users]
+async def invalidate_wallet_access(*user_ids: str):
+    await _wallet_access_cache.invalidate(*user_ids)
+    await _dashboard_cache.invalidate(*user_ids)
 
-# ================== WALLET ROUTES ==================
+async def invalidate_wallet_membership(wallet_id: str, *user_ids: str):
+    """Invalidate cached membership after members join or leave a wallet"""
+    await _wallet_members_cache.invalidate(wallet_id)
+    await invalidate_wallet_access(*user_ids)
+
+async def invalidate_wallet_dashboards(wallet_id: str):
+    """Invalidate dashboards of everyone who sees the wallet"""
+    await _dashboard_cache.invalidate(*await get_wallet_participants(wallet_id))
+
+def encode_cursor(*values) -> str:
+    """Opaque keyset pagination cursor"""
+    return base64.urlsafe_b64encode(json.dumps(jsonable_encoder(values)).encode("utf-8")).decode("ascii")
+
+def decode_cursor(cursor: str) -> list:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        if not isinstance(values, list):
+            raise ValueError(cursor)
+        return values
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Nieprawidłowy kursor")
+
+def created_before(cursor: str) -> dict:
+    """Query clause for documents older than a (created_at, id) cursor"""
+    values = decode_cursor(cursor)
+    try:
+        created_at, tx_id = values
+        created_at = datetime.fromisoformat(created_at)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Nieprawidłowy kursor")
+    return {"$or": [
+        {"created_at": {"$lt": created_at}},
+        {"created_at": created_at, "id": {"$lt": tx_id}}
+    ]}
+
+def wallet_response(wallet: dict) -> WalletResponse:
+    return WalletResponse(**{**wallet, "balance": from_minor(wallet["balance"])})
+
+def transaction_response(tx: dict) -> TransactionResponse:
+    return TransactionResponse(**{**tx, "amount": from_minor(tx["amount"])})
+
+def balance_delta(tx: dict) -> int:
+    """Signed effect of a transaction on its wallet balance, in grosze"""
+    return tx["amount"] if tx["type"] == "income" else -tx["amount"]
+
+def wallet_increments(transactions: List[dict], sign: int = 1) -> dict:
+    """$inc of a wallet's balance and per-author spend counters for transactions"""
+    inc = {"balance": sign * sum_minor(balance_delta(tx) for tx in transactions)}
+    for tx in transactions:
+        if tx["type"] == "expense":
+            key = f"spent_by.{tx['user_id']}"
+            inc[key] = inc.get(key, 0) + sign * tx["amount"]
+    return inc
+
+def goal_response(goal: dict) -> GoalResponse:
+    return GoalResponse(**{
+        **goal,
+        "target_amount": from_minor(goal["target_amount"]),
+        "current_amount": from_minor(goal["current_amount"])
+    })
+
+async def attach_user_names(transactions: List[dict]) -> List[dict]:
+    """Enrich transactions with author names using a single users query"""
+    user_ids = list({tx["user_id"] for tx in transactions})
+    names = {
+        u["id"]: u["name"]
+        async for u in db.users.find({"id": {"$in": user_ids}}, {"_id": 0, "id": 1, "name": 1})
+    }
+    for tx in transactions:
+        if tx["user_id"] in names:
+            tx["user_name"] = names[tx["user_id"]]
+    return transactions
+
+# ================== REALTIME EVENTS ==================
+
+WS_SEND_QUEUE_SIZE = int(os.environ.get('WS_SEND_QUEUE_SIZE', '100'))
+
+class WalletEventConnection:
+    """One WebSocket client with its own bounded send queue"""
+
+    def __init__(self, websocket: WebSocket, user_id: str):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.wallet_ids = set()
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=WS_SEND_QUEUE_SIZE)
+
+    async def writer(self):
+        while True:
+            await self.websocket.send_text(await self.queue.get())
+
+class WalletEventHub:
+    """Fans out wallet events to the WebSocket connections of this process.
+
+    Publishing only enqueues the message, so write handlers never wait on
+    slow clients; a client whose queue fills up is disconnected and is
+    expected to reconnect and refetch. Members joining or leaving a wallet
+    reach the connections in every worker through the invalidation bus.
+    """
+
+    namespace = "wallet_subscriptions"
+
+    def __init__(self, bus: InvalidationBus):
+        self.bus = bus
+        self._by_wallet: Dict[str, set] = {}
+        self._by_user: Dict[str, set] = {}
+        bus.register(self.namespace, self)
+
+    def connect(self, connection: WalletEventConnection):
+        self._by_user.setdefault(connection.user_id, set()).add(connection)
+
+    def disconnect(self, connection: WalletEventConnection):
+        self.unsubscribe(connection, list(connection.wallet_ids))
+        connections = self._by_user.get(connection.user_id)
+        if connections is not None:
+            connections.discard(connection)
+            if not connections:
+                del self._by_user[connection.user_id]
+
+    def subscribe(self, connection: WalletEventConnection, wallet_ids):
+        for wallet_id in wallet_ids:
+            connection.wallet_ids.add(wallet_id)
+            self._by_wallet.setdefault(wallet_id, set()).add(connection)
+
+    def unsubscribe(self, connection: WalletEventConnection, wallet_ids):
+        for wallet_id in wallet_ids:
+            connection.wallet_ids.discard(wallet_id)
+            connections = self._by_wallet.get(wallet_id)
+            if connections is not None:
+                connections.discard(connection)
+                if not connections:
+                    del self._by_wallet[wallet_id]
+
+    async def subscribe_user(self, user_id: str, wallet_id: str):
+        await self.bus.publish(self.namespace, [f"+{user_id}:{wallet_id}"])
+
+    async def unsubscribe_user(self, user_id: str, wallet_id: str):
+        await self.bus.publish(self.namespace, [f"-{user_id}:{wallet_id}"])
+
+    # Invalidation bus hooks
+    def pop(self, change: str):
+        user_id, wallet_id = change[1:].split(":", 1)
+        update = self.subscribe if change[0] == "+" else self.unsubscribe
+        for connection in list(self._by_user.get(user_id, ())):
+            update(connection, [wallet_id])
+
+    def clear(self):
+        # Changes may have been missed; drop wallets the users no longer see
+        asyncio.get_running_loop().create_task(self.resync())
+
+    async def resync(self):
+        for user_id, connections in list(self._by_user.items()):
+            wallet_ids = await get_user_wallet_ids(user_id)
+            for connection in list(connections):
+                self.unsubscribe(connection, connection.wallet_ids - wallet_ids)
+
+    async def publish(self, wallet_id: str, event_type: str, data: dict):
+        connections = self._by_wallet.get(wallet_id)
+        if connections:
+            self._send(connections, {"type": event_type, "wallet_id": wallet_id, "data": data})
+
+    async def publish_user(self, user_id: str, event_type: str, data: dict):
+        """Send an event to every connection of one user, whatever their subscriptions"""
+        connections = self._by_user.get(user_id)
+        if connections:
+            self._send(connections, {"type": event_type, "data": data})
+
+    def _send(self, connections, event: dict):
+        message = json.dumps(jsonable_encoder(event), ensure_ascii=False)
+        for connection in list(connections):
+            try:
+                connection.queue.put_nowait(message)
+            except asyncio.QueueFull:
+                logger.warning(f"Dropping slow WebSocket client of user {connection.user_id}")
+                self.disconnect(connection)
+                asyncio.create_task(connection.websocket.close(code=1013))
+
+wallet_events = WalletEventHub(invalidation_bus)
+
+@api_router.websocket("/ws")
+async def wallet_events_socket(websocket: WebSocket, token: str = Query(...)):
+    """Push wallet events to the client.
+
+    The connection is subscribed to all of the user's wallets on connect.
+    Clients may send {"action": "subscribe" | "unsubscribe", "wallet_ids": [...]}
+    to narrow or extend the set, and {"action": "ping"} as a keepalive.
+    """
+    try:
+        user = await get_user_from_token(token)
+    except HTTPException as e:
+        await websocket.close(code=4401, reason=e.detail)
+        return
+
+    await websocket.accept()
+    connection = WalletEventConnection(websocket, user["id"])
+    wallet_events.connect(connection)
+    wallet_events.subscribe(connection, await get_user_wallet_ids(user["id"]))
+    writer = asyncio.create_task(connection.writer())
+
+    try:
+        await websocket.send_json({"type": "subscribed", "wallet_ids": sorted(connection.wallet_ids)})
+        while True:
+            message = await websocket.receive_json()
+            action = message.get("action") if isinstance(message, dict) else None
+            if action == "ping":
+                await connection.queue.put(json.dumps({"type": "pong"}))
+            elif action in ("subscribe", "unsubscribe"):
+                requested = set(message.get("wallet_ids") or [])
+                if action == "subscribe":
+                    wallet_events.subscribe(connection, requested & await get_user_wallet_ids(user["id"]))
+                else:
+                    wallet_events.unsubscribe(connection, requested)
+                await connection.queue.put(json.dumps({"type": "subscribed", "wallet_ids": sorted(connection.wallet_ids)}))
+    except (WebSocketDisconnect, ValueError):
+        pass
+    finally:
+        wallet_events.disconnect(connection)
+        writer.cancel()
+
+# ================== JOB QUEUE ==================
+
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', '2'))
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', '5'))
+JOB_LEASE_SECONDS = float(os.environ.get('JOB_LEASE_SECONDS', '60'))
+JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', '1'))
+
+class JobQueue:
+    """Durable queue for work the client does not need to wait for.
+
+    Jobs are stored in db.jobs and drained by asyncio workers in every
+    process. A claimed job is leased by pushing its run_at into the future,
+    so jobs of a crashed worker are picked up again once the lease expires.
+    Handlers must therefore be idempotent.
+    """
+
+    def __init__(self):
+        self._handlers = {}
+        self._workers: List[asyncio.Task] = []
+        self._wakeup = asyncio.Event()
+
+    def handler(self, kind: str):
+        def register(func):
+            self._handlers[kind] = func
+            return func
+        return register
+
+    async def enqueue(self, kind: str, payload: dict):
+        now = datetime.utcnow()
+        await db.jobs.insert_one({
+            "_id": str(uuid.uuid4()),
+            "kind": kind,
+            "payload": payload,
+            "status": "pending",
+            "attempts": 0,
+            "run_at": now,
+            "created_at": now
+        })
+        metrics["jobs_enqueued"] += 1
+        self._wakeup.set()
+
+    async def _claim(self) -> Optional[dict]:
+        now = datetime.utcnow()
+        return await db.jobs.find_one_and_update(
+            {"status": {"$in": ["pending", "running"]}, "run_at": {"$lte": now}},
+            {"$set": {"status": "running", "run_at": now + timedelta(seconds=JOB_LEASE_SECONDS)}, "$inc": {"attempts": 1}},
+            sort=[("run_at", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def _run(self, job: dict):
+        handler = self._handlers.get(job["kind"])
+        try:
+            if handler is None:
+                raise RuntimeError(f"No handler for job kind {job['kind']}")
+            await handler(job["payload"])
+        except Exception as e:
+            if job["attempts"] >= JOB_MAX_ATTEMPTS:
+                metrics["jobs_failed"] += 1
+                logger.error(f"Job {job['kind']} {job['_id']} failed permanently: {str(e)}")
+                await db.jobs.update_one({"_id": job["_id"]}, {"$set": {"status": "failed", "error": str(e)}})
+            else:
+                metrics["jobs_retried"] += 1
+                retry_at = datetime.utcnow() + timedelta(seconds=2 ** job["attempts"])
+                await db.jobs.update_one({"_id": job["_id"]}, {"$set": {"status": "pending", "run_at": retry_at, "error": str(e)}})
+            return
+        metrics["jobs_completed"] += 1
+        await db.jobs.delete_one({"_id": job["_id"]})
+
+    async def _worker(self):
+        while True:
+            try:
+                self._wakeup.clear()
+                job = await self._claim()
+                if job is None:
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), JOB_POLL_INTERVAL)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                await self._run(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Job worker error: {str(e)}")
+                await asyncio.sleep(JOB_POLL_INTERVAL)
+
+    def start(self, workers: int = JOB_WORKERS):
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(workers)]
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+
+job_queue = JobQueue()
+
+# ================== DERIVED AGGREGATES ==================
+
+# Monthly rollups in db.rollups hold the amount and count of transactions per
+# (wallet, month, type, category, author). Budgets keep a running spent counter
+# per month. Both are maintained incrementally by apply_transaction_effects.
+
+BUDGET_ALERT_THRESHOLDS = (80, 100)
+
+def month_key(moment: datetime) -> str:
+    return moment.strftime("%Y-%m")
+
+APPLIED_IDS_KEPT = 50
+
+def applied_once(query: dict, update: dict, apply_id: Optional[str]) -> tuple:
+    """Guard an $inc so that it lands at most once per apply id: the target
+    document remembers the last APPLIED_IDS_KEPT ids applied to it"""
+    if apply_id is None:
+        return query, update
+    return (
+        {**query, "applied": {"$ne": apply_id}},
+        {**update, "$push": {"applied": {"$each": [apply_id], "$slice": -APPLIED_IDS_KEPT}}}
+    )
+
+async def update_rollups(transactions: List[dict], sign: int, apply_id: Optional[str] = None):
+    totals = {}
+    for tx in transactions:
+        key = (tx["wallet_id"], month_key(tx["created_at"]), tx["type"], tx["category"], tx["user_id"])
+        amount, count = totals.get(key, (0, 0))
+        totals[key] = (amount + tx["amount"], count + 1)
+    
+    try:
+        await db.rollups.bulk_write([
+            UpdateOne(
+                *applied_once(
+                    {"wallet_id": wallet_id, "month": month, "type": tx_type, "category": category, "user_id": user_id},
+                    {"$inc": {"amount": sign * amount, "count": sign * count}},
+                    apply_id
+                ),
+                upsert=True
+            )
+            for (wallet_id, month, tx_type, category, user_id), (amount, count) in totals.items()
+        ], ordered=False)
+    except BulkWriteError as e:
+        # A guarded upsert whose rollup already carries the apply id tries to insert a duplicate
+        if apply_id is None or any(err["code"] != 11000 for err in e.details["writeErrors"]):
+            raise
+
+async def _budget_scope(wallet_id: str, category: str) -> dict:
+    """Budgets that a transaction in this wallet and category counts towards"""
+    participants = await get_wallet_participants(wallet_id)
+    return {
+        "category": category,
+        "$or": [
+            {"wallet_id": wallet_id},
+            {"wallet_id": None, "user_id": {"$in": list(participants)}}
+        ]
+    }
+
+async def update_budget_spend(transactions: List[dict], sign: int, apply_id: Optional[str] = None):
+    totals = {}
+    for tx in transactions:
+        if tx["type"] == "expense":
+            key = (tx["wallet_id"], tx["category"], month_key(tx["created_at"]))
+            totals[key] = totals.get(key, 0) + tx["amount"]
+    
+    for (wallet_id, category, month), amount in totals.items():
+        scope = await _budget_scope(wallet_id, category)
+        # One budget document carries every month, so each month is applied on its own
+        month_apply_id = f"{apply_id}:{month}" if apply_id else None
+        result = await db.budgets.update_many(*applied_once(scope, {"$inc": {f"spent.{month}": sign * amount}}, month_apply_id))
+        # A repeated apply id may follow a run that died before its alerts; alerts fire once per level anyway
+        if (result.modified_count or apply_id) and sign > 0:
+            await evaluate_budget_alerts(scope, month)
+
+async def evaluate_budget_alerts(scope: dict, month: str):
+    """Emit one alert per budget, month and threshold crossed"""
+    budgets = await db.budgets.find(scope, {"_id": 0}).to_list(None)
+    for budget in budgets:
+        percent = budget_percent(budget, month)
+        crossed = [t for t in BUDGET_ALERT_THRESHOLDS if percent >= t]
+        if not crossed:
+            continue
+        level = crossed[-1]
+        # Conditional so that concurrent transactions alert only once per level
+        result = await db.budgets.update_one(
+            {"id": budget["id"], f"alerted.{month}": {"$not": {"$gte": level}}},
+            {"$set": {f"alerted.{month}": level}}
+        )
+        if not result.modified_count:
+            continue
+        alert = {
+            "id": str(uuid.uuid4()),
+            "budget_id": budget["id"],
+            "user_id": budget["user_id"],
+            "category": budget["category"],
+            "month": month,
+            "threshold": level,
+            "spent": from_minor(budget["spent"].get(month, 0)),
+            "limit": from_minor(budget["limit"]),
+            "created_at": datetime.utcnow()
+        }
+        await db.budget_alerts.insert_one(alert)
+        alert.pop("_id", None)
+        metrics["budget_alerts"] += 1
+        await wallet_events.publish_user(budget["user_id"], "budget.alert", alert)
+
+def budget_percent(budget: dict, month: str) -> float:
+    spent = budget.get("spent", {}).get(month, 0)
+    return spent / budget["limit"] * 100 if budget["limit"] > 0 else 0
+
+async def invalidate_stored_reports(transactions: List[dict]):
+    """Drop stored reports of closed months that these transactions change"""
+    current = month_key(datetime.utcnow())
+    stale = {(tx["wallet_id"], month_key(tx["created_at"])) for tx in transactions}
+    for wallet_id, month in stale:
+        if month < current:
+            await db.reports.delete_many({"month": month, "wallet_ids": wallet_id})
+
+async def apply_transaction_effects(transactions: List[dict], sign: int = 1, apply_id: Optional[str] = None):
+    """Maintain rollups, budget counters and stored reports for created (+1) or
+    removed (-1) transactions; with an apply_id, repeating the call is a no-op"""
+    if not transactions:
+        return
+    await update_rollups(transactions, sign, apply_id)
+    await update_budget_spend(transactions, sign, apply_id)
+    await invalidate_stored_reports(transactions)
+
+async def rebuild_rollups():
+    """Recompute all rollups from live and archived transactions"""
+    await db.rollups.delete_many({})
+    await db.transactions.aggregate([
+        {"$unionWith": "transactions_archive"},
+        {"$group": {
+            "_id": {
+                "wallet_id": "$wallet_id",
+                "month": {"$dateToString": {"format": "%Y-%m", "date": "$created_at"}},
+                "type": "$type",
+                "category": "$category",
+                "user_id": "$user_id"
+            },
+            "amount": {"$sum": "$amount"},
+            "count": {"$sum": 1}
+        }},
+        {"$replaceRoot": {"newRoot": {"$mergeObjects": ["$_id", {"amount": "$amount", "count": "$count"}]}}},
+        {"$merge": {
+            "into": "rollups",
+            "on": ["wallet_id", "month", "type", "category", "user_id"],
+            "whenMatched": "replace",
+            "whenNotMatched": "insert"
+        }}
+    ]).to_list(None)
+
+# ================== SEARCH ==================
+
+# Transactions carry search_tokens: the words of their note and category,
+# lowercased and with diacritics removed. Prefix queries are anchored regexes
+# on that multikey field, which an index can answer with a range scan.
+
+SEARCH_MAX_TOKENS = 64
+# Shorter prefixes match most of a user's history and would have to be sorted in memory
+SEARCH_MIN_TERM_LENGTH = 3
+
+_FOLD_EXTRA = {"ł": "l", "đ": "d", "ø": "o", "ß": "s"}
+
+@lru_cache(maxsize=4096)
+def _fold_char(char: str) -> str:
+    lower = char.lower()
+    if len(lower) != 1:
+        lower = char
+    lower = _FOLD_EXTRA.get(lower, lower)
+    return unicodedata.normalize("NFD", lower)[0]
+
+def fold_text(text: str) -> str:
+    """Lowercase and strip diacritics, keeping character positions intact"""
+    return "".join(_fold_char(c) for c in text)
+
+def search_terms(text: str) -> List[str]:
+    return re.findall(r"\w+", fold_text(text))
+
+def transaction_search_tokens(tx: dict) -> List[str]:
+    tokens = dict.fromkeys(search_terms(tx.get("category") or "") + search_terms(tx.get("note") or ""))
+    return list(tokens)[:SEARCH_MAX_TOKENS]
+
+def search_highlights(text: Optional[str], terms: List[str]) -> List[List[int]]:
+    if not text:
+        return []
+    folded = fold_text(text)
+    spans = sorted(
+        [m.start(), m.start() + len(term)]
+        for term in terms
+        for m in re.finditer(r"(?<!\w)" + re.escape(term), folded)
+    )
+    merged = []
+    for start, end in spans:
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+async def backfill_search_tokens(batch_size: int = 1000):
+    """Add search tokens to transactions written before search existed"""
+    while True:
+        transactions = await db.transactions.find(
+            {"search_tokens": {"$exists": False}},
+            {"_id": 0, "id": 1, "note": 1, "category": 1}
+        ).limit(batch_size).to_list(batch_size)
+        if not transactions:
+            return
+        await db.transactions.bulk_write([
+            UpdateOne({"id": tx["id"]}, {"$set": {"search_tokens": transaction_search_tokens(tx)}})
+            for tx in transactions
+        ], ordered=False)
+
+# ================== ARCHIVE ==================
+
+# Transactions older than ARCHIVE_AFTER_DAYS are moved to transactions_archive.
+# Rollups and wallet balances are left untouched, so dashboards and budgets do
+# not notice. The "archive" meta document holds the horizon: the archive only
+# contains transactions created before it, so reads that stay newer never
+# touch the archive.
+
+ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', '0'))
+ARCHIVE_BATCH_SIZE = int(os.environ.get('ARCHIVE_BATCH_SIZE', '1000'))
+ARCHIVE_HORIZON_CACHE_TTL = 60.0
+
+_archive_horizon_cache = SharedCache("archive_horizon", maxsize=1, ttl=ARCHIVE_HORIZON_CACHE_TTL)
+
+TRANSACTION_SORT = [("created_at", -1), ("id", -1)]
+
+async def get_archive_horizon() -> Optional[datetime]:
+    cached = _archive_horizon_cache.get("horizon")
+    if cached is None:
+        meta = await db.meta.find_one({"_id": "archive"})
+        cached = (meta["horizon"] if meta else None,)
+        _archive_horizon_cache.set("horizon", cached)
+    return cached[0]
+
+async def find_transactions_page(query: dict, limit: int, projection: Optional[dict] = None) -> List[dict]:
+    """Newest-first page of transactions, reading the archive only when the
+    page reaches back past the archive horizon"""
+    projection = projection or {"_id": 0}
+    transactions = await db.transactions.find(query, projection).sort(TRANSACTION_SORT).limit(limit).to_list(limit)
+    horizon = await get_archive_horizon()
+    if horizon is None or (len(transactions) == limit and transactions[-1]["created_at"] >= horizon):
+        return transactions
+    
+    archived = await db.transactions_archive.find(query, projection).sort(TRANSACTION_SORT).limit(limit).to_list(limit)
+    # A batch being archived can briefly exist in both collections
+    merged = {tx["id"]: tx for tx in archived}
+    merged.update((tx["id"], tx) for tx in transactions)
+    return sorted(merged.values(), key=lambda tx: (tx["created_at"], tx["id"]), reverse=True)[:limit]
+
+async def find_transaction(transaction_id: str):
+    """Look a transaction up by id; returns it with the collection holding it"""
+    transaction = await db.transactions.find_one({"id": transaction_id}, {"_id": 0})
+    if transaction:
+        return transaction, db.transactions
+    if await get_archive_horizon() is not None:
+        transaction = await db.transactions_archive.find_one({"id": transaction_id}, {"_id": 0})
+        if transaction:
+            return transaction, db.transactions_archive
+    return None, None
+
+async def archive_transactions(cutoff: datetime, batch_size: int = ARCHIVE_BATCH_SIZE):
+    """Move transactions created before ``cutoff`` to the archive"""
+    meta = await db.meta.find_one({"_id": "archive"})
+    if not meta or meta["horizon"] < cutoff:
+        await db.meta.update_one({"_id": "archive"}, {"$max": {"horizon": cutoff}}, upsert=True)
+        await _archive_horizon_cache.invalidate("horizon")
+        # Let every worker drop its cached horizon before anything moves
+        await asyncio.sleep(ARCHIVE_HORIZON_CACHE_TTL)
+    
+    while True:
+        transactions = await db.transactions.find(
+            {"created_at": {"$lt": cutoff}, "balance_pending": {"$exists": False}},
+            {"_id": 0}
+        ).sort("created_at", 1).limit(batch_size).to_list(batch_size)
+        if not transactions:
+            return
+        
+        ids = [tx["id"] for tx in transactions]
+        try:
+            await db.transactions_archive.insert_many(transactions, ordered=False)
+        except BulkWriteError as e:
+            # Copied by an earlier run that stopped before deleting
+            if any(err["code"] != 11000 for err in e.details["writeErrors"]):
+                raise
+        # Transactions deleted while being copied must not come back
+        remaining = set(await db.transactions.distinct("id", {"id": {"$in": ids}}))
+        gone = [tx_id for tx_id in ids if tx_id not in remaining]
+        if gone:
+            await db.transactions_archive.delete_many({"id": {"$in": gone}})
+        await db.transactions.delete_many({"id": {"$in": ids}})
+        logger.info(f"Archived {len(remaining)} transactions")
+
+# ================== AUTH ROUTES ==================
+
+@api_router.post("/auth/register", response_model=TokenResponse)
+async def register(user_data: UserCreate):
+    # Check if user exists
+    existing = await db.users.find_one({"email": user_data.email.lower()})
+    if existing:
+        raise HTTPException(status_code=400, detail="Użytkownik z tym emailem już istnieje")
+    
+    # Create user
+    user_id = str(uuid.uuid4())
+    user = {
+        "id": user_id,
+        "email": user_data.email.lower(),
+        "password_hash": hash_password(user_data.password),
+        "name": user_data.name,
+        "created_at": datetime.utcnow()
+    }
+    await db.users.insert_one(user)
+    
+    # Create default personal wallet
+    wallet = {
+        "id": str(uuid.uuid4()),
+        "name": "Mój portfel",
+        "emoji": "💰",
+        "balance": 0,
+        "is_shared": False,
+        "owner_id": user_id,
+        "members": [],
+        "member_joined": {},
+        "created_at": datetime.utcnow()
+    }
+    await db.wallets.insert_one(wallet)
+    await invalidate_wallet_access(user_id)
+    
+    return TokenResponse(
+        **create_tokens(user_id),
+        user=UserResponse(
+            id=user_id,
+            email=user["email"],
+            name=user["name"],
+            created_at=user["created_at"]
+        )
+    )
+
+@api_router.post("/auth/login", response_model=TokenResponse)
+async def login(credentials: UserLogin, http_request: Request):
+    # Keyed by address too, so that guessing at an account never locks its owner out
+    client_ip = rate_limit_ip(http_request.scope, dict(http_request.scope["headers"]))
+    await enforce_rate_limit(RATE_LIMIT_LOGIN_EMAIL, f"{credentials.email.lower()}|{client_ip}")
+    user = await db.users.find_one({"email": credentials.email.lower()})
+    if not user or not verify_password(credentials.password, user["password_hash"]):
+        raise HTTPException(status_code=401, detail="Nieprawidłowy email lub hasło")
+    
+    return TokenResponse(
+        **create_tokens(user["id"]),
+        user=UserResponse(
+            id=user["id"],
+            email=user["email"],
+            name=user["name"],
+            created_at=user["created_at"]
+        )
+    )
+
+def token_expiry(payload: dict) -> datetime:
+    return datetime.utcfromtimestamp(payload["exp"])
+
+async def mark_refresh_token_used(token_id: str, expires_at: datetime) -> bool:
+    """Record a refresh token as used; False when it had been used before.
+
+    Kept apart from the revocation list: every refresh adds an entry, and
+    loading those into the Bloom filter would saturate it."""
+    try:
+        await db.used_refresh_tokens.insert_one({"_id": token_id, "expires_at": expires_at})
+    except DuplicateKeyError:
+        return False
+    return True
+
+@api_router.post("/auth/refresh", response_model=TokenResponse)
+async def refresh_tokens(request: RefreshRequest):
+    """Swap a refresh token for a new token pair. Each refresh token works once;
+    presenting a used one again revokes its whole session."""
+    user, payload = await authenticate_token(request.refresh_token, "refresh")
+    if not await mark_refresh_token_used(payload["jti"], token_expiry(payload)):
+        await revocation_list.revoke(payload["sid"], datetime.utcnow() + timedelta(days=REFRESH_TOKEN_TTL_DAYS))
+        raise HTTPException(status_code=401, detail="Token unieważniony")
+    
+    return TokenResponse(
+        **create_tokens(user["id"], payload["sid"]),
+        user=UserResponse(
+            id=user["id"],
+            email=user["email"],
+            name=user["name"],
+            created_at=user["created_at"]
+        )
+    )
+
+@api_router.post("/auth/logout")
+async def logout(session: tuple = Depends(get_current_session)):
+    """Revoke the current session: this access token and every refresh token issued with it"""
+    user, payload = session
+    if payload.get("sid"):
+        await revocation_list.revoke(payload["sid"], datetime.utcnow() + timedelta(days=REFRESH_TOKEN_TTL_DAYS))
+    elif payload.get("jti"):
+        await revocation_list.revoke(payload["jti"], token_expiry(payload))
+    else:
+        # Tokens from before revocation ids carry nothing to revoke; end all earlier tokens instead
+        await db.users.update_one(
+            {"id": user["id"]},
+            {"$set": {"tokens_valid_after": datetime.utcnow().replace(microsecond=0)}}
+        )
+        await _user_cache.invalidate(user["id"])
+    return {"message": "Wylogowano"}
+
+@api_router.post("/auth/change-password", response_model=TokenResponse)
+async def change_password(data: PasswordChange, current_user: dict = Depends(get_current_user)):
+    """Change the password and invalidate every token issued so far; returns a
+    fresh token pair for the current device"""
+    if not verify_password(data.current_password, current_user["password_hash"]):
+        raise HTTPException(status_code=400, detail="Nieprawidłowe obecne hasło")
+    
+    # Whole seconds, to compare with the iat claim; tokens from this second stay valid
+    valid_after = datetime.utcnow().replace(microsecond=0)
+    await db.users.update_one(
+        {"id": current_user["id"]},
+        {"$set": {"password_hash": hash_password(data.new_password), "tokens_valid_after": valid_after}}
+    )
+    await _user_cache.invalidate(current_user["id"])
+    
+    return TokenResponse(
+        **create_tokens(current_user["id"]),
+        user=UserResponse(
+            id=current_user["id"],
+            email=current_user["email"],
+            name=current_user["name"],
+            created_at=current_user["created_at"]
+        )
+    )
+
+@api_router.get("/auth/me", response_model=UserResponse)
+async def get_me(current_user: dict = Depends(get_current_user)):
+    return UserResponse(
+        id=current_user["id"],
+        email=current_user["email"],
+        name=current_user["name"],
+        created_at=current_user["created_at"]
+    )
+
+# ================== USER SEARCH ROUTES ==================
+
+@api_router.get("/users/search", response_model=List[UserSearchResponse])
+async def search_users(q: str = Query(..., min_length=3), current_user: dict = Depends(get_current_user)):
+    """Search users by email or name for inviting to shared wallets"""
+    users = await db.users.find({
+        "$and": [
+            {"id": {"$ne": current_user["id"]}},  # Exclude current user
+            {"$or": [
+                {"email": {"$regex": q, "$options": "i"}},
+                {"name": {"$regex": q, "$options": "i"}}
+            ]}
+        ]
+    }).limit(10).to_list(10)
+    
+    return [UserSearchResponse(id=u["id"], email=u["email"], name=u["name"]) for u in users]
+
+# ================== WALLET ROUTES ==================
 
 @api_router.post("/wallets", response_model=WalletResponse)
 async def create_wallet(wallet_data: WalletCreate, current_user: dict = Depends(get_current_user)):
@@ -330,7 +1787,7 @@ async def create_wallet(wallet_data: WalletCreate, current_user: dict = Depends(
         "id": str(uuid.uuid4()),
         "name": wallet_data.name,
         "emoji": wallet_data.emoji,
-        "balance": 0.0,
+        "balance": 0,
         "is_shared": wallet_data.is_shared,
         "owner_id": current_user["id"],
         "members": [],
@@ -338,23 +1795,20 @@ async def create_wallet(wallet_data: WalletCreate, current_user: dict = Depends(
         "created_at": datetime.utcnow()
     }
     await db.wallets.insert_one(wallet)
+    await invalidate_wallet_access(current_user["id"])
+    await wallet_events.subscribe_user(current_user["id"], wallet["id"])
     wallet = await get_wallet_with_members(wallet)
-    return WalletResponse(**wallet)
+    return wallet_response(wallet)
 
 @api_router.get("/wallets", response_model=List[WalletResponse])
 async def get_wallets(current_user: dict = Depends(get_current_user)):
-    user_id = current_user["id"]
-    wallets = await db.wallets.find({
-        "$or": [
-            {"owner_id": user_id},
-            {"members": user_id}
-        ]
-    }).to_list(100)
+    wallet_ids = await get_user_wallet_ids(current_user["id"])
+    wallets = await db.wallets.find({"id": {"$in": list(wallet_ids)}}).to_list(100)
     
     result = []
     for w in wallets:
         w = await get_wallet_with_members(w)
-        result.append(WalletResponse(**w))
+        result.append(wallet_response(w))
     return result
 
 @api_router.get("/wallets/{wallet_id}", response_model=WalletResponse)
@@ -367,7 +1821,7 @@ async def get_wallet(wallet_id: str, current_user: dict = Depends(get_current_us
     if not wallet:
         raise HTTPException(status_code=404, detail="Portfel nie znaleziony")
     wallet = await get_wallet_with_members(wallet)
-    return WalletResponse(**wallet)
+    return wallet_response(wallet)
 
 @api_router.put("/wallets/{wallet_id}", response_model=WalletResponse)
 async def update_wallet(wallet_id: str, update_data: WalletUpdate, current_user: dict = Depends(get_current_user)):
@@ -379,9 +1833,10 @@ async def update_wallet(wallet_id: str, update_data: WalletUpdate, current_user:
     if updates:
         await db.wallets.update_one({"id": wallet_id}, {"$set": updates})
         wallet.update(updates)
+        await wallet_events.publish(wallet_id, "wallet.updated", updates)
     
     wallet = await get_wallet_with_members(wallet)
-    return WalletResponse(**wallet)
+    return wallet_response(wallet)
 
 @api_router.delete("/wallets/{wallet_id}")
 async def delete_wallet(wallet_id: str, current_user: dict = Depends(get_current_user)):
@@ -391,6 +1846,15 @@ async def delete_wallet(wallet_id: str, current_user: dict = Depends(get_current
     
     await db.wallets.delete_one({"id": wallet_id})
     await db.transactions.delete_many({"wallet_id": wallet_id})
+    await db.transactions_archive.delete_many({"wallet_id": wallet_id})
+    await db.recurring_rules.delete_many({"wallet_id": wallet_id})
+    await db.wallet_members.delete_many({"wallet_id": wallet_id})
+    await db.wallet_invitations.delete_many({"wallet_id": wallet_id})
+    await db.reports.delete_many({"wallet_ids": wallet_id})
+    await invalidate_wallet_membership(wallet_id, wallet["owner_id"], *wallet.get("members", []))
+    await wallet_events.publish(wallet_id, "wallet.deleted", {})
+    for participant_id in [wallet["owner_id"], *wallet.get("members", [])]:
+        await wallet_events.unsubscribe_user(participant_id, wallet_id)
     return {"message": "Portfel usunięty"}
 
 # ================== JOINT ACCOUNT / SHARED WALLET ROUTES ==================
@@ -414,21 +1878,11 @@ async def invite_to_wallet(wallet_id: str, invite_data: WalletInvite, current_us
     if invite_user["id"] == current_user["id"]:
         raise HTTPException(status_code=400, detail="Nie możesz zaprosić samego siebie")
     
-    # Check if already a member
-    if invite_user["id"] in wallet.get("members", []):
+    if not await add_wallet_member(wallet_id, invite_user["id"]):
         raise HTTPException(status_code=400, detail="Użytkownik jest już członkiem tego portfela")
-    
-    # Add to members
-    member_joined = wallet.get("member_joined", {})
-    member_joined[invite_user["id"]] = datetime.utcnow()
-    
-    await db.wallets.update_one(
-        {"id": wallet_id},
-        {
-            "$addToSet": {"members": invite_user["id"]},
-            "$set": {"member_joined": member_joined}
-        }
-    )
+    await invalidate_wallet_membership(wallet_id, invite_user["id"])
+    await wallet_events.subscribe_user(invite_user["id"], wallet_id)
+    await wallet_events.publish(wallet_id, "wallet.member_added", {"user_id": invite_user["id"], "name": invite_user["name"]})
     
     return {"message": f"Użytkownik {invite_user['name']} został dodany do portfela"}
 
@@ -475,21 +1929,11 @@ async def remove_from_wallet(wallet_id: str, member_id: str, current_user: dict
     if not wallet:
         raise HTTPException(status_code=404, detail="Portfel nie znaleziony lub brak uprawnień")
     
-    if member_id not in wallet.get("members", []):
+    if not await remove_wallet_member(wallet_id, member_id):
         raise HTTPException(status_code=404, detail="Użytkownik nie jest członkiem tego portfela")
-    
-    # Remove from members
-    member_joined = wallet.get("member_joined", {})
-    if member_id in member_joined:
-        del member_joined[member_id]
-    
-    await db.wallets.update_one(
-        {"id": wallet_id},
-        {
-            "$pull": {"members": member_id},
-            "$set": {"member_joined": member_joined}
-        }
-    )
+    await invalidate_wallet_membership(wallet_id, member_id)
+    await wallet_events.publish(wallet_id, "wallet.member_removed", {"user_id": member_id})
+    await wallet_events.unsubscribe_user(member_id, wallet_id)
     
     return {"message": "Członek został usunięty z portfela"}
 
@@ -504,20 +1948,204 @@ async def leave_wallet(wallet_id: str, current_user: dict = Depends(get_current_
     if wallet["owner_id"] == user_id:
         raise HTTPException(status_code=400, detail="Właściciel nie może opuścić portfela. Usuń portfel lub przekaż własność.")
     
-    # Remove from members
-    member_joined = wallet.get("member_joined", {})
-    if user_id in member_joined:
-        del member_joined[user_id]
+    if not await remove_wallet_member(wallet_id, user_id):
+        raise HTTPException(status_code=404, detail="Portfel nie znaleziony lub nie jesteś członkiem")
+    await invalidate_wallet_membership(wallet_id, user_id)
+    await wallet_events.unsubscribe_user(user_id, wallet_id)
+    await wallet_events.publish(wallet_id, "wallet.member_left", {"user_id": user_id})
     
-    await db.wallets.update_one(
+    return {"message": "Opuściłeś portfel"}
+
+@api_router.post("/wallets/{wallet_id}/invitations", response_model=WalletBulkInviteResult)
+async def invite_many_to_wallet(wallet_id: str, invite_data: WalletBulkInvite, current_user: dict = Depends(get_current_user)):
+    """Send pending invitations to several emails at once; invitees join on accept"""
+    wallet = await db.wallets.find_one({"id": wallet_id, "owner_id": current_user["id"]})
+    if not wallet:
+        raise HTTPException(status_code=404, detail="Portfel nie znaleziony lub brak uprawnień")
+    
+    if not wallet.get("is_shared"):
+        raise HTTPException(status_code=400, detail="Ten portfel nie jest wspólny")
+    
+    emails = list(dict.fromkeys(e.strip().lower() for e in invite_data.emails))
+    users = await db.users.find(
+        {"email": {"$in": emails}},
+        {"_id": 0, "id": 1, "email": 1}
+    ).to_list(len(emails))
+    users_by_email = {u["email"]: u for u in users}
+    pending = set(await db.wallet_invitations.distinct("invitee_id", {
+        "wallet_id": wallet_id,
+        "status": "pending",
+        "invitee_id": {"$in": [u["id"] for u in users]}
+    }))
+    members = {wallet["owner_id"], *wallet.get("members", [])}
+    
+    result = WalletBulkInviteResult()
+    invitations = []
+    now = datetime.utcnow()
+    for email in emails:
+        user = users_by_email.get(email)
+        if not user:
+            result.not_found.append(email)
+        elif user["id"] in members:
+            result.already_member.append(email)
+        elif user["id"] in pending:
+            result.already_invited.append(email)
+        else:
+            invitations.append({
+                "id": str(uuid.uuid4()),
+                "wallet_id": wallet_id,
+                "wallet_name": wallet["name"],
+                "inviter_id": current_user["id"],
+                "inviter_name": current_user["name"],
+                "invitee_id": user["id"],
+                "invitee_email": email,
+                "status": "pending",
+                "created_at": now,
+                "responded_at": None
+            })
+    
+    if invitations:
+        failed = set()
+        try:
+            await db.wallet_invitations.insert_many(invitations, ordered=False)
+        except BulkWriteError as e:
+            # Lost a race with a concurrent invite for the same person
+            if any(err["code"] != 11000 for err in e.details["writeErrors"]):
+                raise
+            failed = {err["index"] for err in e.details["writeErrors"]}
+        for i, invitation in enumerate(invitations):
+            if i in failed:
+                result.already_invited.append(invitation["invitee_email"])
+                continue
+            result.invited.append(invitation["invitee_email"])
+            await wallet_events.publish_user(
+                invitation["invitee_id"],
+                "invitation.created",
+                WalletInvitationResponse(**invitation).dict()
+            )
+    
+    return result
+
+@api_router.get("/invitations", response_model=List[WalletInvitationResponse])
+async def get_my_invitations(current_user: dict = Depends(get_current_user)):
+    """Pending wallet invitations addressed to the current user"""
+    invitations = await db.wallet_invitations.find(
+        {"invitee_id": current_user["id"], "status": "pending"},
+        {"_id": 0}
+    ).sort("created_at", -1).to_list(100)
+    return invitations
+
+async def respond_to_invitation(invitation_id: str, user_id: str, status: str) -> dict:
+    changes = {"status": status, "responded_at": datetime.utcnow()}
+    invitation = await db.wallet_invitations.find_one_and_update(
+        {"id": invitation_id, "invitee_id": user_id, "status": "pending"},
+        {"$set": changes},
+        projection={"_id": 0}
+    )
+    if not invitation:
+        raise HTTPException(status_code=404, detail="Zaproszenie nie znalezione")
+    return {**invitation, **changes}
+
+@api_router.post("/invitations/{invitation_id}/accept")
+async def accept_invitation(invitation_id: str, current_user: dict = Depends(get_current_user)):
+    user_id = current_user["id"]
+    invitation = await respond_to_invitation(invitation_id, user_id, "accepted")
+    wallet_id = invitation["wallet_id"]
+    
+    if not await add_wallet_member(wallet_id, user_id):
+        if not await db.wallets.find_one({"id": wallet_id}, {"_id": 1}):
+            raise HTTPException(status_code=404, detail="Portfel nie znaleziony")
+        return {"message": "Jesteś już członkiem tego portfela"}
+    
+    await invalidate_wallet_membership(wallet_id, user_id)
+    await wallet_events.subscribe_user(user_id, wallet_id)
+    await wallet_events.publish(wallet_id, "wallet.member_added", {"user_id": user_id, "name": current_user["name"]})
+    return {"message": f"Dołączyłeś do portfela {invitation['wallet_name']}"}
+
+@api_router.post("/invitations/{invitation_id}/decline")
+async def decline_invitation(invitation_id: str, current_user: dict = Depends(get_current_user)):
+    invitation = await respond_to_invitation(invitation_id, current_user["id"], "declined")
+    await wallet_events.publish_user(invitation["inviter_id"], "invitation.declined", {
+        "id": invitation_id,
+        "wallet_id": invitation["wallet_id"],
+        "invitee_id": invitation["invitee_id"]
+    })
+    return {"message": "Zaproszenie odrzucone"}
+
+def settle_up(balances: Dict[str, int]) -> List[tuple]:
+    """Greedy min-cash-flow: repeatedly let the largest debtor pay the largest
+    creditor. Balances must sum to zero; yields at most n - 1 transfers."""
+    creditors = [(-amount, user_id) for user_id, amount in balances.items() if amount > 0]
+    debtors = [(amount, user_id) for user_id, amount in balances.items() if amount < 0]
+    heapq.heapify(creditors)
+    heapq.heapify(debtors)
+    transfers = []
+    while creditors and debtors:
+        credit, creditor = heapq.heappop(creditors)
+        debt, debtor = heapq.heappop(debtors)
+        amount = min(-credit, -debt)
+        transfers.append((debtor, creditor, amount))
+        if -credit > amount:
+            heapq.heappush(creditors, (credit + amount, creditor))
+        if -debt > amount:
+            heapq.heappush(debtors, (debt + amount, debtor))
+    return transfers
+
+@api_router.get("/wallets/{wallet_id}/settlement", response_model=SettlementResponse)
+async def get_wallet_settlement(wallet_id: str, current_user: dict = Depends(get_current_user)):
+    """Who paid what in a shared wallet and the fewest transfers that even it out.
+    Expenses are split equally between the current owner and members; spend by
+    people who have since left still counts as paid."""
+    if wallet_id not in await get_user_wallet_ids(current_user["id"]):
+        raise HTTPException(status_code=404, detail="Portfel nie znaleziony")
+    
+    wallet = await db.wallets.find_one(
         {"id": wallet_id},
-        {
-            "$pull": {"members": user_id},
-            "$set": {"member_joined": member_joined}
-        }
+        {"_id": 0, "owner_id": 1, "members": 1, "is_shared": 1, "spent_by": 1}
     )
+    if not wallet:
+        raise HTTPException(status_code=404, detail="Portfel nie znaleziony")
+    if not wallet.get("is_shared"):
+        raise HTTPException(status_code=400, detail="Ten portfel nie jest wspólny")
     
-    return {"message": "Opuściłeś portfel"}
+    participants = sorted({wallet["owner_id"], *wallet.get("members", [])})
+    paid = {user_id: amount for user_id, amount in wallet.get("spent_by", {}).items() if amount}
+    total = sum(paid.values())
+    
+    # Split in whole grosze; the first few participants absorb the remainder
+    base, remainder = divmod(total, len(participants))
+    shares = {user_id: base + (1 if i < remainder else 0) for i, user_id in enumerate(participants)}
+    user_ids = sorted(set(participants) | set(paid))
+    balances = {user_id: paid.get(user_id, 0) - shares.get(user_id, 0) for user_id in user_ids}
+    
+    names = {
+        u["id"]: u["name"]
+        async for u in db.users.find({"id": {"$in": user_ids}}, {"_id": 0, "id": 1, "name": 1})
+    }
+    return SettlementResponse(
+        wallet_id=wallet_id,
+        total_expense=from_minor(total),
+        members=[
+            SettlementMember(
+                user_id=user_id,
+                name=names.get(user_id, ""),
+                paid=from_minor(paid.get(user_id, 0)),
+                share=from_minor(shares.get(user_id, 0)),
+                balance=from_minor(balances[user_id])
+            )
+            for user_id in user_ids
+        ],
+        transfers=[
+            SettlementTransfer(
+                from_user_id=debtor,
+                from_name=names.get(debtor, ""),
+                to_user_id=creditor,
+                to_name=names.get(creditor, ""),
+                amount=from_minor(amount)
+            )
+            for debtor, creditor, amount in settle_up(balances)
+        ]
+    )
 
 # ================== TRANSACTION ROUTES ==================
 
@@ -526,11 +2154,7 @@ async def create_transaction(tx_data: TransactionCreate, current_user: dict = De
     user_id = current_user["id"]
     
     # Verify wallet access
-    wallet = await db.wallets.find_one({
-        "id": tx_data.wallet_id,
-        "$or": [{"owner_id": user_id}, {"members": user_id}]
-    })
-    if not wallet:
+    if tx_data.wallet_id not in await get_user_wallet_ids(user_id):
         raise HTTPException(status_code=404, detail="Portfel nie znaleziony")
     
     # Validate transaction type
@@ -542,94 +2166,406 @@ async def create_transaction(tx_data: TransactionCreate, current_user: dict = De
         "id": str(uuid.uuid4()),
         "wallet_id": tx_data.wallet_id,
         "user_id": user_id,
-        "amount": abs(tx_data.amount),
+        "amount": to_minor(abs(tx_data.amount)),
         "type": tx_data.type,
         "category": tx_data.category,
         "emoji": tx_data.emoji,
         "note": tx_data.note,
         "created_at": datetime.utcnow()
     }
+    return await record_transaction(transaction, current_user["name"])
+
+async def record_transaction(transaction: dict, user_name: str) -> TransactionResponse:
+    """Insert a new transaction and apply it to its wallet and aggregates"""
+    transaction["search_tokens"] = transaction_search_tokens(transaction)
     await db.transactions.insert_one(transaction)
     
     # Update wallet balance
-    balance_change = transaction["amount"] if tx_data.type == "income" else -transaction["amount"]
-    await db.wallets.update_one(
-        {"id": tx_data.wallet_id},
-        {"$inc": {"balance": balance_change}}
+    wallet_id = transaction["wallet_id"]
+    wallet = await db.wallets.find_one_and_update(
+        {"id": wallet_id},
+        {"$inc": wallet_increments([transaction])},
+        projection={"_id": 0, "balance": 1},
+        return_document=ReturnDocument.AFTER
     )
+    await invalidate_wallet_dashboards(wallet_id)
+    await apply_transaction_effects([transaction])
     
-    transaction = await get_transaction_with_user(transaction)
-    return TransactionResponse(**transaction)
+    transaction["user_name"] = user_name
+    response = transaction_response(transaction)
+    await wallet_events.publish(wallet_id, "transaction.created", response.dict())
+    if wallet:
+        await wallet_events.publish(wallet_id, "wallet.balance", {"balance": from_minor(wallet["balance"])})
+    return response
 
 @api_router.get("/transactions", response_model=List[TransactionResponse])
 async def get_transactions(
+    response: Response,
     wallet_id: Optional[str] = None,
     limit: int = 50,
+    before: Optional[str] = None,
     current_user: dict = Depends(get_current_user)
 ):
+    """Newest first; pass X-Next-Cursor back as ``before`` for older pages"""
     user_id = current_user["id"]
     
     # Get user's wallets
-    wallets = await db.wallets.find({
-        "$or": [{"owner_id": user_id}, {"members": user_id}]
-    }).to_list(100)
-    wallet_ids = [w["id"] for w in wallets]
+    wallet_ids = await get_user_wallet_ids(user_id)
     
-    query = {"wallet_id": {"$in": wallet_ids}}
+    query = {"wallet_id": {"$in": list(wallet_ids)}}
     if wallet_id:
         if wallet_id not in wallet_ids:
             raise HTTPException(status_code=403, detail="Brak dostępu do tego portfela")
         query = {"wallet_id": wallet_id}
+    if before:
+        query.update(created_before(before))
     
-    transactions = await db.transactions.find(query).sort("created_at", -1).limit(limit).to_list(limit)
+    transactions = await find_transactions_page(query, limit)
     
-    result = []
-    for tx in transactions:
-        tx = await get_transaction_with_user(tx)
-        result.append(TransactionResponse(**tx))
-    return result
+    if transactions and len(transactions) == limit:
+        last = transactions[-1]
+        response.headers["X-Next-Cursor"] = encode_cursor(last["created_at"], last["id"])
+    
+    await attach_user_names(transactions)
+    return [transaction_response(tx) for tx in transactions]
+
+@api_router.get("/transactions/search", response_model=List[TransactionSearchResult])
+async def search_transactions(
+    response: Response,
+    q: str = Query(..., min_length=SEARCH_MIN_TERM_LENGTH, max_length=100),
+    wallet_id: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100),
+    before: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """Search notes and categories by word prefixes, ignoring case and Polish
+    diacritics. Words shorter than SEARCH_MIN_TERM_LENGTH are ignored. Newest
+    first; pass X-Next-Cursor back as ``before`` for more."""
+    terms = list(dict.fromkeys(t for t in search_terms(q) if len(t) >= SEARCH_MIN_TERM_LENGTH))[:8]
+    if not terms:
+        return []
+    
+    wallet_ids = await get_user_wallet_ids(current_user["id"])
+    if wallet_id:
+        if wallet_id not in wallet_ids:
+            raise HTTPException(status_code=403, detail="Brak dostępu do tego portfela")
+        wallet_ids = [wallet_id]
+    
+    query = {
+        "wallet_id": {"$in": list(wallet_ids)},
+        "$and": [{"search_tokens": re.compile("^" + re.escape(term))} for term in terms]
+    }
+    if before:
+        query.update(created_before(before))
+    
+    transactions = await find_transactions_page(query, limit, {"_id": 0, "search_tokens": 0})
+    
+    if len(transactions) == limit:
+        last = transactions[-1]
+        response.headers["X-Next-Cursor"] = encode_cursor(last["created_at"], last["id"])
+    
+    await attach_user_names(transactions)
+    return [
+        TransactionSearchResult(
+            **transaction_response(tx).dict(),
+            highlights={
+                "note": search_highlights(tx.get("note"), terms),
+                "category": search_highlights(tx["category"], terms)
+            }
+        )
+        for tx in transactions
+    ]
 
 @api_router.get("/transactions/{transaction_id}", response_model=TransactionResponse)
 async def get_transaction(transaction_id: str, current_user: dict = Depends(get_current_user)):
-    transaction = await db.transactions.find_one({"id": transaction_id})
+    transaction, _ = await find_transaction(transaction_id)
     if not transaction:
         raise HTTPException(status_code=404, detail="Transakcja nie znaleziona")
     
     # Verify access
-    wallet = await db.wallets.find_one({
-        "id": transaction["wallet_id"],
-        "$or": [{"owner_id": current_user["id"]}, {"members": current_user["id"]}]
-    })
-    if not wallet:
+    if transaction["wallet_id"] not in await get_user_wallet_ids(current_user["id"]):
         raise HTTPException(status_code=403, detail="Brak dostępu do tej transakcji")
     
-    transaction = await get_transaction_with_user(transaction)
-    return TransactionResponse(**transaction)
+    await attach_user_names([transaction])
+    return transaction_response(transaction)
+
+@api_router.put("/transactions/{transaction_id}", response_model=TransactionResponse)
+async def update_transaction(transaction_id: str, update_data: TransactionUpdate, current_user: dict = Depends(get_current_user)):
+    transaction, collection = await find_transaction(transaction_id)
+    if not transaction:
+        raise HTTPException(status_code=404, detail="Transakcja nie znaleziona")
+    
+    if transaction["wallet_id"] not in await get_user_wallet_ids(current_user["id"]):
+        raise HTTPException(status_code=403, detail="Brak dostępu do tej transakcji")
+    
+    updates = {k: v for k, v in update_data.dict().items() if v is not None}
+    if "type" in updates and updates["type"] not in ["income", "expense"]:
+        raise HTTPException(status_code=400, detail="Typ transakcji musi być 'income' lub 'expense'")
+    if "amount" in updates:
+        updates["amount"] = to_minor(abs(updates["amount"]))
+    
+    updated = {**transaction, **updates, "updated_at": datetime.utcnow()}
+    updated["search_tokens"] = transaction_search_tokens(updated)
+    
+    # Only applies if nothing the aggregates depend on changed since it was read
+    result = await collection.update_one(
+        {
+            "id": transaction_id,
+            "amount": transaction["amount"],
+            "type": transaction["type"],
+            "category": transaction["category"],
+            "balance_pending": {"$exists": False}
+        },
+        {"$set": {**updates, "updated_at": updated["updated_at"], "search_tokens": updated["search_tokens"]}}
+    )
+    if not result.matched_count:
+        raise HTTPException(status_code=409, detail="Transakcja została zmieniona, spróbuj ponownie")
+    
+    # Old and new effect on the wallet folded into a single $inc
+    inc = wallet_increments([transaction], -1)
+    for key, value in wallet_increments([updated]).items():
+        inc[key] = inc.get(key, 0) + value
+    inc = {key: value for key, value in inc.items() if value}
+    wallet = None
+    if inc:
+        wallet = await db.wallets.find_one_and_update(
+            {"id": transaction["wallet_id"]},
+            {"$inc": inc},
+            projection={"_id": 0, "balance": 1},
+            return_document=ReturnDocument.AFTER
+        )
+    
+    if any(transaction[k] != updated[k] for k in ("amount", "type", "category")):
+        await apply_transaction_effects([transaction], -1)
+        await apply_transaction_effects([updated])
+    elif transaction.get("note") != updated.get("note"):
+        # Stored reports list the top notes of the month
+        await invalidate_stored_reports([updated])
+    await invalidate_wallet_dashboards(transaction["wallet_id"])
+    
+    await attach_user_names([updated])
+    response = transaction_response(updated)
+    await wallet_events.publish(transaction["wallet_id"], "transaction.updated", response.dict())
+    if wallet and "balance" in inc:
+        await wallet_events.publish(transaction["wallet_id"], "wallet.balance", {"balance": from_minor(wallet["balance"])})
+    return response
 
 @api_router.delete("/transactions/{transaction_id}")
 async def delete_transaction(transaction_id: str, current_user: dict = Depends(get_current_user)):
-    transaction = await db.transactions.find_one({"id": transaction_id})
+    transaction, collection = await find_transaction(transaction_id)
     if not transaction:
         raise HTTPException(status_code=404, detail="Transakcja nie znaleziona")
     
     # Verify ownership or wallet access
-    wallet = await db.wallets.find_one({
-        "id": transaction["wallet_id"],
-        "$or": [{"owner_id": current_user["id"]}, {"members": current_user["id"]}]
-    })
-    if not wallet:
+    if transaction["wallet_id"] not in await get_user_wallet_ids(current_user["id"]):
         raise HTTPException(status_code=403, detail="Brak dostępu do tej transakcji")
     
     # Reverse balance change
-    balance_change = -transaction["amount"] if transaction["type"] == "income" else transaction["amount"]
-    await db.wallets.update_one(
+    wallet = await db.wallets.find_one_and_update(
         {"id": transaction["wallet_id"]},
-        {"$inc": {"balance": balance_change}}
+        {"$inc": wallet_increments([transaction], -1)},
+        projection={"_id": 0, "balance": 1},
+        return_document=ReturnDocument.AFTER
     )
     
-    await db.transactions.delete_one({"id": transaction_id})
+    await collection.delete_one({"id": transaction_id})
+    await invalidate_wallet_dashboards(transaction["wallet_id"])
+    await apply_transaction_effects([transaction], -1)
+    await wallet_events.publish(transaction["wallet_id"], "transaction.deleted", {"id": transaction_id})
+    if wallet:
+        await wallet_events.publish(transaction["wallet_id"], "wallet.balance", {"balance": from_minor(wallet["balance"])})
     return {"message": "Transakcja usunięta"}
 
+# ================== RECURRING TRANSACTIONS ==================
+
+RECURRING_FREQUENCIES = ("daily", "weekly", "monthly", "yearly")
+RECURRING_TICK_SECONDS = float(os.environ.get('RECURRING_TICK_SECONDS', '60'))
+RECURRING_BATCH_SIZE = int(os.environ.get('RECURRING_BATCH_SIZE', '200'))
+RECURRING_LEASE_SECONDS = float(os.environ.get('RECURRING_LEASE_SECONDS', '300'))
+# Upper bound on occurrences caught up per rule and tick, e.g. after long downtime
+RECURRING_MAX_CATCH_UP = 366
+
+def add_months(moment: datetime, months: int, anchor_day: int) -> datetime:
+    """Shift by whole months, keeping the anchor day where the month allows it"""
+    month_index = moment.month - 1 + months
+    year = moment.year + month_index // 12
+    month = month_index % 12 + 1
+    day = min(anchor_day, calendar.monthrange(year, month)[1])
+    return moment.replace(year=year, month=month, day=day)
+
+def next_occurrence(rule: dict, current: datetime) -> datetime:
+    frequency, interval = rule["frequency"], rule["interval"]
+    if frequency == "daily":
+        return current + timedelta(days=interval)
+    if frequency == "weekly":
+        return current + timedelta(weeks=interval)
+    if frequency == "monthly":
+        return add_months(current, interval, rule["anchor_day"])
+    return add_months(current, 12 * interval, rule["anchor_day"])
+
+def recurring_transaction_id(rule_id: str, occurrence: datetime) -> str:
+    # Deterministic, so re-running a tick cannot create the same occurrence twice
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"cenny-grosz:recurring:{rule_id}:{occurrence.isoformat()}"))
+
+def recurring_rule_response(rule: dict) -> RecurringRuleResponse:
+    return RecurringRuleResponse(**{**rule, "amount": from_minor(rule["amount"])})
+
+@api_router.post("/recurring", response_model=RecurringRuleResponse)
+async def create_recurring_rule(rule_data: RecurringRuleCreate, current_user: dict = Depends(get_current_user)):
+    if rule_data.wallet_id not in await get_user_wallet_ids(current_user["id"]):
+        raise HTTPException(status_code=404, detail="Portfel nie znaleziony")
+    if rule_data.type not in ["income", "expense"]:
+        raise HTTPException(status_code=400, detail="Typ transakcji musi być 'income' lub 'expense'")
+    if rule_data.frequency not in RECURRING_FREQUENCIES:
+        raise HTTPException(status_code=400, detail="Częstotliwość musi być 'daily', 'weekly', 'monthly' lub 'yearly'")
+    
+    start_at = rule_data.start_at or datetime.utcnow()
+    rule = {
+        "id": str(uuid.uuid4()),
+        "wallet_id": rule_data.wallet_id,
+        "user_id": current_user["id"],
+        "amount": to_minor(abs(rule_data.amount)),
+        "type": rule_data.type,
+        "category": rule_data.category,
+        "emoji": rule_data.emoji,
+        "note": rule_data.note,
+        "frequency": rule_data.frequency,
+        "interval": rule_data.interval,
+        "anchor_day": start_at.day,
+        "next_run_at": start_at,
+        "end_at": rule_data.end_at,
+        "active": True,
+        "lease_until": datetime.min,
+        "created_at": datetime.utcnow()
+    }
+    await db.recurring_rules.insert_one(rule)
+    return recurring_rule_response(rule)
+
+@api_router.get("/recurring", response_model=List[RecurringRuleResponse])
+async def get_recurring_rules(current_user: dict = Depends(get_current_user)):
+    rules = await db.recurring_rules.find({"user_id": current_user["id"]}).sort("next_run_at", 1).to_list(None)
+    return [recurring_rule_response(r) for r in rules]
+
+@api_router.delete("/recurring/{rule_id}")
+async def delete_recurring_rule(rule_id: str, current_user: dict = Depends(get_current_user)):
+    result = await db.recurring_rules.delete_one({"id": rule_id, "user_id": current_user["id"]})
+    if not result.deleted_count:
+        raise HTTPException(status_code=404, detail="Reguła nie znaleziona")
+    return {"message": "Transakcja cykliczna usunięta"}
+
+async def materialize_recurring_transactions(now: Optional[datetime] = None) -> int:
+    """Create all due occurrences of recurring rules; returns how many were created.
+
+    Rules are claimed with a lease so several workers can run this
+    concurrently, and every step is idempotent so a tick interrupted at any
+    point can simply be repeated.
+    """
+    now = now or datetime.utcnow()
+    created = 0
+    while True:
+        due = await db.recurring_rules.find(
+            {"active": True, "next_run_at": {"$lte": now}, "lease_until": {"$lt": now}},
+            {"_id": 0, "id": 1}
+        ).sort("next_run_at", 1).limit(RECURRING_BATCH_SIZE).to_list(RECURRING_BATCH_SIZE)
+        if not due:
+            return created
+        
+        lease_id = str(uuid.uuid4())
+        await db.recurring_rules.update_many(
+            {"id": {"$in": [r["id"] for r in due]}, "lease_until": {"$lt": now}},
+            {"$set": {"lease_id": lease_id, "lease_until": now + timedelta(seconds=RECURRING_LEASE_SECONDS)}}
+        )
+        rules = await db.recurring_rules.find({"lease_id": lease_id}).to_list(None)
+        created += await _materialize_rules(rules, now)
+
+async def _materialize_rules(rules: List[dict], now: datetime) -> int:
+    transactions = []
+    advances = []
+    for rule in rules:
+        occurrence = rule["next_run_at"]
+        end_at = rule.get("end_at")
+        if rule["wallet_id"] not in await get_user_wallet_ids(rule["user_id"]):
+            # The author lost access to the wallet
+            advances.append((rule, occurrence, False))
+            continue
+        
+        count = 0
+        while occurrence <= now and count < RECURRING_MAX_CATCH_UP and (end_at is None or occurrence <= end_at):
+            transactions.append({
+                "id": recurring_transaction_id(rule["id"], occurrence),
+                "wallet_id": rule["wallet_id"],
+                "user_id": rule["user_id"],
+                "amount": rule["amount"],
+                "type": rule["type"],
+                "category": rule["category"],
+                "emoji": rule["emoji"],
+                "note": rule["note"],
+                "created_at": occurrence,
+                "recurring_rule_id": rule["id"],
+                "search_tokens": transaction_search_tokens(rule),
+                "balance_pending": True
+            })
+            occurrence = next_occurrence(rule, occurrence)
+            count += 1
+        advances.append((rule, occurrence, end_at is None or occurrence <= end_at))
+    
+    created = 0
+    if transactions:
+        try:
+            result = await db.transactions.insert_many(transactions, ordered=False)
+            created = len(result.inserted_ids)
+        except BulkWriteError as e:
+            # Occurrences inserted by an earlier, interrupted run are duplicates
+            if any(err["code"] != 11000 for err in e.details["writeErrors"]):
+                raise
+            created = e.details["nInserted"]
+        
+        # Occurrences still marked pending are claimed per wallet under a fresh apply
+        # id before anything is counted. The wallet, rollups and budgets each remember
+        # the apply ids they have added, so a run interrupted anywhere is finished by
+        # the next one under the same claim and no occurrence counts twice.
+        ids = [t["id"] for t in transactions]
+        for wallet_id in {t["wallet_id"] for t in transactions}:
+            await db.transactions.update_many(
+                {"id": {"$in": ids}, "wallet_id": wallet_id, "balance_pending": True},
+                {"$set": {"balance_pending": str(uuid.uuid4())}}
+            )
+        pending = await db.transactions.find(
+            {"id": {"$in": ids}, "balance_pending": {"$exists": True}},
+            {"_id": 0}
+        ).to_list(None)
+        claims = {}
+        for tx in pending:
+            claims.setdefault((tx["wallet_id"], tx["balance_pending"]), []).append(tx)
+        
+        for (wallet_id, apply_id), claimed in claims.items():
+            wallet = await db.wallets.find_one_and_update(
+                *applied_once({"id": wallet_id}, {"$inc": wallet_increments(claimed)}, apply_id),
+                projection={"_id": 0, "balance": 1},
+                return_document=ReturnDocument.AFTER
+            )
+            # Guarded by the same apply id, so a retry completes whatever the interrupted run left out
+            await apply_transaction_effects(claimed, apply_id=apply_id)
+            await db.transactions.update_many(
+                {"id": {"$in": [t["id"] for t in claimed]}, "balance_pending": apply_id},
+                {"$unset": {"balance_pending": ""}}
+            )
+            if wallet:
+                await invalidate_wallet_dashboards(wallet_id)
+                for tx in claimed:
+                    await wallet_events.publish(wallet_id, "transaction.created", transaction_response(tx).dict())
+                await wallet_events.publish(wallet_id, "wallet.balance", {"balance": from_minor(wallet["balance"])})
+    
+    for rule, next_run_at, active in advances:
+        await db.recurring_rules.update_one(
+            {"id": rule["id"], "lease_id": rule["lease_id"]},
+            {"$set": {"next_run_at": next_run_at, "active": active, "last_run_at": now, "lease_until": datetime.min}, "$unset": {"lease_id": ""}}
+        )
+    
+    if created:
+        metrics["recurring_transactions_created"] += created
+    return created
+
 # ================== CATEGORY ROUTES ==================
 
 # Default categories
@@ -652,30 +2588,75 @@ DEFAULT_INCOME_CATEGORIES = [
     {"name": "Inne", "emoji": "💵"},
 ]
 
+def _default_category_payloads(category_type: str, catalog: List[dict]) -> tuple:
+    return tuple(
+        {"id": f"default-{category_type}-{i}", "name": c["name"], "emoji": c["emoji"], "type": category_type, "is_default": True}
+        for i, c in enumerate(catalog)
+    )
+
+# Built once at import; the payloads are shared between requests and must not be mutated
+_DEFAULT_EXPENSE_PAYLOADS = _default_category_payloads("expense", DEFAULT_EXPENSE_CATEGORIES)
+_DEFAULT_INCOME_PAYLOADS = _default_category_payloads("income", DEFAULT_INCOME_CATEGORIES)
+DEFAULT_CATEGORY_PAYLOADS = {
+    "expense": _DEFAULT_EXPENSE_PAYLOADS,
+    "income": _DEFAULT_INCOME_PAYLOADS,
+    None: _DEFAULT_EXPENSE_PAYLOADS + _DEFAULT_INCOME_PAYLOADS,
+}
+
+CATEGORY_CACHE_TTL = float(os.environ.get('CATEGORY_CACHE_TTL', '300'))
+
+# Merged (defaults + custom) category lists per user and type, stored together with their JSON encoding
+_category_cache = SharedCache("categories", maxsize=10000, ttl=CATEGORY_CACHE_TTL)
+
+def _category_cache_key(user_id: str, category_type: Optional[str]) -> str:
+    return f"{user_id}:{category_type or 'all'}"
+
+async def invalidate_user_categories(user_id: str):
+    await _category_cache.invalidate(*[_category_cache_key(user_id, t) for t in DEFAULT_CATEGORY_PAYLOADS])
+
+def _encode_json(payload) -> bytes:
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+async def get_merged_categories(user_id: str, category_type: Optional[str]) -> tuple:
+    """Return (categories, encoded JSON) for a user, served from cache when possible"""
+    key = _category_cache_key(user_id, category_type)
+    cached = _category_cache.get(key)
+    if cached is not None:
+        return cached
+
+    query = {"user_id": user_id}
+    if category_type:
+        query["type"] = category_type
+
+    projection = {"_id": 0, "id": 1, "name": 1, "emoji": 1, "type": 1}
+    custom = [
+        {"id": c["id"], "name": c["name"], "emoji": c["emoji"], "type": c["type"], "is_default": False}
+        async for c in db.categories.find(query, projection).sort("created_at", 1)
+    ]
+
+    merged = DEFAULT_CATEGORY_PAYLOADS.get(category_type, ()) + tuple(custom)
+    entry = (merged, _encode_json(list(merged)))
+    _category_cache.set(key, entry)
+    return entry
+
 @api_router.get("/categories")
-async def get_categories(type: Optional[str] = None, current_user: dict = Depends(get_current_user)):
+async def get_categories(
+    type: Optional[str] = None,
+    skip: int = Query(0, ge=0),
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    current_user: dict = Depends(get_current_user)
+):
     """Get user's categories + default ones"""
-    user_id = current_user["id"]
-    
-    # Get user's custom categories
-    query = {"user_id": user_id}
-    if type:
-        query["type"] = type
-    
-    custom_categories = await db.categories.find(query).to_list(100)
-    
-    # Prepare response with defaults + custom
-    if type == "expense":
-        defaults = [{"id": f"default-expense-{i}", "name": c["name"], "emoji": c["emoji"], "type": "expense", "is_default": True} for i, c in enumerate(DEFAULT_EXPENSE_CATEGORIES)]
-    elif type == "income":
-        defaults = [{"id": f"default-income-{i}", "name": c["name"], "emoji": c["emoji"], "type": "income", "is_default": True} for i, c in enumerate(DEFAULT_INCOME_CATEGORIES)]
-    else:
-        defaults = [{"id": f"default-expense-{i}", "name": c["name"], "emoji": c["emoji"], "type": "expense", "is_default": True} for i, c in enumerate(DEFAULT_EXPENSE_CATEGORIES)]
-        defaults += [{"id": f"default-income-{i}", "name": c["name"], "emoji": c["emoji"], "type": "income", "is_default": True} for i, c in enumerate(DEFAULT_INCOME_CATEGORIES)]
-    
-    custom = [{"id": c["id"], "name": c["name"], "emoji": c["emoji"], "type": c["type"], "is_default": False} for c in custom_categories]
-    
-    return defaults + custom
+    if type not in DEFAULT_CATEGORY_PAYLOADS:
+        raise HTTPException(status_code=400, detail="Typ musi być 'income' lub 'expense'")
+
+    merged, encoded = await get_merged_categories(current_user["id"], type)
+
+    if skip or limit is not None:
+        end = skip + limit if limit is not None else None
+        encoded = _encode_json(list(merged[skip:end]))
+
+    return Response(content=encoded, media_type="application/json")
 
 @api_router.post("/categories")
 async def create_category(category_data: CategoryCreate, current_user: dict = Depends(get_current_user)):
@@ -691,18 +2672,110 @@ async def create_category(category_data: CategoryCreate, current_user: dict = De
         "type": category_data.type,
         "created_at": datetime.utcnow()
     }
-    await db.categories.insert_one(category)
-    return {"id": category["id"], "name": category["name"], "emoji": category["emoji"], "type": category["type"], "is_default": False}
+    await db.categories.insert_one(category)
+    await invalidate_user_categories(current_user["id"])
+    return {"id": category["id"], "name": category["name"], "emoji": category["emoji"], "type": category["type"], "is_default": False}
+
+@api_router.delete("/categories/{category_id}")
+async def delete_category(category_id: str, current_user: dict = Depends(get_current_user)):
+    """Delete a custom category"""
+    category = await db.categories.find_one({"id": category_id, "user_id": current_user["id"]})
+    if not category:
+        raise HTTPException(status_code=404, detail="Kategoria nie znaleziona")
+    
+    await db.categories.delete_one({"id": category_id})
+    await invalidate_user_categories(current_user["id"])
+    return {"message": "Kategoria usunięta"}
+
+# ================== BUDGET ROUTES ==================
+
+def budget_response(budget: dict, month: str) -> BudgetResponse:
+    spent = budget.get("spent", {}).get(month, 0)
+    percent = budget_percent(budget, month)
+    status = "ok"
+    if percent >= BUDGET_ALERT_THRESHOLDS[-1]:
+        status = "exceeded"
+    elif percent >= BUDGET_ALERT_THRESHOLDS[0]:
+        status = "warning"
+    return BudgetResponse(
+        id=budget["id"],
+        user_id=budget["user_id"],
+        wallet_id=budget.get("wallet_id"),
+        category=budget["category"],
+        limit=from_minor(budget["limit"]),
+        month=month,
+        spent=from_minor(spent),
+        remaining=from_minor(budget["limit"] - spent),
+        percent=round(percent, 1),
+        status=status,
+        created_at=budget["created_at"]
+    )
+
+async def budget_spent_from_rollups(user_id: str, wallet_id: Optional[str], category: str, month: str) -> int:
+    wallet_ids = [wallet_id] if wallet_id else list(await get_user_wallet_ids(user_id))
+    rollups = await db.rollups.find(
+        {"wallet_id": {"$in": wallet_ids}, "month": month, "type": "expense", "category": category},
+        {"_id": 0, "amount": 1}
+    ).to_list(None)
+    return sum_minor(r["amount"] for r in rollups)
+
+@api_router.post("/budgets", response_model=BudgetResponse)
+async def create_budget(budget_data: BudgetCreate, current_user: dict = Depends(get_current_user)):
+    user_id = current_user["id"]
+    if budget_data.wallet_id and budget_data.wallet_id not in await get_user_wallet_ids(user_id):
+        raise HTTPException(status_code=404, detail="Portfel nie znaleziony")
+    
+    # Spending so far this month comes from rollups, later spending from the running counter
+    month = month_key(datetime.utcnow())
+    budget = {
+        "id": str(uuid.uuid4()),
+        "user_id": user_id,
+        "wallet_id": budget_data.wallet_id,
+        "category": budget_data.category,
+        "limit": to_minor(budget_data.limit),
+        "spent": {month: await budget_spent_from_rollups(user_id, budget_data.wallet_id, budget_data.category, month)},
+        "alerted": {},
+        "created_at": datetime.utcnow()
+    }
+    try:
+        await db.budgets.insert_one(budget)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Budżet dla tej kategorii już istnieje")
+    return budget_response(budget, month)
 
-@api_router.delete("/categories/{category_id}")
-async def delete_category(category_id: str, current_user: dict = Depends(get_current_user)):
-    """Delete a custom category"""
-    category = await db.categories.find_one({"id": category_id, "user_id": current_user["id"]})
-    if not category:
-        raise HTTPException(status_code=404, detail="Kategoria nie znaleziona")
-    
-    await db.categories.delete_one({"id": category_id})
-    return {"message": "Kategoria usunięta"}
+@api_router.get("/budgets", response_model=List[BudgetResponse])
+async def get_budgets(month: Optional[str] = Query(None, pattern=r"^\d{4}-\d{2}$"), current_user: dict = Depends(get_current_user)):
+    """Budgets with their status for the given month (default: current month)"""
+    month = month or month_key(datetime.utcnow())
+    budgets = await db.budgets.find({"user_id": current_user["id"]}).sort("category", 1).to_list(None)
+    return [budget_response(b, month) for b in budgets]
+
+@api_router.put("/budgets/{budget_id}", response_model=BudgetResponse)
+async def update_budget(budget_id: str, update_data: BudgetUpdate, current_user: dict = Depends(get_current_user)):
+    month = month_key(datetime.utcnow())
+    budget = await db.budgets.find_one_and_update(
+        {"id": budget_id, "user_id": current_user["id"]},
+        # A new limit may put the budget back under its thresholds
+        {"$set": {"limit": to_minor(update_data.limit)}, "$unset": {f"alerted.{month}": ""}},
+        return_document=ReturnDocument.AFTER
+    )
+    if not budget:
+        raise HTTPException(status_code=404, detail="Budżet nie znaleziony")
+    return budget_response(budget, month)
+
+@api_router.delete("/budgets/{budget_id}")
+async def delete_budget(budget_id: str, current_user: dict = Depends(get_current_user)):
+    result = await db.budgets.delete_one({"id": budget_id, "user_id": current_user["id"]})
+    if not result.deleted_count:
+        raise HTTPException(status_code=404, detail="Budżet nie znaleziony")
+    return {"message": "Budżet usunięty"}
+
+@api_router.get("/budgets/alerts", response_model=List[dict])
+async def get_budget_alerts(limit: int = Query(20, ge=1, le=100), current_user: dict = Depends(get_current_user)):
+    return await db.budget_alerts.find(
+        {"user_id": current_user["id"]},
+        {"_id": 0}
+    ).sort("created_at", -1).limit(limit).to_list(limit)
 
 # ================== GOAL ROUTES ==================
 
@@ -712,27 +2785,28 @@ async def create_goal(goal_data: GoalCreate, current_user: dict = Depends(get_cu
         "id": str(uuid.uuid4()),
         "user_id": current_user["id"],
         "name": goal_data.name,
-        "target_amount": goal_data.target_amount,
-        "current_amount": 0.0,
+        "target_amount": to_minor(goal_data.target_amount),
+        "current_amount": 0,
         "emoji": goal_data.emoji,
         "deadline": goal_data.deadline,
         "completed": False,
         "created_at": datetime.utcnow()
     }
     await db.goals.insert_one(goal)
-    return GoalResponse(**goal)
+    await _dashboard_cache.invalidate(current_user["id"])
+    return goal_response(goal)
 
 @api_router.get("/goals", response_model=List[GoalResponse])
 async def get_goals(current_user: dict = Depends(get_current_user)):
     goals = await db.goals.find({"user_id": current_user["id"]}).to_list(100)
-    return [GoalResponse(**g) for g in goals]
+    return [goal_response(g) for g in goals]
 
 @api_router.get("/goals/{goal_id}", response_model=GoalResponse)
 async def get_goal(goal_id: str, current_user: dict = Depends(get_current_user)):
     goal = await db.goals.find_one({"id": goal_id, "user_id": current_user["id"]})
     if not goal:
         raise HTTPException(status_code=404, detail="Cel nie znaleziony")
-    return GoalResponse(**goal)
+    return goal_response(goal)
 
 @api_router.put("/goals/{goal_id}", response_model=GoalResponse)
 async def update_goal(goal_id: str, update_data: GoalUpdate, current_user: dict = Depends(get_current_user)):
@@ -741,36 +2815,112 @@ async def update_goal(goal_id: str, update_data: GoalUpdate, current_user: dict
         raise HTTPException(status_code=404, detail="Cel nie znaleziony")
     
     updates = {k: v for k, v in update_data.dict().items() if v is not None}
-    
-    # Check if goal is completed
-    if "current_amount" in updates or "target_amount" in updates:
-        current = updates.get("current_amount", goal["current_amount"])
-        target = updates.get("target_amount", goal["target_amount"])
-        updates["completed"] = current >= target
+    if "target_amount" in updates:
+        updates["target_amount"] = to_minor(updates["target_amount"])
     
     if updates:
         await db.goals.update_one({"id": goal_id}, {"$set": updates})
-        goal.update(updates)
+        if "target_amount" in updates:
+            # Derived from the stored amounts, as for contributions
+            await db.goals.update_one(
+                {"id": goal_id},
+                [{"$set": {"completed": {"$gte": ["$current_amount", "$target_amount"]}}}]
+            )
+        await _dashboard_cache.invalidate(current_user["id"])
+        goal = await db.goals.find_one({"id": goal_id}, {"_id": 0})
     
-    return GoalResponse(**goal)
+    return goal_response(goal)
 
 @api_router.post("/goals/{goal_id}/contribute", response_model=GoalResponse)
 async def contribute_to_goal(goal_id: str, contribution: GoalContribute, current_user: dict = Depends(get_current_user)):
-    goal = await db.goals.find_one({"id": goal_id, "user_id": current_user["id"]})
+    """Add to (or, with a negative amount, withdraw from) a goal. With wallet_id
+    the money is also moved out of (or back into) that wallet as a transaction."""
+    user_id = current_user["id"]
+    amount = to_minor(contribution.amount)
+    if amount == 0:
+        raise HTTPException(status_code=400, detail="Kwota musi być różna od zera")
+    if contribution.wallet_id and contribution.wallet_id not in await get_user_wallet_ids(user_id):
+        raise HTTPException(status_code=404, detail="Portfel nie znaleziony")
+    
+    goal = await db.goals.find_one({"id": goal_id, "user_id": user_id}, {"_id": 0, "name": 1, "emoji": 1})
     if not goal:
         raise HTTPException(status_code=404, detail="Cel nie znaleziony")
     
-    new_amount = goal["current_amount"] + contribution.amount
-    completed = new_amount >= goal["target_amount"]
+    # The ledger entry goes first, so goal progress never changes without one
+    now = datetime.utcnow()
+    contribution_id = str(uuid.uuid4())
+    transaction_id = str(uuid.uuid4()) if contribution.wallet_id else None
+    await db.goal_contributions.insert_one({
+        "id": contribution_id,
+        "goal_id": goal_id,
+        "user_id": user_id,
+        "amount": amount,
+        "wallet_id": contribution.wallet_id,
+        "transaction_id": transaction_id,
+        "note": contribution.note,
+        "created_at": now
+    })
     
+    query = {"id": goal_id, "user_id": user_id}
+    if amount < 0:
+        # Cannot withdraw more than has been saved
+        query["current_amount"] = {"$gte": -amount}
+    result = await db.goals.update_one(
+        query,
+        {"$inc": {"current_amount": amount, f"contributed.{month_key(now)}": amount}}
+    )
+    if not result.matched_count:
+        await db.goal_contributions.delete_one({"id": contribution_id})
+        if amount > 0:
+            raise HTTPException(status_code=404, detail="Cel nie znaleziony")
+        raise HTTPException(status_code=400, detail="Nie można wypłacić więcej, niż zebrano na cel")
+    # Derived from the stored amounts, so concurrent contributions converge
     await db.goals.update_one(
         {"id": goal_id},
-        {"$set": {"current_amount": new_amount, "completed": completed}}
+        [{"$set": {"completed": {"$gte": ["$current_amount", "$target_amount"]}}}]
     )
     
-    goal["current_amount"] = new_amount
-    goal["completed"] = completed
-    return GoalResponse(**goal)
+    if contribution.wallet_id:
+        await record_transaction({
+            "id": transaction_id,
+            "wallet_id": contribution.wallet_id,
+            "user_id": user_id,
+            "amount": abs(amount),
+            "type": "expense" if amount > 0 else "income",
+            "category": "Oszczędności",
+            "emoji": goal["emoji"],
+            "note": f"{'Wpłata na cel' if amount > 0 else 'Wypłata z celu'}: {goal['name']}",
+            "created_at": now
+        }, current_user["name"])
+    await _dashboard_cache.invalidate(user_id)
+    
+    goal = await db.goals.find_one({"id": goal_id}, {"_id": 0})
+    return goal_response(goal)
+
+@api_router.get("/goals/{goal_id}/contributions", response_model=List[GoalContributionResponse])
+async def get_goal_contributions(
+    goal_id: str,
+    response: Response,
+    limit: int = Query(50, ge=1, le=200),
+    before: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """Contribution history, newest first; pass X-Next-Cursor back as ``before``"""
+    if not await db.goals.find_one({"id": goal_id, "user_id": current_user["id"]}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="Cel nie znaleziony")
+    
+    query = {"goal_id": goal_id}
+    if before:
+        query.update(created_before(before))
+    contributions = await db.goal_contributions.find(query, {"_id": 0}).sort(
+        [("created_at", -1), ("id", -1)]
+    ).limit(limit).to_list(limit)
+    
+    if len(contributions) == limit:
+        last = contributions[-1]
+        response.headers["X-Next-Cursor"] = encode_cursor(last["created_at"], last["id"])
+    
+    return [GoalContributionResponse(**{**c, "amount": from_minor(c["amount"])}) for c in contributions]
 
 @api_router.delete("/goals/{goal_id}")
 async def delete_goal(goal_id: str, current_user: dict = Depends(get_current_user)):
@@ -779,23 +2929,186 @@ async def delete_goal(goal_id: str, current_user: dict = Depends(get_current_use
         raise HTTPException(status_code=404, detail="Cel nie znaleziony")
     
     await db.goals.delete_one({"id": goal_id})
+    await db.goal_contributions.delete_many({"goal_id": goal_id})
+    await _dashboard_cache.invalidate(current_user["id"])
     return {"message": "Cel usunięty"}
 
 # ================== AI ASSISTANT ROUTES ==================
 
+LLM_PROVIDER = os.environ.get('LLM_PROVIDER', 'emergent')  # "emergent" or "fake" for local testing
+LLM_MAX_CONCURRENCY = int(os.environ.get('LLM_MAX_CONCURRENCY', '16'))
+LLM_MAX_IN_FLIGHT_PER_USER = int(os.environ.get('LLM_MAX_IN_FLIGHT_PER_USER', '1'))
+LLM_QUEUE_TIMEOUT = float(os.environ.get('LLM_QUEUE_TIMEOUT', '5'))
+LLM_TIMEOUT = float(os.environ.get('LLM_TIMEOUT', '30'))
+LLM_BREAKER_FAILURES = int(os.environ.get('LLM_BREAKER_FAILURES', '5'))
+LLM_BREAKER_RESET_SECONDS = float(os.environ.get('LLM_BREAKER_RESET_SECONDS', '30'))
+
+class LlmUnavailable(Exception):
+    pass
+
+class EmergentLlmClient:
+    """emergentintegrations is imported once, on first use"""
+
+    def __init__(self):
+        from emergentintegrations.llm.chat import LlmChat, UserMessage
+        self._chat_class = LlmChat
+        self._message_class = UserMessage
+
+    async def send(self, session_id: str, system_message: str, text: str) -> str:
+        chat = self._chat_class(
+            api_key=EMERGENT_LLM_KEY,
+            session_id=session_id,
+            system_message=system_message
+        ).with_model("openai", "gpt-5.2")
+        return await chat.send_message(self._message_class(text=text))
+
+class FakeLlmClient:
+    """Local stand-in for the upstream LLM, with configurable latency and failures"""
+
+    def __init__(self, delay: float = 0.0, fail: bool = False):
+        self.delay = delay
+        self.fail = fail
+        self.calls = 0
+
+    async def send(self, session_id: str, system_message: str, text: str) -> str:
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError("Fake LLM failure")
+        return f"To jest testowa odpowiedź na: {text}"
+
+class CircuitBreaker:
+    """Opens after consecutive failures and lets a single probe through after a cool-down"""
+
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    def cancel_probe(self):
+        self._probing = False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._probing = False
+        if self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+class LlmGuard:
+    """Concurrency caps, timeouts and a circuit breaker around the upstream LLM"""
+
+    def __init__(self, client_factory, max_concurrency: int, max_per_user: int):
+        self._client_factory = client_factory
+        self._client = None
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.max_concurrency = max_concurrency
+        self.max_per_user = max_per_user
+        self._in_flight: Counter = Counter()
+        self.breaker = CircuitBreaker(LLM_BREAKER_FAILURES, LLM_BREAKER_RESET_SECONDS)
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = self._client_factory()
+        return self._client
+
+    @property
+    def in_flight(self) -> int:
+        return sum(self._in_flight.values())
+
+    async def ask(self, user_id: str, system_message: str, text: str) -> str:
+        if self._in_flight[user_id] >= self.max_per_user:
+            metrics["llm_rejected_user_limit"] += 1
+            raise HTTPException(status_code=429, detail="Poczekaj na odpowiedź na poprzednie pytanie")
+        if not self.breaker.allow():
+            metrics["llm_short_circuited"] += 1
+            raise LlmUnavailable("circuit open")
+
+        self._in_flight[user_id] += 1
+        try:
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), LLM_QUEUE_TIMEOUT)
+            except asyncio.TimeoutError:
+                metrics["llm_rejected_busy"] += 1
+                # Not the upstream's fault, but a half-open probe must be released
+                self.breaker.cancel_probe()
+                raise LlmUnavailable("too many concurrent requests")
+            try:
+                metrics["llm_calls"] += 1
+                response = await asyncio.wait_for(
+                    self.client.send(f"cenny_grosz_{user_id}", system_message, text),
+                    LLM_TIMEOUT
+                )
+            except asyncio.TimeoutError:
+                metrics["llm_timeouts"] += 1
+                self.breaker.record_failure()
+                raise LlmUnavailable("timeout")
+            except Exception:
+                metrics["llm_failures"] += 1
+                self.breaker.record_failure()
+                raise
+            finally:
+                self._semaphore.release()
+            self.breaker.record_success()
+            return response
+        finally:
+            self._in_flight[user_id] -= 1
+            if not self._in_flight[user_id]:
+                del self._in_flight[user_id]
+
+llm_guard = LlmGuard(
+    FakeLlmClient if LLM_PROVIDER == "fake" else EmergentLlmClient,
+    LLM_MAX_CONCURRENCY,
+    LLM_MAX_IN_FLIGHT_PER_USER
+)
+
+AI_RESPONSE_CACHE_TTL = float(os.environ.get('AI_RESPONSE_CACHE_TTL', '3600'))
+AI_RESPONSE_CACHE_SIZE = int(os.environ.get('AI_RESPONSE_CACHE_SIZE', '2000'))
+
+# Answers keyed by normalized question + hash of the financial context they were given
+_ai_response_cache = TTLCache(maxsize=AI_RESPONSE_CACHE_SIZE, ttl=AI_RESPONSE_CACHE_TTL)
+
+def normalize_ai_message(message: str) -> str:
+    return re.sub(r"\s+", " ", message.strip().lower()).rstrip("?!. ")
+
+def ai_response_cache_key(message: str, context: str) -> str:
+    context_hash = hashlib.sha256(context.encode("utf-8")).hexdigest()
+    return f"{context_hash}:{normalize_ai_message(message)}"
+
 @api_router.post("/ai/chat", response_model=ChatResponse)
 async def chat_with_ai(request: ChatRequest, current_user: dict = Depends(get_current_user)):
     try:
-        from emergentintegrations.llm.chat import LlmChat, UserMessage
-        
         # Get user's financial data for context
         user_id = current_user["id"]
         
-        wallets = await db.wallets.find({
-            "$or": [{"owner_id": user_id}, {"members": user_id}]
-        }).to_list(100)
+        wallet_ids = await get_user_wallet_ids(user_id)
+        wallets = await db.wallets.find({"id": {"$in": list(wallet_ids)}}).to_list(100)
         
-        total_balance = sum(w["balance"] for w in wallets)
+        total_balance = from_minor(sum_minor(w["balance"] for w in wallets))
         personal_wallets = [w for w in wallets if not w.get("is_shared")]
         shared_wallets = [w for w in wallets if w.get("is_shared")]
         
@@ -804,29 +3117,23 @@ async def chat_with_ai(request: ChatRequest, current_user: dict = Depends(get_cu
         }).sort("created_at", -1).limit(20).to_list(20)
         
         goals = await db.goals.find({"user_id": user_id}).to_list(100)
+        insights = await db.insights.find_one({"user_id": user_id}, {"_id": 0})
         
         # Build financial context
         tx_summary = ""
         if recent_transactions:
-            income_total = sum(tx["amount"] for tx in recent_transactions if tx["type"] == "income")
-            expense_total = sum(tx["amount"] for tx in recent_transactions if tx["type"] == "expense")
-            categories = {}
-            for tx in recent_transactions:
-                if tx["type"] == "expense":
-                    cat = tx["category"]
-                    categories[cat] = categories.get(cat, 0) + tx["amount"]
-            
-            top_categories = sorted(categories.items(), key=lambda x: x[1], reverse=True)[:5]
+            summary = summarize_transactions(recent_transactions)
+            top_categories = sorted(summary["expense_categories"].items(), key=lambda x: x[1], reverse=True)[:5]
             tx_summary = f"""
 Ostatnie transakcje (20):
-- Suma przychodów: {income_total:.2f} PLN
-- Suma wydatków: {expense_total:.2f} PLN
-- Top kategorie wydatków: {', '.join([f'{c}: {a:.2f} PLN' for c, a in top_categories])}
+- Suma przychodów: {from_minor(summary['income']):.2f} PLN
+- Suma wydatków: {from_minor(summary['expense']):.2f} PLN
+- Top kategorie wydatków: {', '.join([f'{c}: {from_minor(a):.2f} PLN' for c, a in top_categories])}
 """
         
         goals_summary = ""
         if goals:
-            goals_list = [f"- {g['emoji']} {g['name']}: {g['current_amount']:.2f}/{g['target_amount']:.2f} PLN ({int(g['current_amount']/g['target_amount']*100) if g['target_amount'] > 0 else 0}%)" for g in goals]
+            goals_list = [f"- {g['emoji']} {g['name']}: {from_minor(g['current_amount']):.2f}/{from_minor(g['target_amount']):.2f} PLN ({int(g['current_amount']/g['target_amount']*100) if g['target_amount'] > 0 else 0}%)" for g in goals]
             goals_summary = "\nCele oszczędnościowe:\n" + "\n".join(goals_list)
         
         wallets_summary = f"""
@@ -849,29 +3156,37 @@ Dane finansowe użytkownika {current_user['name']}:
 {wallets_summary}
 {tx_summary}
 {goals_summary}
+{insights_prompt(insights)}
 
 Odpowiadaj zawsze po polsku. Bądź pomocny i konkretny. Dawaj praktyczne porady finansowe.
 Używaj emoji by być przyjaznym, ale nie przesadzaj."""
 
-        chat = LlmChat(
-            api_key=EMERGENT_LLM_KEY,
-            session_id=f"cenny_grosz_{user_id}",
-            system_message=system_message
-        ).with_model("openai", "gpt-5.2")
-        
-        user_message = UserMessage(text=request.message)
-        response = await chat.send_message(user_message)
+        # Identical questions against unchanged data get the same answer
+        cache_key = ai_response_cache_key(request.message, system_message)
+        response = _ai_response_cache.get(cache_key)
+        cached = response is not None
+        if cached:
+            metrics["ai_cache_hits"] += 1
+        else:
+            metrics["ai_cache_misses"] += 1
+            response = await llm_guard.ask(user_id, system_message, request.message)
+            _ai_response_cache.set(cache_key, response)
         
-        # Save chat history
-        await db.ai_chats.insert_one({
+        # Saved by a job once the enqueue is acknowledged, so a failing save is retried
+        timestamp = datetime.utcnow()
+        await job_queue.enqueue("ai_chat.save", {
+            "id": str(uuid.uuid4()),
             "user_id": user_id,
             "user_message": request.message,
             "ai_response": response,
-            "timestamp": datetime.utcnow()
+            "cached": cached,
+            "timestamp": timestamp
         })
         
-        return ChatResponse(response=response, timestamp=datetime.utcnow())
+        return ChatResponse(response=response, timestamp=timestamp)
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"AI Chat error: {str(e)}")
         return ChatResponse(
@@ -879,14 +3194,42 @@ Używaj emoji by być przyjaznym, ale nie przesadzaj."""
             timestamp=datetime.utcnow()
         )
 
+@job_queue.handler("ai_chat.save")
+async def save_ai_chat(payload: dict):
+    # Upsert on the job-generated id so a retried job does not duplicate the entry
+    await db.ai_chats.update_one({"id": payload["id"]}, {"$setOnInsert": payload}, upsert=True)
+
 @api_router.get("/ai/history", response_model=List[dict])
-async def get_chat_history(limit: int = 20, current_user: dict = Depends(get_current_user)):
-    chats = await db.ai_chats.find(
-        {"user_id": current_user["id"]}
-    ).sort("timestamp", -1).limit(limit).to_list(limit)
+async def get_chat_history(
+    response: Response,
+    limit: int = Query(20, ge=1, le=100),
+    before: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """Chat history, oldest first. Older pages are fetched by passing the
+    X-Next-Cursor response header back as ``before``."""
+    query = {"user_id": current_user["id"]}
+    if before:
+        values = decode_cursor(before)
+        try:
+            timestamp, chat_id = values
+            timestamp, chat_id = datetime.fromisoformat(timestamp), ObjectId(chat_id)
+        except (TypeError, ValueError, InvalidId):
+            raise HTTPException(status_code=400, detail="Nieprawidłowy kursor")
+        query["$or"] = [
+            {"timestamp": {"$lt": timestamp}},
+            {"timestamp": timestamp, "_id": {"$lt": chat_id}}
+        ]
+    
+    chats = await db.ai_chats.find(query).sort([("timestamp", -1), ("_id", -1)]).limit(limit).to_list(limit)
+    
+    if len(chats) == limit:
+        oldest = chats[-1]
+        response.headers["X-Next-Cursor"] = encode_cursor(oldest["timestamp"], str(oldest["_id"]))
     
     return [
         {
+            "id": str(c["_id"]),
             "user_message": c["user_message"],
             "ai_response": c["ai_response"],
             "timestamp": c["timestamp"]
@@ -894,30 +3237,73 @@ async def get_chat_history(limit: int = 20, current_user: dict = Depends(get_cur
         for c in reversed(chats)
     ]
 
+@api_router.get("/ai/history/summaries", response_model=List[dict])
+async def get_chat_history_summaries(current_user: dict = Depends(get_current_user)):
+    """Monthly digests of conversations that were compacted out of the history"""
+    summaries = await db.ai_chat_summaries.find(
+        {"user_id": current_user["id"]},
+        {"_id": 0, "user_id": 0}
+    ).sort("month", -1).to_list(None)
+    return summaries
+
+AI_CHAT_SUMMARY_EXCERPTS = 20
+
+async def compact_ai_chats(older_than: datetime, batch_size: int = 1000):
+    """Fold chats older than ``older_than`` into per-user monthly summaries"""
+    while True:
+        chats = await db.ai_chats.find(
+            {"timestamp": {"$lt": older_than}},
+            {"user_id": 1, "user_message": 1, "timestamp": 1}
+        ).sort("timestamp", 1).limit(batch_size).to_list(batch_size)
+        if not chats:
+            return
+        
+        groups = {}
+        for c in chats:
+            groups.setdefault((c["user_id"], c["timestamp"].strftime("%Y-%m")), []).append(c)
+        
+        for (user_id, month), group in groups.items():
+            await db.ai_chat_summaries.update_one(
+                {"user_id": user_id, "month": month},
+                {
+                    "$inc": {"messages": len(group)},
+                    "$min": {"first_at": group[0]["timestamp"]},
+                    "$max": {"last_at": group[-1]["timestamp"]},
+                    "$push": {"questions": {
+                        "$each": [c["user_message"][:200] for c in group],
+                        "$slice": -AI_CHAT_SUMMARY_EXCERPTS
+                    }}
+                },
+                upsert=True
+            )
+        await db.ai_chats.delete_many({"_id": {"$in": [c["_id"] for c in chats]}})
+        logger.info(f"Compacted {len(chats)} AI chats into {len(groups)} summaries")
+
 # ================== DASHBOARD STATS ==================
 
 @api_router.get("/dashboard/stats")
 async def get_dashboard_stats(current_user: dict = Depends(get_current_user)):
     user_id = current_user["id"]
     
-    wallets = await db.wallets.find({
-        "$or": [{"owner_id": user_id}, {"members": user_id}]
-    }).to_list(100)
+    cached = _dashboard_cache.get(user_id)
+    if cached is not None:
+        return cached
+    
+    generation = _dashboard_cache.generation(user_id)
+    wallets = await db.wallets.find({"id": {"$in": list(await get_user_wallet_ids(user_id))}}).to_list(100)
     
     wallet_ids = [w["id"] for w in wallets]
-    total_balance = sum(w["balance"] for w in wallets)
+    total_balance = sum_minor(w["balance"] for w in wallets)
     
     # Get this month's transactions
     now = datetime.utcnow()
     month_start = datetime(now.year, now.month, 1)
     
-    month_transactions = await db.transactions.find({
-        "wallet_id": {"$in": wallet_ids},
-        "created_at": {"$gte": month_start}
-    }).to_list(1000)
-    
-    month_income = sum(tx["amount"] for tx in month_transactions if tx["type"] == "income")
-    month_expenses = sum(tx["amount"] for tx in month_transactions if tx["type"] == "expense")
+    month_transactions = await analytics_db.transactions.find(
+        {"wallet_id": {"$in": wallet_ids}, "created_at": {"$gte": month_start}},
+        {"_id": 0, "amount": 1, "type": 1, "category": 1}
+    ).to_list(None)
+    month_summary = summarize_transactions(month_transactions)
     
     # Get goals progress
     goals = await db.goals.find({"user_id": user_id}).to_list(100)
@@ -929,39 +3315,768 @@ async def get_dashboard_stats(current_user: dict = Depends(get_current_user)):
             "name": g["name"],
             "emoji": g["emoji"],
             "progress": min(progress, 100),
-            "current": g["current_amount"],
-            "target": g["target_amount"]
+            "current": from_minor(g["current_amount"]),
+            "target": from_minor(g["target_amount"])
         })
     
-    # Category breakdown
-    categories = {}
-    for tx in month_transactions:
-        if tx["type"] == "expense":
-            cat = tx["category"]
-            categories[cat] = categories.get(cat, 0) + tx["amount"]
-    
-    return {
-        "total_balance": total_balance,
-        "month_income": month_income,
-        "month_expenses": month_expenses,
+    stats = {
+        "total_balance": from_minor(total_balance),
+        "month_income": from_minor(month_summary["income"]),
+        "month_expenses": from_minor(month_summary["expense"]),
         "wallets_count": len(wallets),
         "goals_progress": goals_progress,
-        "expense_categories": categories
+        "expense_categories": {c: from_minor(a) for c, a in month_summary["expense_categories"].items()}
+    }
+    _dashboard_cache.set(user_id, stats, generation)
+    return stats
+
+# ================== ANALYTICS ==================
+
+ANALYTICS_MAX_BUCKETS = int(os.environ.get('ANALYTICS_MAX_BUCKETS', '1000'))
+
+ANALYTICS_GROUP_FIELDS = {"category": "category", "wallet": "wallet_id", "user": "user_id"}
+
+def bucket_start(moment: datetime, bucket: str) -> datetime:
+    day = datetime(moment.year, moment.month, moment.day)
+    if bucket == "week":
+        return day - timedelta(days=day.weekday())
+    if bucket == "month":
+        return day.replace(day=1)
+    return day
+
+def bucket_range(start: datetime, end: datetime, bucket: str) -> List[datetime]:
+    """Starts of all buckets overlapping [start, end)"""
+    buckets = []
+    current = bucket_start(start, bucket)
+    while current < end:
+        buckets.append(current)
+        if bucket == "month":
+            current = add_months(current, 1, 1)
+        else:
+            current += timedelta(days=7 if bucket == "week" else 1)
+    return buckets
+
+async def spending_rows(wallet_ids: List[str], tx_type: str, start: datetime, end: datetime, bucket: str, field: str) -> List[dict]:
+    """Sum amounts per (bucket start, group key) over [start, end)"""
+    if bucket == "month" and start.day == 1 and end.day == 1:
+        # Whole months: the rollups already hold the answer
+        rows = await analytics_db.rollups.aggregate([
+            {"$match": {
+                "wallet_id": {"$in": wallet_ids},
+                "type": tx_type,
+                "month": {"$gte": month_key(start), "$lt": month_key(end)},
+                "count": {"$gt": 0}
+            }},
+            {"$group": {
+                "_id": {"bucket": "$month", "key": f"${field}"},
+                "amount": {"$sum": "$amount"},
+                "count": {"$sum": "$count"}
+            }}
+        ]).to_list(None)
+        for row in rows:
+            row["_id"]["bucket"] = datetime.strptime(row["_id"]["bucket"], "%Y-%m")
+        return rows
+    
+    match = {"wallet_id": {"$in": wallet_ids}, "type": tx_type, "created_at": {"$gte": start, "$lt": end}}
+    pipeline = [{"$match": match}]
+    horizon = await get_archive_horizon()
+    if horizon is not None and start < horizon:
+        pipeline.append({"$unionWith": {"coll": "transactions_archive", "pipeline": [{"$match": match}]}})
+    truncate = {"date": "$created_at", "unit": bucket}
+    if bucket == "week":
+        truncate["startOfWeek"] = "monday"
+    pipeline.append({"$group": {
+        "_id": {"bucket": {"$dateTrunc": truncate}, "key": f"${field}"},
+        "amount": {"$sum": "$amount"},
+        "count": {"$sum": 1}
+    }})
+    return await analytics_db.transactions.aggregate(pipeline).to_list(None)
+
+async def analytics_labels(group_by: str, keys: List[str]) -> List[str]:
+    if group_by == "wallet":
+        names = {w["id"]: w["name"] async for w in db.wallets.find({"id": {"$in": keys}}, {"_id": 0, "id": 1, "name": 1})}
+    elif group_by == "user":
+        names = {u["id"]: u["name"] async for u in db.users.find({"id": {"$in": keys}}, {"_id": 0, "id": 1, "name": 1})}
+    else:
+        names = {}
+    return [names.get(key, key) for key in keys]
+
+@api_router.get("/analytics/spending")
+async def get_spending_analytics(
+    date_from: date = Query(..., alias="from"),
+    date_to: date = Query(..., alias="to"),
+    bucket: str = Query("month", pattern="^(day|week|month)$"),
+    group_by: str = Query("category", pattern="^(category|wallet|user)$"),
+    tx_type: str = Query("expense", alias="type", pattern="^(income|expense)$"),
+    wallet_id: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """Totals per time bucket and group as columnar arrays for charts.
+    ``to`` is inclusive; buckets are UTC days, ISO weeks or calendar months.
+    ``amounts[i][j]`` is the sum for ``keys[i]`` in ``buckets[j]``."""
+    if date_to < date_from:
+        raise HTTPException(status_code=400, detail="Nieprawidłowy zakres dat")
+    
+    wallet_ids = await get_user_wallet_ids(current_user["id"])
+    if wallet_id:
+        if wallet_id not in wallet_ids:
+            raise HTTPException(status_code=403, detail="Brak dostępu do tego portfela")
+        wallet_ids = [wallet_id]
+    
+    start = datetime(date_from.year, date_from.month, date_from.day)
+    end = datetime(date_to.year, date_to.month, date_to.day) + timedelta(days=1)
+    buckets = bucket_range(start, end, bucket)
+    if len(buckets) > ANALYTICS_MAX_BUCKETS:
+        raise HTTPException(status_code=400, detail="Zbyt wiele przedziałów, wybierz większy przedział czasu")
+    
+    rows = await spending_rows(list(wallet_ids), tx_type, start, end, bucket, ANALYTICS_GROUP_FIELDS[group_by])
+    
+    keys = sorted({row["_id"]["key"] for row in rows})
+    key_index = {key: i for i, key in enumerate(keys)}
+    bucket_index = {b: i for i, b in enumerate(buckets)}
+    amounts = np.zeros((len(keys), len(buckets)), dtype=np.int64)
+    counts = np.zeros((len(keys), len(buckets)), dtype=np.int64)
+    for row in rows:
+        i, j = key_index[row["_id"]["key"]], bucket_index[row["_id"]["bucket"]]
+        amounts[i, j] += row["amount"]
+        counts[i, j] += row["count"]
+    
+    # Largest groups first, the order a legend or donut wants them in
+    order = np.argsort(-amounts.sum(axis=1), kind="stable")
+    keys = [keys[i] for i in order]
+    amounts, counts = amounts[order], counts[order]
+    
+    return {
+        "bucket": bucket,
+        "group_by": group_by,
+        "type": tx_type,
+        "buckets": [b.date().isoformat() for b in buckets],
+        "keys": keys,
+        "labels": await analytics_labels(group_by, keys),
+        "amounts": (amounts / 100).tolist(),
+        "counts": counts.tolist(),
+        "totals": (amounts.sum(axis=0) / 100).tolist()
+    }
+
+# ================== REPORTS ==================
+
+# Reports of closed months are generated once and stored in db.reports;
+# transactions that land in a closed month later drop the stored copy. The open
+# month is always computed on demand.
+
+REPORT_TOP_NOTES = 10
+
+async def build_monthly_report(user_id: str, wallets: List[dict], month: str) -> dict:
+    wallet_ids = [w["id"] for w in wallets]
+    wallet_names = {w["id"]: w["name"] for w in wallets}
+    shared_ids = {w["id"] for w in wallets if w.get("is_shared")}
+    
+    rollups = await analytics_db.rollups.find(
+        {"wallet_id": {"$in": wallet_ids}, "month": month, "count": {"$gt": 0}},
+        {"_id": 0, "applied": 0}
+    ).to_list(None)
+    
+    totals = {"income": 0, "expense": 0, "count": 0}
+    categories = {"income": {}, "expense": {}}
+    per_wallet = {}
+    per_member = {}
+    for r in rollups:
+        totals[r["type"]] += r["amount"]
+        totals["count"] += r["count"]
+        amount, count = categories[r["type"]].get(r["category"], (0, 0))
+        categories[r["type"]][r["category"]] = (amount + r["amount"], count + r["count"])
+        wallet_totals = per_wallet.setdefault(r["wallet_id"], {"income": 0, "expense": 0})
+        wallet_totals[r["type"]] += r["amount"]
+        if r["type"] == "expense" and r["wallet_id"] in shared_ids:
+            amount, count = per_member.get((r["wallet_id"], r["user_id"]), (0, 0))
+            per_member[(r["wallet_id"], r["user_id"])] = (amount + r["amount"], count + r["count"])
+    
+    member_ids = list({user for _, user in per_member})
+    member_names = {
+        u["id"]: u["name"]
+        async for u in db.users.find({"id": {"$in": member_ids}}, {"_id": 0, "id": 1, "name": 1})
+    }
+    
+    start = datetime.strptime(month, "%Y-%m")
+    end = add_months(start, 1, 1)
+    match = {
+        "wallet_id": {"$in": wallet_ids},
+        "type": "expense",
+        "created_at": {"$gte": start, "$lt": end},
+        "note": {"$nin": [None, ""]}
+    }
+    pipeline = [{"$match": match}]
+    horizon = await get_archive_horizon()
+    if horizon is not None and start < horizon:
+        pipeline.append({"$unionWith": {"coll": "transactions_archive", "pipeline": [{"$match": match}]}})
+    pipeline += [
+        {"$group": {"_id": {"$toLower": "$note"}, "note": {"$first": "$note"}, "amount": {"$sum": "$amount"}, "count": {"$sum": 1}}},
+        {"$sort": {"amount": -1}},
+        {"$limit": REPORT_TOP_NOTES}
+    ]
+    top_notes = await analytics_db.transactions.aggregate(pipeline).to_list(REPORT_TOP_NOTES)
+    
+    goals = await db.goals.find({"user_id": user_id}, {"_id": 0}).to_list(100)
+    
+    def breakdown(items: dict) -> List[dict]:
+        return [
+            {"category": c, "amount": from_minor(a), "count": n}
+            for c, (a, n) in sorted(items.items(), key=lambda item: -item[1][0])
+        ]
+    
+    return {
+        "month": month,
+        "income": from_minor(totals["income"]),
+        "expense": from_minor(totals["expense"]),
+        "net": from_minor(totals["income"] - totals["expense"]),
+        "transactions_count": totals["count"],
+        "expense_categories": breakdown(categories["expense"]),
+        "income_categories": breakdown(categories["income"]),
+        "wallets": [
+            {
+                "wallet_id": wallet_id,
+                "name": wallet_names[wallet_id],
+                "income": from_minor(t["income"]),
+                "expense": from_minor(t["expense"]),
+                "net": from_minor(t["income"] - t["expense"])
+            }
+            for wallet_id, t in per_wallet.items()
+        ],
+        "members": [
+            {
+                "wallet_id": wallet_id,
+                "user_id": member_id,
+                "name": member_names.get(member_id, ""),
+                "expense": from_minor(amount),
+                "count": count
+            }
+            for (wallet_id, member_id), (amount, count) in sorted(per_member.items(), key=lambda item: (item[0][0], -item[1][0]))
+        ],
+        "goals": [
+            {
+                "id": g["id"],
+                "name": g["name"],
+                "emoji": g["emoji"],
+                "contributed": from_minor(g.get("contributed", {}).get(month, 0)),
+                "current": from_minor(g["current_amount"]),
+                "target": from_minor(g["target_amount"])
+            }
+            for g in goals
+        ],
+        "top_notes": [
+            {"note": n["note"], "amount": from_minor(n["amount"]), "count": n["count"]}
+            for n in top_notes
+        ]
+    }
+
+def report_csv(report: dict) -> str:
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(["sekcja", "nazwa", "kwota", "liczba"])
+    writer.writerow(["suma", "przychody", report["income"], ""])
+    writer.writerow(["suma", "wydatki", report["expense"], ""])
+    writer.writerow(["suma", "bilans", report["net"], report["transactions_count"]])
+    for c in report["expense_categories"]:
+        writer.writerow(["wydatki", c["category"], c["amount"], c["count"]])
+    for c in report["income_categories"]:
+        writer.writerow(["przychody", c["category"], c["amount"], c["count"]])
+    for w in report["wallets"]:
+        writer.writerow(["portfel", w["name"], w["net"], ""])
+    for m in report["members"]:
+        writer.writerow(["członek", m["name"], m["expense"], m["count"]])
+    for g in report["goals"]:
+        writer.writerow(["cel", g["name"], g["contributed"], ""])
+    for n in report["top_notes"]:
+        writer.writerow(["notatka", n["note"], n["amount"], n["count"]])
+    return out.getvalue()
+
+@api_router.get("/reports/monthly")
+async def get_monthly_report(
+    month: str = Query(..., pattern=r"^\d{4}-\d{2}$"),
+    format: str = Query("json", pattern="^(json|csv)$"),
+    current_user: dict = Depends(get_current_user)
+):
+    """Full report of one month across all the user's wallets, as JSON or CSV"""
+    user_id = current_user["id"]
+    try:
+        datetime.strptime(month, "%Y-%m")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Nieprawidłowy miesiąc")
+    current = month_key(datetime.utcnow())
+    if month > current:
+        raise HTTPException(status_code=400, detail="Nieprawidłowy miesiąc")
+    
+    stored = await db.reports.find_one({"user_id": user_id, "month": month}, {"_id": 0, "report": 1}) if month < current else None
+    if stored:
+        report = stored["report"]
+    else:
+        wallet_ids = await get_user_wallet_ids(user_id)
+        wallets = await db.wallets.find(
+            {"id": {"$in": list(wallet_ids)}},
+            {"_id": 0, "id": 1, "name": 1, "is_shared": 1}
+        ).to_list(None)
+        report = await build_monthly_report(user_id, wallets, month)
+        if month < current:
+            await db.reports.update_one(
+                {"user_id": user_id, "month": month},
+                {"$set": {"report": report, "wallet_ids": list(wallet_ids), "generated_at": datetime.utcnow()}},
+                upsert=True
+            )
+    
+    if format == "csv":
+        return Response(
+            content=report_csv(report),
+            media_type="text/csv; charset=utf-8",
+            headers={"Content-Disposition": f'attachment; filename="raport-{month}.csv"'}
+        )
+    return report
+
+# ================== INSIGHTS ==================
+
+# Forecasts and anomaly flags are computed once a night per user and stored in
+# db.insights; the API and the AI assistant only read the stored document.
+
+INSIGHTS_HOUR = int(os.environ.get('INSIGHTS_HOUR', '3'))  # UTC hour after which the nightly run starts
+INSIGHTS_HISTORY_MONTHS = 12
+INSIGHTS_ANOMALY_WINDOW_DAYS = 180
+INSIGHTS_ANOMALY_RECENT_DAYS = 30
+INSIGHTS_ANOMALY_Z = 3.0
+INSIGHTS_MIN_SAMPLES = 5
+INSIGHTS_MAX_ANOMALIES = 10
+
+def forecast_categories(history: np.ndarray, spent: np.ndarray, elapsed: float):
+    """Month-end forecast per category from past monthly totals.
+    
+    ``history`` is categories x months, oldest first, ending with last month;
+    ``spent`` is this month so far and ``elapsed`` the fraction of it gone.
+    The baseline is the three-month average, averaged with the same month a
+    year ago when there was spend then. The rest of the month is expected at a
+    blend of baseline and current pace that trusts the pace more as the month
+    goes on."""
+    baseline = history[:, -3:].mean(axis=1)
+    if history.shape[1] >= 12:
+        seasonal = history[:, -12]
+        baseline = np.where(seasonal > 0, (baseline + seasonal) / 2, baseline)
+    pace = spent / max(elapsed, 1e-9)
+    remaining = (1 - elapsed) * (elapsed * pace + (1 - elapsed) * baseline)
+    return baseline, spent + remaining
+
+def anomaly_scores(amounts: np.ndarray, groups: np.ndarray):
+    """Leave-one-out z-score of each log amount within its group, and the
+    typical amount it was compared against. NaN where the rest of the group
+    has too few samples or no spread."""
+    logs = np.log1p(amounts)
+    counts = np.bincount(groups)[groups] - 1
+    sums = np.bincount(groups, logs)[groups] - logs
+    squares = np.bincount(groups, logs ** 2)[groups] - logs ** 2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = sums / counts
+        std = np.sqrt(np.maximum(squares / counts - mean ** 2, 0))
+        z = (logs - mean) / std
+    z[(counts < INSIGHTS_MIN_SAMPLES) | ~(std > 1e-9)] = np.nan
+    return z, np.expm1(mean)
+
+async def compute_user_insights(user_id: str, now: datetime) -> dict:
+    wallet_ids = list(await get_user_wallet_ids(user_id))
+    month = month_key(now)
+    month_start = datetime(now.year, now.month, 1)
+    months = [month_key(add_months(month_start, -i, 1)) for i in range(INSIGHTS_HISTORY_MONTHS, -1, -1)]
+    
+    rollups = await analytics_db.rollups.find(
+        {"wallet_id": {"$in": wallet_ids}, "type": "expense", "month": {"$gte": months[0]}, "count": {"$gt": 0}},
+        {"_id": 0, "month": 1, "category": 1, "amount": 1}
+    ).to_list(None)
+    categories = sorted({r["category"] for r in rollups})
+    category_index = {c: i for i, c in enumerate(categories)}
+    month_index = {m: i for i, m in enumerate(months)}
+    totals = np.zeros((len(categories), len(months)), dtype=np.int64)
+    for r in rollups:
+        if r["month"] in month_index:
+            totals[category_index[r["category"]], month_index[r["month"]]] += r["amount"]
+    
+    days_in_month = calendar.monthrange(now.year, now.month)[1]
+    elapsed = ((now - month_start).total_seconds() / 86400) / days_in_month
+    baseline, forecast = forecast_categories(totals[:, :-1].astype(float), totals[:, -1].astype(float), elapsed)
+    forecasts = [
+        {
+            "category": c,
+            "spent": int(totals[i, -1]),
+            "baseline": int(round(baseline[i])),
+            "forecast": int(round(forecast[i]))
+        }
+        for i, c in enumerate(categories)
+        if forecast[i] > 0
+    ]
+    forecasts.sort(key=lambda f: -f["forecast"])
+    
+    transactions = await analytics_db.transactions.find(
+        {
+            "wallet_id": {"$in": wallet_ids},
+            "type": "expense",
+            "created_at": {"$gte": now - timedelta(days=INSIGHTS_ANOMALY_WINDOW_DAYS)}
+        },
+        {"_id": 0, "id": 1, "wallet_id": 1, "amount": 1, "category": 1, "note": 1, "created_at": 1}
+    ).to_list(None)
+    anomalies = []
+    if transactions:
+        amounts = np.fromiter((tx["amount"] for tx in transactions), dtype=float, count=len(transactions))
+        _, groups = np.unique(np.array([tx["category"] for tx in transactions], dtype=object).astype(str), return_inverse=True)
+        z, typical = anomaly_scores(amounts, groups)
+        recent_since = now - timedelta(days=INSIGHTS_ANOMALY_RECENT_DAYS)
+        flagged = [
+            i for i in np.flatnonzero(z >= INSIGHTS_ANOMALY_Z)
+            if transactions[i]["created_at"] >= recent_since
+        ]
+        flagged.sort(key=lambda i: -z[i])
+        anomalies = [
+            {
+                "transaction_id": transactions[i]["id"],
+                "wallet_id": transactions[i]["wallet_id"],
+                "category": transactions[i]["category"],
+                "amount": transactions[i]["amount"],
+                "typical": int(round(typical[i])),
+                "z_score": round(float(z[i]), 2),
+                "note": transactions[i].get("note"),
+                "created_at": transactions[i]["created_at"]
+            }
+            for i in flagged[:INSIGHTS_MAX_ANOMALIES]
+        ]
+    
+    return {
+        "user_id": user_id,
+        "month": month,
+        "computed_at": now,
+        "forecast_total": sum(f["forecast"] for f in forecasts),
+        "forecasts": forecasts,
+        "anomalies": anomalies
     }
 
+async def compute_insights(now: Optional[datetime] = None):
+    now = now or datetime.utcnow()
+    count = 0
+    async for user in db.users.find({}, {"_id": 0, "id": 1}):
+        insights = await compute_user_insights(user["id"], now)
+        await db.insights.replace_one({"user_id": user["id"]}, insights, upsert=True)
+        count += 1
+    logger.info(f"Computed insights for {count} users")
+
+async def run_nightly_insights():
+    now = datetime.utcnow()
+    if now.hour < INSIGHTS_HOUR:
+        return
+    today = now.date().isoformat()
+    try:
+        result = await db.meta.update_one(
+            {"_id": "insights", "last_run": {"$ne": today}},
+            {"$set": {"last_run": today}},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        return
+    if result.modified_count or result.upserted_id is not None:
+        await compute_insights(now)
+
+def insights_response(insights: dict) -> InsightsResponse:
+    return InsightsResponse(
+        month=insights["month"],
+        computed_at=insights["computed_at"],
+        forecast_total=from_minor(insights["forecast_total"]),
+        forecasts=[
+            InsightForecast(**{**f, **{k: from_minor(f[k]) for k in ("spent", "baseline", "forecast")}})
+            for f in insights["forecasts"]
+        ],
+        anomalies=[
+            InsightAnomaly(**{**a, "amount": from_minor(a["amount"]), "typical": from_minor(a["typical"])})
+            for a in insights["anomalies"]
+        ]
+    )
+
+@api_router.get("/insights", response_model=InsightsResponse)
+async def get_insights(current_user: dict = Depends(get_current_user)):
+    """This month's spending forecast and unusual transactions from the nightly run"""
+    insights = await db.insights.find_one({"user_id": current_user["id"]}, {"_id": 0})
+    if not insights:
+        return InsightsResponse()
+    return insights_response(insights)
+
+def insights_prompt(insights: Optional[dict]) -> str:
+    if not insights or insights["month"] != month_key(datetime.utcnow()):
+        return ""
+    lines = [f"\nPrognoza wydatków na ten miesiąc: {from_minor(insights['forecast_total']):.2f} PLN"]
+    lines += [
+        f"- {f['category']}: wydano {from_minor(f['spent']):.2f}, prognoza {from_minor(f['forecast']):.2f} PLN (zwykle {from_minor(f['baseline']):.2f})"
+        for f in insights["forecasts"][:5]
+    ]
+    if insights["anomalies"]:
+        lines.append("Nietypowe wydatki:")
+        lines += [
+            f"- {a['created_at']:%d.%m} {a['category']}: {from_minor(a['amount']):.2f} PLN (zwykle ok. {from_minor(a['typical']):.2f})"
+            for a in insights["anomalies"][:3]
+        ]
+    return "\n".join(lines)
+
 # ================== MAIN ROUTES ==================
 
 @api_router.get("/")
 async def root():
     return {"message": "Witaj w Cenny Grosz API!", "version": "1.0.0"}
 
+@api_router.get("/metrics")
+async def get_metrics():
+    return {
+        **metrics,
+        "ai_cache_size": len(_ai_response_cache),
+        "jobs_pending": await db.jobs.count_documents({"status": {"$in": ["pending", "running"]}}),
+        "jobs_failed_stored": await db.jobs.count_documents({"status": "failed"}),
+        "mongo_pool": pool_stats.snapshot(),
+        "timestamp": datetime.utcnow()
+    }
+
 @api_router.get("/health")
 async def health_check():
-    return {"status": "healthy", "timestamp": datetime.utcnow()}
+    return {"status": "healthy", "mongo_pool": pool_stats.snapshot(), "timestamp": datetime.utcnow()}
+
+# ================== HEALTH PROBES ==================
+
+# /health/live only says the process answers; /health/ready also checks that
+# MongoDB responds, the event loop is not stalled and the connection pool is
+# not exhausted. An open LLM circuit breaker is reported but does not fail
+# readiness, since everything except AI chat still works.
+
+HEALTH_PING_TIMEOUT_SECONDS = float(os.environ.get('HEALTH_PING_TIMEOUT_SECONDS', '1'))
+HEALTH_MAX_LOOP_LAG_MS = float(os.environ.get('HEALTH_MAX_LOOP_LAG_MS', '500'))
+HEALTH_CACHE_SECONDS = 1.0
+
+class LoopLagMonitor:
+    """Samples how late a short sleep wakes up; the overshoot is time the event
+    loop spent blocked on something else"""
+
+    def __init__(self, interval: float, samples: int):
+        self.interval = interval
+        self._samples = deque(maxlen=samples)
+
+    @property
+    def lag_ms(self) -> float:
+        return max(self._samples, default=0.0)
+
+    async def run(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self._samples.append(max(0.0, time.monotonic() - started - self.interval) * 1000)
+
+loop_lag = LoopLagMonitor(0.5, 10)
+
+async def ping_mongo() -> dict:
+    started = time.monotonic()
+    try:
+        await asyncio.wait_for(client.admin.command("ping"), HEALTH_PING_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        return {"ok": False, "error": f"timeout after {HEALTH_PING_TIMEOUT_SECONDS}s"}
+    except Exception as e:
+        return {"ok": False, "error": str(e)}
+    return {"ok": True, "latency_ms": round((time.monotonic() - started) * 1000, 1)}
+
+async def readiness() -> dict:
+    pool = pool_stats.snapshot()
+    lag_ms = round(loop_lag.lag_ms, 1)
+    checks = {
+        "mongo": await ping_mongo(),
+        "event_loop": {"ok": lag_ms <= HEALTH_MAX_LOOP_LAG_MS, "lag_ms": lag_ms},
+        "mongo_pool": {"ok": not (pool["in_use"] >= pool["max_size"] and pool["waiting"] > 0), **pool},
+        "llm": {"ok": True, "breaker": llm_guard.breaker.state}
+    }
+    ready = all(check["ok"] for check in checks.values())
+    return {"status": "ready" if ready else "not_ready", "checks": checks, "timestamp": datetime.utcnow()}
+
+_readiness_cache: dict = {}
+_readiness_lock = asyncio.Lock()
+
+async def cached_readiness() -> dict:
+    """Readiness computed at most once per HEALTH_CACHE_SECONDS, shared by
+    concurrent probes"""
+    async with _readiness_lock:
+        if time.monotonic() - _readiness_cache.get("at", float("-inf")) >= HEALTH_CACHE_SECONDS:
+            _readiness_cache["result"] = await readiness()
+            _readiness_cache["at"] = time.monotonic()
+        return _readiness_cache["result"]
+
+@api_router.get("/health/live")
+async def liveness_check():
+    return {"status": "alive", "timestamp": datetime.utcnow()}
+
+@api_router.get("/health/ready")
+async def readiness_check():
+    result = await cached_readiness()
+    status_code = 200 if result["status"] == "ready" else 503
+    return JSONResponse(status_code=status_code, content=jsonable_encoder(result))
+
+# ================== RATE LIMITING ==================
+
+# Token buckets per route budget and client: the user id from a valid bearer
+# token, otherwise the client IP. Login is always keyed by IP (and by target
+# email in the route), since anyone can register accounts to mint tokens.
+# Budgets are "<requests>/<seconds>"; "0" turns one off. RATE_LIMIT_BACKEND=mongo
+# shares the buckets between workers at the cost of one update per limited request.
+
+RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'memory')  # "memory" or "mongo"
+# Reverse proxies in front of the app that append to X-Forwarded-For; the client
+# address is the entry the outermost of them added. RATE_LIMIT_TRUST_PROXY=1 means 1.
+RATE_LIMIT_PROXY_HOPS = int(os.environ.get('RATE_LIMIT_PROXY_HOPS', os.environ.get('RATE_LIMIT_TRUST_PROXY', '0')))
+RATE_LIMIT_MAX_KEYS = int(os.environ.get('RATE_LIMIT_MAX_KEYS', '100000'))
+
+class RateBudget:
+    def __init__(self, name: str, spec: str, per_user: bool = True):
+        self.name = name
+        self.per_user = per_user
+        count, _, seconds = spec.partition("/")
+        self.capacity = int(count)
+        self.rate = self.capacity / float(seconds or 1)
+
+RATE_LIMIT_BUDGETS = {
+    ("POST", "/api/auth/login"): RateBudget("login", os.environ.get('RATE_LIMIT_LOGIN', '10/60'), per_user=False),
+    ("GET", "/api/users/search"): RateBudget("user_search", os.environ.get('RATE_LIMIT_USER_SEARCH', '30/60')),
+    ("POST", "/api/ai/chat"): RateBudget("ai_chat", os.environ.get('RATE_LIMIT_AI_CHAT', '10/60')),
+    # Load balancer probes are never limited, even with RATE_LIMIT_DEFAULT set
+    ("GET", "/api/health"): RateBudget("health", "0"),
+    ("GET", "/api/health/live"): RateBudget("health", "0"),
+    ("GET", "/api/health/ready"): RateBudget("health", "0"),
+}
+RATE_LIMIT_DEFAULT = RateBudget("default", os.environ.get('RATE_LIMIT_DEFAULT', '0'))
+# Attempts per target account from one address
+RATE_LIMIT_LOGIN_EMAIL = RateBudget("login_email", os.environ.get('RATE_LIMIT_LOGIN_EMAIL', '30/3600'), per_user=False)
+
+class RateLimiter:
+    """In-process token buckets, least recently used first so that idle keys
+    (whose buckets have refilled) can be dropped from the front in O(1)"""
+
+    def __init__(self, max_keys: int, idle_seconds: float):
+        self.max_keys = max_keys
+        self.idle_seconds = idle_seconds
+        self._buckets: OrderedDict = OrderedDict()
+
+    async def acquire(self, key: str, budget: RateBudget) -> float:
+        """Take a token; returns 0 if allowed, else seconds until one is available"""
+        now = time.monotonic()
+        tokens, last = self._buckets.pop(key, (budget.capacity, now))
+        tokens = min(budget.capacity, tokens + (now - last) * budget.rate)
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / budget.rate
+        self._buckets[key] = (tokens, now)
+        
+        while self._buckets:
+            _, (_, oldest) = next(iter(self._buckets.items()))
+            if len(self._buckets) <= self.max_keys and now - oldest < self.idle_seconds:
+                break
+            self._buckets.popitem(last=False)
+        return wait
+
+    def __len__(self):
+        return len(self._buckets)
+
+class MongoRateLimiter:
+    """Token buckets in db.rate_limits, refilled and taken in one pipeline update
+    against the server clock. Fails open if the database is unavailable."""
+
+    def __init__(self, idle_seconds: float):
+        self.idle_seconds = idle_seconds
+
+    async def acquire(self, key: str, budget: RateBudget) -> float:
+        elapsed = {"$divide": [{"$subtract": ["$$NOW", {"$ifNull": ["$ts", "$$NOW"]}]}, 1000]}
+        refilled = {"$min": [budget.capacity, {"$add": [{"$ifNull": ["$tokens", budget.capacity]}, {"$multiply": [elapsed, budget.rate]}]}]}
+        try:
+            bucket = await db.rate_limits.find_one_and_update(
+                {"_id": key},
+                [
+                    {"$set": {"tokens": refilled, "ts": "$$NOW"}},
+                    {"$set": {
+                        "allowed": {"$gte": ["$tokens", 1]},
+                        "tokens": {"$cond": [{"$gte": ["$tokens", 1]}, {"$subtract": ["$tokens", 1]}, "$tokens"]},
+                        "expires_at": {"$add": ["$$NOW", int(self.idle_seconds * 1000)]}
+                    }}
+                ],
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except Exception as e:
+            logger.warning(f"Rate limiter unavailable: {str(e)}")
+            return 0.0
+        return 0.0 if bucket["allowed"] else (1 - bucket["tokens"]) / budget.rate
+
+# Long enough for any bucket to refill completely
+RATE_LIMIT_IDLE_SECONDS = max(
+    [b.capacity / b.rate for b in [*RATE_LIMIT_BUDGETS.values(), RATE_LIMIT_DEFAULT] if b.capacity] or [60]
+)
+rate_limiter = MongoRateLimiter(RATE_LIMIT_IDLE_SECONDS) if RATE_LIMIT_BACKEND == "mongo" else RateLimiter(RATE_LIMIT_MAX_KEYS, RATE_LIMIT_IDLE_SECONDS)
+
+_proxy_hops_warned = False
+
+def rate_limit_ip(scope, headers: dict) -> str:
+    global _proxy_hops_warned
+    forwarded = headers.get(b"x-forwarded-for")
+    if forwarded and RATE_LIMIT_PROXY_HOPS:
+        hops = [hop.strip() for hop in forwarded.decode("latin-1").split(",")]
+        # Entries left of those added by our own proxies can be forged by the client
+        return hops[max(len(hops) - RATE_LIMIT_PROXY_HOPS, 0)]
+    if forwarded and not _proxy_hops_warned:
+        _proxy_hops_warned = True
+        logger.warning("Requests carry X-Forwarded-For but RATE_LIMIT_PROXY_HOPS is 0: "
+                       "rate limits by IP apply to the proxy, shared by all its clients")
+    return scope["client"][0] if scope.get("client") else "unknown"
+
+def rate_limit_client(scope, budget: RateBudget) -> str:
+    headers = dict(scope["headers"])
+    authorization = headers.get(b"authorization", b"").decode("latin-1")
+    if budget.per_user and authorization.startswith("Bearer "):
+        try:
+            # Signature check only; revocation is get_current_user's job
+            return "user:" + jwt.decode(authorization[7:], JWT_SECRET, algorithms=["HS256"])["user_id"]
+        except (jwt.InvalidTokenError, KeyError):
+            pass
+    return "ip:" + rate_limit_ip(scope, headers)
+
+async def enforce_rate_limit(budget: RateBudget, key: str):
+    """Rate limit inside a route, for keys only known once the body is parsed"""
+    if not budget.capacity:
+        return
+    wait = await rate_limiter.acquire(f"{budget.name}:{key}", budget)
+    if wait > 0:
+        metrics[f"rate_limited_{budget.name}"] += 1
+        raise HTTPException(
+            status_code=429,
+            detail="Zbyt wiele żądań, spróbuj ponownie później",
+            headers={"Retry-After": str(math.ceil(wait))}
+        )
+
+class RateLimitMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            budget = RATE_LIMIT_BUDGETS.get((scope["method"], scope["path"].rstrip("/")), RATE_LIMIT_DEFAULT)
+            if budget.capacity and scope["path"].startswith("/api"):
+                wait = await rate_limiter.acquire(f"{budget.name}:{rate_limit_client(scope, budget)}", budget)
+                if wait > 0:
+                    metrics[f"rate_limited_{budget.name}"] += 1
+                    response = JSONResponse(
+                        {"detail": "Zbyt wiele żądań, spróbuj ponownie później"},
+                        status_code=429,
+                        headers={"Retry-After": str(math.ceil(wait))}
+                    )
+                    await response(scope, receive, send)
+                    return
+        await self.app(scope, receive, send)
 
 # Include the router in the main app
 app.include_router(api_router)
 
+# Added before CORS so that 429 responses still carry CORS headers
+app.add_middleware(RateLimitMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -970,6 +4085,231 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# ================== MIGRATIONS ==================
+
+async def migrate_money_to_minor_units():
+    """Convert float PLN amounts left by earlier versions to integer grosze"""
+    money_fields = {
+        "wallets": ["balance"],
+        "transactions": ["amount"],
+        "goals": ["target_amount", "current_amount"],
+    }
+    for collection, fields in money_fields.items():
+        for field in fields:
+            result = await db[collection].update_many(
+                {field: {"$type": "double"}},
+                [{"$set": {field: {"$toLong": {"$round": [{"$multiply": [f"${field}", 100]}, 0]}}}}]
+            )
+            if result.modified_count:
+                logger.info(f"Migrated {result.modified_count} {collection}.{field} values to grosze")
+
+# Applied in order, each once; every migration must be idempotent since several
+# workers may start at the same time
+async def backfill_wallet_members(batch_size: int = 1000):
+    """Mirror existing wallets.members into the wallet_members collection"""
+    ops = []
+    async for wallet in db.wallets.find({"members.0": {"$exists": True}}, {"_id": 0, "id": 1, "members": 1, "member_joined": 1, "created_at": 1}):
+        for member_id in wallet["members"]:
+            ops.append(UpdateOne(
+                {"wallet_id": wallet["id"], "user_id": member_id},
+                {"$setOnInsert": {"joined_at": wallet.get("member_joined", {}).get(member_id, wallet["created_at"])}},
+                upsert=True
+            ))
+        if len(ops) >= batch_size:
+            await db.wallet_members.bulk_write(ops, ordered=False)
+            ops = []
+    if ops:
+        await db.wallet_members.bulk_write(ops, ordered=False)
+
+async def backfill_wallet_spent_by():
+    """Initialise per-author spend counters on wallets from the rollups"""
+    totals = await db.rollups.aggregate([
+        {"$match": {"type": "expense"}},
+        {"$group": {"_id": {"wallet_id": "$wallet_id", "user_id": "$user_id"}, "amount": {"$sum": "$amount"}}}
+    ]).to_list(None)
+    spent_by = {}
+    for t in totals:
+        spent_by.setdefault(t["_id"]["wallet_id"], {})[t["_id"]["user_id"]] = t["amount"]
+    for batch_start in range(0, len(spent_by), 1000):
+        await db.wallets.bulk_write([
+            UpdateOne({"id": wallet_id}, {"$set": {"spent_by": amounts}})
+            for wallet_id, amounts in list(spent_by.items())[batch_start:batch_start + 1000]
+        ], ordered=False)
+
+MIGRATIONS = [
+    ("money_minor_units", migrate_money_to_minor_units),
+    ("transaction_rollups", rebuild_rollups),
+    ("transaction_search_tokens", backfill_search_tokens),
+    ("wallet_members", backfill_wallet_members),
+    ("wallet_spent_by", backfill_wallet_spent_by),
+]
+
+# 0 disables the TTL / compaction; chats must be compacted before they expire
+AI_CHAT_RETENTION_DAYS = int(os.environ.get('AI_CHAT_RETENTION_DAYS', '0'))
+AI_CHAT_COMPACT_AFTER_DAYS = int(os.environ.get('AI_CHAT_COMPACT_AFTER_DAYS', '0'))
+if 0 < AI_CHAT_COMPACT_AFTER_DAYS and 0 < AI_CHAT_RETENTION_DAYS <= AI_CHAT_COMPACT_AFTER_DAYS:
+    raise RuntimeError(
+        f"AI_CHAT_COMPACT_AFTER_DAYS ({AI_CHAT_COMPACT_AFTER_DAYS}) must be less than "
+        f"AI_CHAT_RETENTION_DAYS ({AI_CHAT_RETENTION_DAYS}), otherwise chats expire before they are summarised"
+    )
+
+async def ensure_ttl_index(collection, field: str, expire_after_seconds: int, name: str):
+    """Create a TTL index, or update its expiry in place when it already exists"""
+    try:
+        await collection.create_index(field, name=name, expireAfterSeconds=expire_after_seconds)
+    except OperationFailure:
+        await db.command("collMod", collection.name, index={"name": name, "expireAfterSeconds": expire_after_seconds})
+
+@app.on_event("startup")
+async def check_database():
+    """Fail fast with a clear log line when MongoDB is unreachable"""
+    try:
+        await client.admin.command("ping")
+    except Exception:
+        logger.exception(f"MongoDB not reachable within {MONGO_SERVER_SELECTION_TIMEOUT_MS} ms")
+        raise
+    logger.info(f"Connected to MongoDB (pool {MONGO_MIN_POOL_SIZE}-{MONGO_MAX_POOL_SIZE}, analytics reads: {MONGO_ANALYTICS_READ_PREFERENCE})")
+
+@app.on_event("startup")
+async def create_indexes():
+    await db.categories.create_index([("user_id", 1), ("type", 1), ("created_at", 1)])
+    await db.wallets.create_index("id", unique=True)
+    await db.wallets.create_index("owner_id")
+    await db.wallets.create_index("members")
+    await db.wallet_members.create_index([("wallet_id", 1), ("user_id", 1)], unique=True)
+    await db.wallet_members.create_index("user_id")
+    await db.wallet_invitations.create_index("id", unique=True)
+    await db.wallet_invitations.create_index([("invitee_id", 1), ("status", 1), ("created_at", -1)])
+    await db.wallet_invitations.create_index(
+        [("wallet_id", 1), ("invitee_id", 1)],
+        unique=True,
+        partialFilterExpression={"status": "pending"}
+    )
+    await db.ai_chats.create_index([("user_id", 1), ("timestamp", -1), ("_id", -1)])
+    if AI_CHAT_RETENTION_DAYS > 0:
+        await ensure_ttl_index(db.ai_chats, "timestamp", AI_CHAT_RETENTION_DAYS * 86400, "ai_chats_ttl")
+    else:
+        try:
+            await db.ai_chats.drop_index("ai_chats_ttl")
+        except OperationFailure:
+            pass
+    await db.ai_chat_summaries.create_index([("user_id", 1), ("month", -1)], unique=True)
+    await db.ai_chats.create_index("id", unique=True, sparse=True)
+    await db.jobs.create_index([("status", 1), ("run_at", 1)])
+    await db.transactions.create_index("id", unique=True)
+    await db.transactions.create_index([("wallet_id", 1), ("search_tokens", 1), ("created_at", -1)])
+    await db.transactions.create_index([("wallet_id", 1), ("created_at", -1), ("id", -1)])
+    await db.transactions.create_index("created_at")
+    await db.transactions_archive.create_index("id", unique=True)
+    await db.transactions_archive.create_index([("wallet_id", 1), ("created_at", -1), ("id", -1)])
+    await db.transactions_archive.create_index([("wallet_id", 1), ("search_tokens", 1), ("created_at", -1)])
+    await db.recurring_rules.create_index("id", unique=True)
+    await db.recurring_rules.create_index([("active", 1), ("next_run_at", 1)])
+    await db.recurring_rules.create_index([("user_id", 1), ("next_run_at", 1)])
+    await db.recurring_rules.create_index("lease_id", sparse=True)
+    await db.rollups.create_index([("wallet_id", 1), ("month", 1), ("type", 1), ("category", 1), ("user_id", 1)], unique=True)
+    await db.budgets.create_index("id", unique=True)
+    await db.budgets.create_index([("user_id", 1), ("wallet_id", 1), ("category", 1)], unique=True)
+    await db.budgets.create_index([("wallet_id", 1), ("category", 1)])
+    await db.budget_alerts.create_index([("user_id", 1), ("created_at", -1)])
+    await db.reports.create_index([("user_id", 1), ("month", 1)], unique=True)
+    await db.reports.create_index([("wallet_ids", 1), ("month", 1)])
+    await db.insights.create_index("user_id", unique=True)
+    await db.goal_contributions.create_index("id", unique=True)
+    await db.revoked_tokens.create_index("expires_at", expireAfterSeconds=0)
+    await db.used_refresh_tokens.create_index("expires_at", expireAfterSeconds=0)
+    await db.rate_limits.create_index("expires_at", expireAfterSeconds=0)
+    await db.goal_contributions.create_index([("goal_id", 1), ("created_at", -1), ("id", -1)])
+
+@app.on_event("startup")
+async def run_migrations():
+    applied = {m["name"] async for m in db.migrations.find({}, {"_id": 0, "name": 1})}
+    for name, migration in MIGRATIONS:
+        if name in applied:
+            continue
+        await migration()
+        await db.migrations.update_one(
+            {"name": name},
+            {"$setOnInsert": {"name": name, "applied_at": datetime.utcnow()}},
+            upsert=True
+        )
+
+# ================== BACKGROUND TASKS ==================
+
+WORKER_ID = uuid.uuid4().hex
+
+_background_tasks: List[asyncio.Task] = []
+
+async def acquire_lease(name: str, ttl_seconds: float) -> bool:
+    """Take or renew a named lease so that only one worker runs a job at a time"""
+    now = datetime.utcnow()
+    try:
+        await db.leases.find_one_and_update(
+            {"_id": name, "$or": [{"until": {"$lt": now}}, {"owner": WORKER_ID}]},
+            {"$set": {"owner": WORKER_ID, "until": now + timedelta(seconds=ttl_seconds)}},
+            upsert=True
+        )
+        return True
+    except DuplicateKeyError:
+        return False
+
+async def run_periodically(name: str, interval: float, job):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            if await acquire_lease(name, interval):
+                await job()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Background task {name} failed: {str(e)}")
+
+def start_background_task(coro):
+    _background_tasks.append(asyncio.create_task(coro))
+
+async def reload_revocation_list(interval: float = 3600):
+    # Every worker keeps its own filter, so this runs everywhere without a lease
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await revocation_list.load()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Reloading revoked tokens failed: {str(e)}")
+
+@app.on_event("startup")
+async def start_background_tasks():
+    await revocation_list.load()
+    start_background_task(reload_revocation_list())
+    start_background_task(loop_lag.run())
+    job_queue.start()
+    start_background_task(run_periodically("recurring_transactions", RECURRING_TICK_SECONDS, materialize_recurring_transactions))
+    start_background_task(run_periodically("insights", 3600, run_nightly_insights))
+    if ARCHIVE_AFTER_DAYS > 0:
+        start_background_task(run_periodically(
+            "archive_transactions",
+            3600,
+            lambda: archive_transactions(datetime.utcnow() - timedelta(days=ARCHIVE_AFTER_DAYS))
+        ))
+    if AI_CHAT_COMPACT_AFTER_DAYS > 0:
+        start_background_task(run_periodically(
+            "compact_ai_chats",
+            3600,
+            lambda: compact_ai_chats(datetime.utcnow() - timedelta(days=AI_CHAT_COMPACT_AFTER_DAYS))
+        ))
+
+@app.on_event("shutdown")
+async def stop_background_tasks():
+    for task in _background_tasks:
+        task.cancel()
+    await job_queue.stop()
+
+@app.on_event("startup")
+async def start_invalidation_bus():
+    await invalidation_bus.start()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await invalidation_bus.stop()
     client.close()
@@ -7,6 +7,8 @@ Testing all authentication, wallet, transaction, goal, and AI assistant APIs
 import requests
 import json
 import sys
+import time
+import uuid
 from datetime import datetime
 import os
 from typing import Dict, Optional, Any
@@ -74,13 +76,14 @@ class TestRunner:
         print()
 
     def make_request(self, method: str, endpoint: str, data: Optional[Dict] = None, 
-                    auth: bool = True, expected_status: int = None) -> requests.Response:
-        """Make HTTP request with optional authentication"""
+                    auth: bool = True, expected_status: int = None, token: Optional[str] = None) -> requests.Response:
+        """Make HTTP request with optional authentication (token overrides the test user's)"""
         url = f"{BASE_URL}{endpoint}"
         headers = {"Content-Type": "application/json"}
         
-        if auth and self.auth_token:
-            headers["Authorization"] = f"Bearer {self.auth_token}"
+        token = token or self.auth_token
+        if auth and token:
+            headers["Authorization"] = f"Bearer {token}"
         
         try:
             if method.upper() == "GET":
@@ -197,6 +200,59 @@ class TestRunner:
                         f"Get user failed: {response.status_code} - {response.text}")
         return False
 
+    def test_token_lifecycle(self):
+        """Test refresh, refresh token reuse, logout and password change on a throwaway user"""
+        user = {
+            "email": f"tokeny.{uuid.uuid4().hex[:8]}@test.pl",
+            "password": "TestoweHaslo2025!",
+            "name": "Tomasz Tokenowy"
+        }
+        response = self.make_request("POST", "/auth/register", user, auth=False)
+        tokens = response.json() if response.status_code == 200 else {}
+        if not tokens.get("refresh_token"):
+            self.log_test("Token Lifecycle: Register", False, 
+                        f"No refresh token on registration: {response.status_code} - {response.text}")
+            return False
+        self.log_test("Token Lifecycle: Register", True, f"Access token valid for {tokens.get('expires_in')} s")
+        
+        # Refresh returns a working pair
+        response = self.make_request("POST", "/auth/refresh", {"refresh_token": tokens["refresh_token"]}, auth=False)
+        refreshed = response.json() if response.status_code == 200 else {}
+        me = self.make_request("GET", "/auth/me", token=refreshed.get("access_token"))
+        self.log_test("Token Lifecycle: Refresh", 
+                      bool(refreshed.get("access_token")) and me.status_code == 200, 
+                      f"Refresh: {response.status_code}, /auth/me with new token: {me.status_code}")
+        
+        # Presenting the used refresh token again revokes the whole session
+        reuse = self.make_request("POST", "/auth/refresh", {"refresh_token": tokens["refresh_token"]}, auth=False)
+        after = self.make_request("POST", "/auth/refresh", {"refresh_token": refreshed.get("refresh_token")}, auth=False)
+        self.log_test("Token Lifecycle: Refresh Reuse", 
+                      reuse.status_code == 401 and after.status_code == 401, 
+                      f"Reused token: {reuse.status_code}, newer token of the same session: {after.status_code}")
+        
+        # Logout revokes both tokens of the session
+        login = self.make_request("POST", "/auth/login", {"email": user["email"], "password": user["password"]}, auth=False).json()
+        logout = self.make_request("POST", "/auth/logout", token=login.get("access_token"))
+        me = self.make_request("GET", "/auth/me", token=login.get("access_token"))
+        refresh = self.make_request("POST", "/auth/refresh", {"refresh_token": login.get("refresh_token")}, auth=False)
+        self.log_test("Token Lifecycle: Logout", 
+                      logout.status_code == 200 and me.status_code == 401 and refresh.status_code == 401, 
+                      f"Logout: {logout.status_code}, access: {me.status_code}, refresh: {refresh.status_code}")
+        
+        # A password change invalidates every earlier token; iat has whole-second resolution
+        login = self.make_request("POST", "/auth/login", {"email": user["email"], "password": user["password"]}, auth=False).json()
+        time.sleep(1.1)
+        change = self.make_request("POST", "/auth/change-password", 
+                                   {"current_password": user["password"], "new_password": "NoweHaslo2025!"}, 
+                                   token=login.get("access_token"))
+        old = self.make_request("GET", "/auth/me", token=login.get("access_token"))
+        new = self.make_request("GET", "/auth/me", token=change.json().get("access_token") if change.status_code == 200 else None)
+        relogin = self.make_request("POST", "/auth/login", {"email": user["email"], "password": "NoweHaslo2025!"}, auth=False)
+        success = change.status_code == 200 and old.status_code == 401 and new.status_code == 200 and relogin.status_code == 200
+        self.log_test("Token Lifecycle: Change Password", success, 
+                      f"Change: {change.status_code}, old token: {old.status_code}, new token: {new.status_code}, login with new password: {relogin.status_code}")
+        return success
+
     # ================== WALLET TESTS ==================
     
     def test_get_default_wallet(self):
@@ -375,6 +431,25 @@ class TestRunner:
                         f"Failed to get wallet: {response.status_code} - {response.text}")
         return False
 
+    def test_update_transaction(self, transaction_id: str):
+        """Test editing a transaction's amount and note"""
+        update_data = {"amount": 300.0, "note": "Zakupy w Lidlu"}
+        response = self.make_request("PUT", f"/transactions/{transaction_id}", update_data)
+        
+        if response.status_code == 200:
+            transaction = response.json()
+            if transaction["amount"] == 300.0 and transaction.get("updated_at"):
+                self.log_test("Update Transaction", True, 
+                            f"Transaction updated to -{transaction['amount']} PLN")
+                return transaction
+            else:
+                self.log_test("Update Transaction", False, 
+                            f"Unexpected transaction after update: {transaction}")
+        else:
+            self.log_test("Update Transaction", False, 
+                        f"Transaction update failed: {response.status_code} - {response.text}")
+        return None
+
     def test_delete_transaction(self, transaction_id: str):
         """Test transaction deletion"""
         response = self.make_request("DELETE", f"/transactions/{transaction_id}")
@@ -613,6 +688,7 @@ class TestRunner:
                 return False
         
         self.test_get_current_user()
+        self.test_token_lifecycle()
         
         # Wallet tests
         self.test_get_default_wallet()
@@ -634,6 +710,10 @@ class TestRunner:
             expected_balance = initial_balance + 2500.0 - 350.0
             self.test_wallet_balance_update(test_wallet_id, expected_balance)
             
+            # Editing the expense moves the balance by the difference only
+            if expense_tx and self.test_update_transaction(expense_tx['id']):
+                self.test_wallet_balance_update(test_wallet_id, expected_balance + 50.0)
+            
             self.test_get_transactions()
             
             # Test invalid transaction type
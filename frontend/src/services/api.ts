@@ -5,26 +5,71 @@ import { useStore, isDemoUser } from '../store/store';
 
 const API_URL = process.env.EXPO_PUBLIC_BACKEND_URL || '';
 
+// Endpoints whose 401 means bad credentials rather than an expired access token
+const NO_REFRESH_ENDPOINTS = ['/auth/login', '/auth/register', '/auth/refresh'];
+
 class Api {
   private token: string | null = null;
+  private refreshToken: string | null = null;
+  private refreshing: Promise<boolean> | null = null;
 
   async init() {
     this.token = await AsyncStorage.getItem('token');
+    this.refreshToken = await AsyncStorage.getItem('refreshToken');
   }
 
-  setToken(token: string | null) {
+  setToken(token: string | null, refreshToken: string | null = null) {
     this.token = token;
+    this.refreshToken = refreshToken;
     if (token) {
       AsyncStorage.setItem('token', token);
     } else {
       AsyncStorage.removeItem('token');
     }
+    if (refreshToken) {
+      AsyncStorage.setItem('refreshToken', refreshToken);
+    } else {
+      AsyncStorage.removeItem('refreshToken');
+    }
+  }
+
+  // Access tokens are short-lived; trade the refresh token for a new pair.
+  // Concurrent callers share one request: a refresh token works only once,
+  // and presenting it a second time ends the whole session.
+  private refresh(): Promise<boolean> {
+    if (!this.refreshing) {
+      this.refreshing = this.requestRefresh().finally(() => {
+        this.refreshing = null;
+      });
+    }
+    return this.refreshing;
   }
 
-  private async fetch<T>(endpoint: string, options: RequestInit = {}): Promise<T> {
+  private async requestRefresh(): Promise<boolean> {
+    if (!this.refreshToken) {
+      this.refreshToken = await AsyncStorage.getItem('refreshToken');
+    }
+    if (!this.refreshToken) return false;
+
+    const res = await fetch(`${API_URL}/api/auth/refresh`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ refresh_token: this.refreshToken }),
+    });
+    if (!res.ok) {
+      this.setToken(null);
+      return false;
+    }
+    const data = await res.json();
+    this.setToken(data.access_token, data.refresh_token);
+    return true;
+  }
+
+  private async fetch<T>(endpoint: string, options: RequestInit = {}, retry = true): Promise<T> {
     if (!this.token) {
       this.token = await AsyncStorage.getItem('token');
     }
+    const sentToken = this.token;
 
     const res = await fetch(`${API_URL}/api${endpoint}`, {
       ...options,
@@ -35,6 +80,13 @@ class Api {
       },
     });
 
+    if (res.status === 401 && retry && !NO_REFRESH_ENDPOINTS.includes(endpoint)) {
+      // Another request may already have refreshed the token this one was sent with
+      if (this.token !== sentToken || (await this.refresh())) {
+        return this.fetch<T>(endpoint, options, false);
+      }
+    }
+
     const data = await res.json();
     if (!res.ok) throw new Error(data.detail || 'Error');
     return data;
@@ -46,7 +98,7 @@ class Api {
       method: 'POST',
       body: JSON.stringify({ email, password, name }),
     });
-    this.setToken(res.access_token);
+    this.setToken(res.access_token, res.refresh_token);
     return res;
   }
 
@@ -55,7 +107,7 @@ class Api {
       method: 'POST',
       body: JSON.stringify({ email, password }),
     });
-    this.setToken(res.access_token);
+    this.setToken(res.access_token, res.refresh_token);
     return res;
   }
 
@@ -64,6 +116,9 @@ class Api {
   }
 
   logout() {
+    if (this.token) {
+      this.fetch<any>('/auth/logout', { method: 'POST' }, false).catch(() => {});
+    }
     this.setToken(null);
   }
 
@@ -0,0 +1,45 @@
+"""Shared setup: the backend is imported against a throwaway database.
+
+Tests that touch MongoDB take the ``mongo`` fixture and are skipped when no
+server is reachable at MONGO_URL (default localhost); the rest run anywhere.
+"""
+
+import asyncio
+import os
+import sys
+import uuid
+from pathlib import Path
+
+import pytest
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ["DB_NAME"] = f"cenny_grosz_test_{uuid.uuid4().hex[:8]}"
+os.environ.setdefault("JWT_SECRET", "test-secret-for-the-backend-test-suite")
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+
+@pytest.fixture(scope="session")
+def run():
+    """Run a coroutine to completion. One loop serves the whole session, since
+    Motor and the module-level locks bind to the first loop they see."""
+    loop = asyncio.new_event_loop()
+    yield loop.run_until_complete
+    loop.close()
+
+
+@pytest.fixture(scope="session")
+def mongo(run):
+    """The backend's database with indexes created; dropped after the session"""
+    try:
+        MongoClient(os.environ["MONGO_URL"], serverSelectionTimeoutMS=1000).admin.command("ping")
+    except PyMongoError:
+        pytest.skip("MongoDB is not reachable")
+
+    import server
+
+    run(server.create_indexes())
+    yield server.db
+    run(server.client.drop_database(os.environ["DB_NAME"]))
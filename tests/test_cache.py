@@ -0,0 +1,85 @@
+"""Caches shared between requests and workers"""
+
+import asyncio
+from datetime import datetime, timedelta
+
+import server
+
+
+def test_invalidation_during_fill_is_not_overwritten():
+    cache = server.TTLCache(maxsize=10, ttl=60)
+
+    generation = cache.generation("u1")
+    cache.pop("u1")  # the value changes while the fill reads the old one
+    cache.set("u1", "stale", generation)
+    assert cache.get("u1") is None
+
+    generation = cache.generation("u1")
+    cache.set("u1", "fresh", generation)
+    assert cache.get("u1") == "fresh"
+
+
+def test_clear_during_fill_is_not_overwritten():
+    cache = server.TTLCache(maxsize=10, ttl=60)
+    generation = cache.generation("u1")
+    cache.clear()
+    cache.set("u1", "stale", generation)
+    assert cache.get("u1") is None
+
+
+def two_workers():
+    """Two workers' buses wired to one broker, as the in-memory backend allows"""
+    broker = []
+    return server.InvalidationBus(broker), server.InvalidationBus(broker)
+
+
+def test_shared_cache_invalidation_reaches_other_worker(run):
+    bus_a, bus_b = two_workers()
+    cache_a = server.SharedCache("users", maxsize=10, ttl=60, bus=bus_a)
+    cache_b = server.SharedCache("users", maxsize=10, ttl=60, bus=bus_b)
+    other = server.SharedCache("wallet_access", maxsize=10, ttl=60, bus=bus_b)
+    for cache in (cache_a, cache_b, other):
+        cache.set("u1", "cached")
+        cache.set("u2", "cached")
+
+    run(cache_a.invalidate("u1"))
+
+    assert cache_a.get("u1") is None
+    assert cache_b.get("u1") is None
+    assert cache_b.get("u2") == "cached"
+    assert other.get("u1") == "cached"
+
+
+def test_revocation_reaches_other_worker(mongo, run):
+    bus_a, bus_b = two_workers()
+    revoked_a = server.RevocationList(1000, bus_a)
+    revoked_b = server.RevocationList(1000, bus_b)
+    expires_at = datetime.utcnow() + timedelta(hours=1)
+
+    assert run(revoked_a.revoke("sid-1", expires_at))
+
+    assert "sid-1" in revoked_b._filter
+    assert run(revoked_b.is_revoked("sid-1"))
+    assert not run(revoked_b.is_revoked("sid-2"))
+
+
+def test_clear_all_drops_caches_and_reloads_revocations(mongo, run):
+    bus_a, bus_b = two_workers()
+    cache_b = server.SharedCache("users", maxsize=10, ttl=60, bus=bus_b)
+    revoked_b = server.RevocationList(1000, bus_b)
+    cache_b.set("u1", "cached")
+    # A revocation whose message worker B never received
+    run(mongo.revoked_tokens.insert_one({"_id": "sid-missed", "expires_at": datetime.utcnow() + timedelta(hours=1)}))
+    assert "sid-missed" not in revoked_b._filter
+
+    async def reconnect():
+        bus_b.clear_all()
+        for _ in range(100):
+            if "sid-missed" in revoked_b._filter:
+                return
+            await asyncio.sleep(0.01)
+
+    run(reconnect())
+
+    assert cache_b.get("u1") is None
+    assert "sid-missed" in revoked_b._filter
@@ -0,0 +1,47 @@
+"""Nightly forecasts and anomaly scores"""
+
+import numpy as np
+import pytest
+
+import server
+
+
+def test_forecast_blends_baseline_and_pace():
+    history = np.array([[100.0, 100.0, 100.0], [0.0, 0.0, 0.0]])
+    spent = np.array([50.0, 30.0])
+
+    baseline, forecast = server.forecast_categories(history, spent, elapsed=0.5)
+
+    assert baseline.tolist() == [100.0, 0.0]
+    # On pace with the baseline: the month ends at the baseline
+    assert forecast[0] == pytest.approx(100)
+    # No history: the rest of the month is half pace, half nothing
+    assert forecast[1] == pytest.approx(30 + 0.5 * (0.5 * 60))
+
+
+def test_forecast_uses_same_month_last_year():
+    history = np.full((1, 12), 100.0)
+    history[0, 0] = 300.0
+
+    baseline, forecast = server.forecast_categories(history, np.array([0.0]), elapsed=0.0)
+
+    assert baseline[0] == pytest.approx(200)
+    assert forecast[0] == pytest.approx(200)
+
+
+def test_outlier_scores_high_against_the_rest_of_its_category():
+    amounts = np.array([100, 110, 90, 105, 95, 100, 1000, 5000, 20], dtype=float)
+    groups = np.array([0, 0, 0, 0, 0, 0, 0, 1, 1])
+
+    z, typical = server.anomaly_scores(amounts, groups)
+
+    assert z[6] > server.INSIGHTS_ANOMALY_Z
+    assert np.all(np.abs(z[:6]) < server.INSIGHTS_ANOMALY_Z)
+    assert typical[6] == pytest.approx(100, rel=0.05)
+    # Too few other samples in the category to judge
+    assert np.isnan(z[7:]).all()
+
+
+def test_category_without_spread_is_not_scored():
+    z, _ = server.anomaly_scores(np.full(7, 100.0), np.zeros(7, dtype=int))
+    assert np.isnan(z).all()
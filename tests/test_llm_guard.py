@@ -0,0 +1,89 @@
+"""LlmGuard in front of the fake LLM client: caps, timeouts and the circuit breaker"""
+
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+import server
+
+
+def guard_for(client: server.FakeLlmClient, max_concurrency: int = 4, max_per_user: int = 1) -> server.LlmGuard:
+    return server.LlmGuard(lambda: client, max_concurrency, max_per_user)
+
+
+async def outcomes(*calls):
+    return await asyncio.gather(*calls, return_exceptions=True)
+
+
+def test_second_question_of_a_user_in_flight_is_rejected(run):
+    client = server.FakeLlmClient(delay=0.05)
+
+    async def ask_three():
+        guard = guard_for(client)
+        return await outcomes(guard.ask("u1", "", "a"), guard.ask("u1", "", "b"), guard.ask("u2", "", "c"))
+
+    first, second, other_user = run(ask_three())
+
+    assert first == "To jest testowa odpowiedź na: a"
+    assert isinstance(second, HTTPException) and second.status_code == 429
+    assert other_user == "To jest testowa odpowiedź na: c"
+    assert client.calls == 2
+
+
+def test_request_waiting_too_long_for_a_slot_is_turned_away(run, monkeypatch):
+    monkeypatch.setattr(server, "LLM_QUEUE_TIMEOUT", 0.01)
+    client = server.FakeLlmClient(delay=0.1)
+
+    async def ask_two():
+        guard = guard_for(client, max_concurrency=1)
+        return guard, await outcomes(guard.ask("u1", "", "a"), guard.ask("u2", "", "b"))
+
+    guard, (first, queued) = run(ask_two())
+
+    assert first == "To jest testowa odpowiedź na: a"
+    assert isinstance(queued, server.LlmUnavailable)
+    assert client.calls == 1
+    # Being busy is not the upstream's fault
+    assert guard.breaker.failures == 0
+    assert guard.in_flight == 0
+
+
+def test_slow_upstream_times_out_and_counts_as_failure(run, monkeypatch):
+    monkeypatch.setattr(server, "LLM_TIMEOUT", 0.01)
+    guard = guard_for(server.FakeLlmClient(delay=1))
+
+    with pytest.raises(server.LlmUnavailable):
+        run(guard.ask("u1", "", "a"))
+
+    assert guard.breaker.failures == 1
+    assert guard.in_flight == 0
+
+
+def test_breaker_opens_then_closes_after_a_single_successful_probe(run):
+    client = server.FakeLlmClient(fail=True)
+    guard = guard_for(client)
+    guard.breaker = server.CircuitBreaker(failure_threshold=2, reset_seconds=0.05)
+
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            run(guard.ask("u1", "", "a"))
+    assert guard.breaker.state == "open"
+
+    # While open, nothing reaches the upstream
+    with pytest.raises(server.LlmUnavailable):
+        run(guard.ask("u1", "", "a"))
+    assert client.calls == 2
+
+    run(asyncio.sleep(0.06))
+    assert guard.breaker.state == "half_open"
+
+    # Only one probe goes through while it is in flight
+    client.fail, client.delay = False, 0.05
+    probe, other = run(outcomes(guard.ask("u1", "", "a"), guard.ask("u2", "", "b")))
+    assert probe == "To jest testowa odpowiedź na: a"
+    assert isinstance(other, server.LlmUnavailable)
+    assert client.calls == 3
+
+    assert guard.breaker.state == "closed"
+    assert run(guard.ask("u2", "", "b")) == "To jest testowa odpowiedź na: b"
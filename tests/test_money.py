@@ -0,0 +1,19 @@
+"""Conversion of API amounts to integer grosze"""
+
+import pytest
+from fastapi import HTTPException
+
+import server
+
+
+def test_amounts_round_half_up_to_grosze():
+    assert server.to_minor(12.345) == 1235
+    assert server.to_minor(0.1 + 0.2) == 30
+    assert server.to_minor(-5) == -500
+
+
+@pytest.mark.parametrize("amount", [float("nan"), float("inf"), float("-inf"), 1e300])
+def test_amounts_that_are_not_money_are_rejected(amount):
+    with pytest.raises(HTTPException) as error:
+        server.to_minor(amount)
+    assert error.value.status_code == 400
@@ -0,0 +1,42 @@
+"""In-process token buckets"""
+
+from types import SimpleNamespace
+
+import pytest
+
+import server
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(server, "time", SimpleNamespace(monotonic=lambda: clock.now))
+    return clock
+
+
+def test_bucket_empties_then_refills(run, clock):
+    limiter = server.RateLimiter(max_keys=100, idle_seconds=60)
+    budget = server.RateBudget("test", "2/10", per_user=False)
+
+    assert run(limiter.acquire("ip:1", budget)) == 0
+    assert run(limiter.acquire("ip:1", budget)) == 0
+    assert run(limiter.acquire("ip:1", budget)) == pytest.approx(5)
+    # Another key has its own bucket
+    assert run(limiter.acquire("ip:2", budget)) == 0
+
+    clock.now += 5
+    assert run(limiter.acquire("ip:1", budget)) == 0
+    assert run(limiter.acquire("ip:1", budget)) == pytest.approx(5)
+
+
+def test_idle_and_excess_keys_are_dropped(run, clock):
+    limiter = server.RateLimiter(max_keys=2, idle_seconds=60)
+    budget = server.RateBudget("test", "2/10", per_user=False)
+
+    for key in ("ip:1", "ip:2", "ip:3"):
+        run(limiter.acquire(key, budget))
+    assert len(limiter) == 2
+
+    clock.now += 61
+    run(limiter.acquire("ip:4", budget))
+    assert len(limiter) == 1
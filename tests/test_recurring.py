@@ -0,0 +1,93 @@
+"""Recurring transactions: an interrupted run, repeated, counts every occurrence once"""
+
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+import server
+
+
+def recurring_rule(wallet_id: str, user_id: str, amount: float, tx_type: str, frequency: str, start_at: datetime) -> dict:
+    return {
+        "id": str(uuid.uuid4()),
+        "wallet_id": wallet_id,
+        "user_id": user_id,
+        "amount": server.to_minor(amount),
+        "type": tx_type,
+        "category": "Rachunki",
+        "emoji": "🧾",
+        "note": None,
+        "frequency": frequency,
+        "interval": 1,
+        "anchor_day": start_at.day,
+        "next_run_at": start_at,
+        "end_at": None,
+        "active": True,
+        "lease_until": datetime.min,
+        "created_at": start_at
+    }
+
+
+async def crash_and_rerun(db, monkeypatch, crash_in: str):
+    now = datetime.utcnow().replace(microsecond=0)
+    user_id = str(uuid.uuid4())
+    wallet_id = str(uuid.uuid4())
+    await db.wallets.insert_one({
+        "id": wallet_id,
+        "name": "Test",
+        "owner_id": user_id,
+        "members": [],
+        "balance": 0,
+        "created_at": now
+    })
+    await db.budgets.insert_one({
+        "id": str(uuid.uuid4()),
+        "user_id": user_id,
+        "wallet_id": wallet_id,
+        "category": "Rachunki",
+        "limit": server.to_minor(1000),
+        "spent": {},
+        "alerted": {},
+        "created_at": now
+    })
+    # Three monthly occurrences are due
+    await db.recurring_rules.insert_one(recurring_rule(wallet_id, user_id, 100, "expense", "monthly", now - timedelta(days=65)))
+
+    # The first run dies inside one step of applying the occurrences
+    async def crash(*args, **kwargs):
+        raise RuntimeError("worker died")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(server, crash_in, crash)
+        with pytest.raises(RuntimeError):
+            await server.materialize_recurring_transactions(now)
+
+    # Another rule for the same wallet is due by the time the lease runs out, so
+    # the re-run batches the wallet's pending occurrences differently
+    await db.recurring_rules.insert_one(recurring_rule(wallet_id, user_id, 50, "income", "weekly", now - timedelta(days=1)))
+    await server.materialize_recurring_transactions(now + timedelta(seconds=server.RECURRING_LEASE_SECONDS + 1))
+
+    wallet = await db.wallets.find_one({"id": wallet_id})
+    budget = await db.budgets.find_one({"wallet_id": wallet_id})
+    transactions = await db.transactions.find({"wallet_id": wallet_id}).to_list(None)
+    rollups = {}
+    async for r in db.rollups.find({"wallet_id": wallet_id}):
+        amount, count = rollups.get(r["type"], (0, 0))
+        rollups[r["type"]] = (amount + r["amount"], count + r["count"])
+    return wallet, budget, transactions, rollups
+
+
+@pytest.mark.parametrize("crash_in", [
+    "apply_transaction_effects",  # after the balance $inc
+    "update_budget_spend",  # after the rollups too
+])
+def test_interrupted_run_applies_each_occurrence_once(mongo, run, monkeypatch, crash_in):
+    wallet, budget, transactions, rollups = run(crash_and_rerun(mongo, monkeypatch, crash_in))
+
+    assert wallet["balance"] == server.to_minor(-300 + 50)
+    assert len(transactions) == 4
+    assert not any("balance_pending" in tx for tx in transactions)
+    assert rollups["expense"] == (server.to_minor(300), 3)
+    assert rollups["income"] == (server.to_minor(50), 1)
+    assert sum(budget["spent"].values()) == server.to_minor(300)
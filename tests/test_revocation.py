@@ -0,0 +1,21 @@
+"""Bloom filter behind the token revocation list"""
+
+import server
+
+
+def test_no_false_negatives_and_few_false_positives():
+    bloom = server.BloomFilter(capacity=1000, error_rate=0.001)
+    revoked = [f"revoked-{i}" for i in range(1000)]
+    for token_id in revoked:
+        bloom.add(token_id)
+
+    assert all(token_id in bloom for token_id in revoked)
+    false_positives = sum(f"valid-{i}" in bloom for i in range(20000))
+    # About 0.1% expected at capacity; allow for hashing noise
+    assert false_positives < 20000 * 0.005
+
+
+def test_empty_filter_contains_nothing():
+    bloom = server.BloomFilter(capacity=10)
+    assert "anything" not in bloom
+    assert bloom.size >= 64 and bloom.hashes >= 1
@@ -0,0 +1,34 @@
+"""Settling up a shared wallet"""
+
+import server
+
+
+def apply(balances: dict, transfers: list) -> dict:
+    result = dict(balances)
+    for debtor, creditor, amount in transfers:
+        assert amount > 0
+        result[debtor] += amount
+        result[creditor] -= amount
+    return result
+
+
+def test_transfers_even_out_every_balance():
+    balances = {"a": 6000, "b": -1000, "c": -2000, "d": -3000, "e": 0}
+
+    transfers = server.settle_up(balances)
+
+    assert all(amount == 0 for amount in apply(balances, transfers).values())
+    assert len(transfers) <= len(balances) - 1
+    assert all(creditor == "a" for _, creditor, _ in transfers)
+
+
+def test_largest_debtor_pays_largest_creditor_first():
+    transfers = server.settle_up({"a": 500, "b": 300, "c": -700, "d": -100})
+
+    assert transfers[0] == ("c", "a", 500)
+    assert sorted(transfers[1:]) == [("c", "b", 200), ("d", "b", 100)]
+
+
+def test_nothing_to_settle():
+    assert server.settle_up({}) == []
+    assert server.settle_up({"a": 0, "b": 0}) == []
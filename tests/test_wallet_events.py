@@ -0,0 +1,57 @@
+"""Wallet event fan-out across workers"""
+
+import json
+
+import server
+
+
+def two_workers():
+    broker = []
+    return server.WalletEventHub(server.InvalidationBus(broker)), server.WalletEventHub(server.InvalidationBus(broker))
+
+
+def received(connection: server.WalletEventConnection) -> list:
+    messages = []
+    while not connection.queue.empty():
+        messages.append(json.loads(connection.queue.get_nowait())["type"])
+    return messages
+
+
+def test_member_removed_on_another_worker_stops_receiving_events(run):
+    hub_a, hub_b = two_workers()
+
+    async def scenario():
+        member = server.WalletEventConnection(None, "member")
+        owner = server.WalletEventConnection(None, "owner")
+        for connection in (member, owner):
+            hub_b.connect(connection)
+            hub_b.subscribe(connection, ["w1"])
+
+        # The member is removed through worker A, then worker B publishes
+        await hub_a.unsubscribe_user("member", "w1")
+        await hub_b.publish("w1", "transaction.created", {})
+        return member, owner
+
+    member, owner = run(scenario())
+
+    assert received(member) == []
+    assert member.wallet_ids == set()
+    assert received(owner) == ["transaction.created"]
+
+
+def test_member_added_on_another_worker_starts_receiving_events(run):
+    hub_a, hub_b = two_workers()
+
+    async def scenario():
+        member = server.WalletEventConnection(None, "member")
+        hub_b.connect(member)
+
+        await hub_a.subscribe_user("member", "w1")
+        await hub_b.publish("w1", "transaction.created", {})
+        await hub_b.publish("w2", "transaction.created", {})
+        return member
+
+    member = run(scenario())
+
+    assert member.wallet_ids == {"w1"}
+    assert received(member) == ["transaction.created"]